@@ -0,0 +1,110 @@
+"""
+Per-tenant upload latency while one tenant bulk-uploads.
+
+Simulates the upload pipeline as a shared backend that slows down with
+concurrency (processor sharing over --capacity slots, --service seconds per
+upload alone). One noisy tenant fires --burst uploads at once while --quiet
+tenants each upload one document at a time. Runs the mix without admission
+control and then through admission.acquire, and reports p50/p99 per kind of
+tenant plus how many uploads were refused. With admission the quiet tenants'
+p99 should stay near the service time however large the burst.
+
+Usage (from backend/):
+    python benchmarks/admission_overload.py --burst 400 --quiet 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "src"))
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float("nan")
+
+
+class SharedBackend:
+    """ Every upload in progress shares capacity slots; alone, one takes `service` seconds. """
+
+    def __init__(self, capacity: int, service: float):
+        self.capacity = capacity
+        self.service = service
+        self.active = 0
+
+    async def process(self):
+        self.active += 1
+        try:
+            remaining = self.service
+            while remaining > 0:
+                step = min(remaining, 0.01)
+                await asyncio.sleep(step * max(1, self.active / self.capacity))
+                remaining -= step
+        finally:
+            self.active -= 1
+
+
+async def run(admitted: bool, burst: int, quiet: int, quiet_uploads: int, capacity: int, service: float) -> dict:
+    import admission
+
+    backend = SharedBackend(capacity, service)
+    admission.buckets = admission.MemoryBuckets()
+    admission.gate = admission.Gate()
+    latencies = {"noisy": [], "quiet": []}
+    outcomes = Counter()
+
+    async def upload(kind: str, organization_id: str):
+        started = time.perf_counter()
+        if admitted:
+            try:
+                slot = await admission.acquire("upload", organization_id)
+            except admission.Rejected:
+                outcomes[f"{kind}_refused"] += 1
+                return
+        try:
+            await backend.process()
+        finally:
+            if admitted:
+                slot.release()
+        outcomes[f"{kind}_done"] += 1
+        latencies[kind].append(time.perf_counter() - started)
+
+    async def quiet_tenant(index: int):
+        for _ in range(quiet_uploads):
+            await upload("quiet", f"quiet-{index}")
+            await asyncio.sleep(service / 2)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(upload("noisy", "noisy") for _ in range(burst)),
+        *(quiet_tenant(index) for index in range(quiet)),
+    )
+    return {"seconds": time.perf_counter() - started, "latencies": latencies, "outcomes": dict(outcomes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-tenant upload latency under a bulk-upload burst.")
+    parser.add_argument("--burst", type=int, default=400)
+    parser.add_argument("--quiet", type=int, default=4)
+    parser.add_argument("--quiet-uploads", type=int, default=10)
+    parser.add_argument("--capacity", type=int, default=8, help="uploads the backend runs at full speed")
+    parser.add_argument("--service", type=float, default=0.1, help="seconds per upload on an idle backend")
+    args = parser.parse_args()
+
+    # the burst is what's being measured, so the noisy tenant's bucket doesn't cut it short
+    os.environ.setdefault("ADMISSION_UPLOAD_BURST", str(args.burst))
+    os.environ.setdefault("ADMISSION_MAX_IN_FLIGHT", str(args.capacity))
+    for admitted in (False, True):
+        result = asyncio.run(run(admitted, args.burst, args.quiet, args.quiet_uploads, args.capacity, args.service))
+        print(f"{'admission' if admitted else 'no admission'}: {result['seconds']:.1f} s {result['outcomes']}")
+        for kind, latencies in result["latencies"].items():
+            print(f"  {kind:<6} {len(latencies):>5} uploads  p50 {percentile(latencies, 0.5) * 1000:>8.1f} ms  "
+                  f"p99 {percentile(latencies, 0.99) * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Login latency under a credential-stuffing burst.
+
+Seeds a scratch database, then fires --attempts wrong-password logins from
+--attackers concurrent clients spread over --ips addresses, while one client
+keeps logging in a real user and another keeps calling GET /. Reports how the
+burst was answered and p50/p99 for the legitimate traffic, which should stay
+flat: refused attempts cost no hashing, and the rest wait in a bounded pool.
+
+Usage (from backend/):
+    python benchmarks/login_burst.py --attempts 2000 --attackers 64
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "src"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(attempts: int, attackers: int, ips: int) -> dict:
+    import httpx
+    from sqlalchemy import select
+    import database
+    import main
+    import schema
+    import synthetic_data
+
+    dataset = synthetic_data.generate(1, 50, 0)
+    victim = dataset["admins"][0]
+    with database.SessionLocal() as session:
+        staff = [email for email in session.scalars(select(schema.User.email)) if email != victim]
+    # real accounts cost a hash per guess; unknown ones are answered from the lookup
+    targets = staff + [f"user{index}@unknown.example.com" for index in range(len(staff))]
+    clients = {
+        address: httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app, client=(address, 1234)),
+                                   base_url="http://bench")
+        for address in [f"203.0.113.{index}" for index in range(ips)] + ["198.51.100.1"]
+    }
+    attacker_addresses = list(clients)[:-1]
+    user = clients["198.51.100.1"]
+    statuses = Counter()
+    remaining = attempts
+    done = asyncio.Event()
+
+    async def attacker(rng: random.Random):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            client = clients[rng.choice(attacker_addresses)]
+            response = await client.post("/auth/login", json={"email": rng.choice(targets), "password": "guess"})
+            statuses[response.status_code if response.status_code != 200 else "wrong_password"] += 1
+
+    async def measure(request) -> list:
+        latencies = []
+        while not done.is_set():
+            started = time.perf_counter()
+            response = await request()
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code in (200, 503), response.text
+            await asyncio.sleep(0.005)
+        return latencies
+
+    logins = asyncio.create_task(measure(
+        lambda: user.post("/auth/login", json={"email": victim, "password": dataset["password"]})
+    ))
+    pings = asyncio.create_task(measure(lambda: user.get("/")))
+    started = time.perf_counter()
+    await asyncio.gather(*(attacker(random.Random(seed)) for seed in range(attackers)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    login_latencies, ping_latencies = await logins, await pings
+    for client in clients.values():
+        await client.aclose()
+    return {
+        "burst_seconds": elapsed,
+        "statuses": dict(statuses),
+        "login": login_latencies,
+        "ping": ping_latencies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure login latency during a credential-stuffing burst.")
+    parser.add_argument("--attempts", type=int, default=2000)
+    parser.add_argument("--attackers", type=int, default=64)
+    parser.add_argument("--ips", type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="carelumi-login-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.chdir(workdir)
+
+    result = asyncio.run(run(args.attempts, args.attackers, args.ips))
+    print(f"{args.attempts} attempts in {result['burst_seconds']:.1f} s: {result['statuses']}")
+    for name in ("login", "ping"):
+        latencies = result[name]
+        print(f"{name:<6} {len(latencies):>5} requests  p50 {percentile(latencies, 0.5) * 1000:>8.2f} ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:>8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare plain-JSON and packed storage of a large synthetic extraction result.
+
+Builds a Landing AI style response with many chunks, grounding boxes and
+marginalia, then reports the stored size and the time to get the markdown, one
+page's chunks and the whole result back, for JSON and each available codec.
+
+Usage (from backend/):
+    python benchmarks/processed_storage.py --chunks 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "src"))
+
+
+def synthetic_extraction(chunks: int, rng: random.Random) -> dict:
+    words = ["employee", "training", "signature", "facility", "date", "supervisor", "policy", "completed", "form"]
+    items, markdown = [], []
+    for number in range(chunks):
+        chunk_id = "%08x-%04x-%04x-%04x-%012x" % tuple(rng.getrandbits(bits) for bits in (32, 16, 16, 16, 48))
+        chunk_type = rng.choice(["text", "marginalia", "table", "figure"])
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(8, 60)))
+        page = number // 20
+        items.append({
+            "text": text,
+            "chunk_type": chunk_type,
+            "chunk_id": chunk_id,
+            "grounding": [{
+                "page": page,
+                "box": {key: round(rng.random(), 6) for key in ("l", "t", "r", "b")},
+            }],
+        })
+        markdown.append(f"<!-- {chunk_type}, from page {page} (l=0.1,t=0.2,r=0.9,b=0.3), with ID {chunk_id} -->\n{text}")
+    return {
+        "data": {"markdown": "\n\n".join(markdown), "chunks": items},
+        "errors": [],
+        "extraction_error": None,
+        "metadata": {"filename": "synthetic.pdf", "page_count": chunks // 20, "version": "v1"},
+    }
+
+
+def best_of(repeat: int, operation) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain-JSON and packed extraction storage.")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import processed_format
+    from processed_format import BytesSource
+
+    result = synthetic_extraction(args.chunks, random.Random(args.seed))
+    stored = json.dumps(result).encode("utf-8")
+    formats = [("json", stored)]
+    codecs = [("zlib", processed_format.CODEC_ZLIB)]
+    if processed_format._zstd() is not None:
+        codecs.append(("zstd", processed_format.CODEC_ZSTD))
+    for name, codec in codecs:
+        packed = processed_format.encode(result, codec)
+        assert processed_format.reader(BytesSource(packed)).to_dict() == processed_format.JsonReader(result).to_dict()
+        formats.append((name, packed))
+
+    print(f"{'format':<6} {'bytes':>10} {'ratio':>7} {'markdown ms':>12} {'page ms':>9} {'full ms':>9}")
+    for name, data in formats:
+        markdown = best_of(args.repeat, lambda: processed_format.reader(BytesSource(data)).markdown())
+        page = best_of(args.repeat, lambda: processed_format.reader(BytesSource(data)).chunks(pages=[3]))
+        full = best_of(args.repeat, lambda: processed_format.reader(BytesSource(data)).to_dict())
+        print(f"{name:<6} {len(data):>10} {len(data) / len(stored):>7.1%} {markdown:>12.2f} {page:>9.2f} {full:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Run time of commands.reconcile_storage against a large synthetic bucket.
+
+Fills a scratch database with synthetic tenants, indexes an object for every
+raw and processed key they refer to in the local S3 stand-in (in memory, no
+files), drops a few objects and adds a few orphans, then reconciles. Each LIST
+call sleeps --latency seconds to stand in for the round trip to S3, so the
+listing time shows what the parallel ranges buy.
+
+Usage (from backend/):
+    python benchmarks/reconcile_scale.py --organizations 200 --users 20 --documents 50
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "src"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a storage reconciliation over a synthetic bucket.")
+    parser.add_argument("--organizations", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20, help="users per organization")
+    parser.add_argument("--documents", type=int, default=50, help="documents per user")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds per LIST call")
+    parser.add_argument("--drift", type=int, default=100, help="objects dropped and orphans added")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="carelumi-reconcile-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.chdir(workdir)
+
+    from sqlalchemy import text
+    import database
+    import local_s3
+    import synthetic_data
+    from commands import reconcile_storage
+    from syncS3 import BUCKET_NAME
+
+    class SlowS3(local_s3.LocalS3):
+        calls = 0
+
+        def list_objects_v2(self, **kwargs):
+            SlowS3.calls += 1
+            time.sleep(args.latency)
+            return super().list_objects_v2(**kwargs)
+
+    started = time.perf_counter()
+    synthetic_data.generate(args.organizations, args.users, args.documents)
+    with database.engine.connect() as conn:
+        keys = [row[0] for row in conn.execute(text(
+            "SELECT substr(s3_key, :start) FROM documents UNION ALL "
+            "SELECT processed_key FROM documents WHERE processed_key IS NOT NULL"
+        ), {"start": len(reconcile_storage.S3_PREFIX) + 1})]
+    rng = random.Random(0)
+    dropped = set(rng.sample(keys, args.drift))
+    client = SlowS3(os.path.join(workdir, "s3"))
+    old = time.time() - 86400
+    # build the index in one sort rather than an insort per key
+    client.keys[BUCKET_NAME] = sorted(
+        [key for key in keys if key not in dropped]
+        + [f"{key.rsplit('/', 1)[0]}/orphan-{index}.pdf" for index, key in enumerate(rng.sample(keys, args.drift))]
+    )
+    client.meta = {(BUCKET_NAME, key): (1024, old) for key in client.keys[BUCKET_NAME]}
+    reconcile_storage.get_s3_client = lambda: client
+    print(f"{len(client.keys[BUCKET_NAME])} objects, {len(keys)} references, set up in {time.perf_counter() - started:.1f} s")
+
+    counts = reconcile_storage.reconcile(os.path.join(workdir, "reconcile"), args.workers, 3600, False, False)
+    objects_per_second = counts["objects"] / max(counts["seconds"], 0.1)
+    print(f"{SlowS3.calls} LIST calls at {args.latency * 1000:.0f} ms, {args.workers} workers: "
+          f"listed in {counts['list_seconds']} s, reconciled in {counts['seconds']} s "
+          f"({objects_per_second:,.0f} objects/s, {1_000_000 / objects_per_second / 60:.1f} min per million)")
+    print(f"{counts['missing']} missing (expected {args.drift}), {counts['orphan']} orphans (expected {args.drift})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Compare single-model review with the tiered review against a stub model endpoint.
+
+Starts a local OpenAI-compatible /chat/completions server that answers with canned
+verdicts after a per-model delay, points the review at it through LLM_BASE_URL, and
+reviews a synthetic mix of forms both ways. Reports which tier decided each form,
+mean latency per document and estimated cost per document.
+
+Usage (from backend/):
+    python benchmarks/review_tiers.py --documents 200
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "src"))
+
+SMALL_DELAY = 0.03
+LARGE_DELAY = 0.12
+
+
+class StubModelHandler(BaseHTTPRequestHandler):
+    """ Minimal OpenAI-compatible chat completion endpoint with deterministic verdicts. """
+    usage = Counter()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        model = body["model"]
+        text = body["messages"][-1]["content"]
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+        # a stable pseudo-random confidence per document
+        confidence = int(hashlib.sha256(text.encode()).hexdigest()[:4], 16) / 0xFFFF
+        verdict = {"correct": "____" not in text, "reasoning": "Checked every field."}
+        if "confidence" in json.dumps(body.get("response_format", {})):
+            verdict["confidence"] = round(0.5 + confidence / 2, 3)
+        content = json.dumps(verdict)
+        completion_tokens = len(content) // 4
+        with self.lock:
+            self.usage[(model, "prompt")] += prompt_tokens
+            self.usage[(model, "completion")] += completion_tokens
+        time.sleep(LARGE_DELAY if "lite" not in model else SMALL_DELAY)
+        payload = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubModelHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_form(rng: random.Random) -> str:
+    """ A Landing AI style markdown form; some complete, some with blanks. """
+    fields = ["Employee Name", "Date", "Signature", "Position", "Facility", "Supervisor", "Notes"]
+    kind = rng.choices(["complete", "blank_required", "blank_optional", "prose"], [5, 2, 2, 1])[0]
+    lines = ["<!-- text, from page 0 (l=0.1,t=0.1), with ID %08x -->" % rng.getrandbits(32), "# Staff Training Record"]
+    for name in fields[:rng.randint(3, len(fields))]:
+        value = f"value {rng.randint(1, 999)}"
+        if kind == "blank_required" and name in ("Signature", "Date") or kind == "blank_optional" and name == "Notes":
+            value = "____"
+        lines.append(f"{name}: {value}")
+    if kind == "prose":
+        lines = lines[:2] + ["The employee attended the session and the form was reviewed by the supervisor."]
+    return "\n".join(lines)
+
+
+def run(documents: int, tiers: tuple, forms: list) -> dict:
+    import metering
+    import review
+
+    StubModelHandler.usage.clear()
+    config = review.ReviewConfig(tiers=tiers)
+    latencies, deciding = [], Counter()
+    for form in forms:
+        started = time.perf_counter()
+        _, tier = review.review_document(form, config)
+        latencies.append(time.perf_counter() - started)
+        deciding[tier] += 1
+    models = {model for model, _ in StubModelHandler.usage}
+    cost = sum(
+        metering.cost_micros("gemini", model, prompt_tokens=StubModelHandler.usage[(model, "prompt")],
+                             completion_tokens=StubModelHandler.usage[(model, "completion")])
+        for model in models
+    )
+    return {
+        "tiers": dict(deciding),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "cost_per_document_usd": cost / metering.MICROS / documents,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-model and tiered document review.")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = start_stub_server()
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/"
+    os.environ["LLM_CACHE"] = "off"
+    os.environ.setdefault("GEMINI_API_KEY", "stub")
+
+    rng = random.Random(args.seed)
+    forms = [synthetic_form(rng) for _ in range(args.documents)]
+    for name, tiers in (("single model", ("large",)), ("tiered", ("heuristics", "small", "large"))):
+        result = run(args.documents, tiers, forms)
+        print(f"{name:<14} mean {result['mean_ms']:>8.2f} ms/doc  "
+              f"${result['cost_per_document_usd']:.7f}/doc  decided by {result['tiers']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
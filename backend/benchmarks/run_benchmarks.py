@@ -0,0 +1,252 @@
+"""
+In-process benchmark harness for the FastAPI app.
+
+Builds a synthetic multi-tenant database in a scratch directory, drives the app through
+TestClient with S3, extraction, notification and LLM calls replaced by local stubs, and
+reports throughput, p50/p99 latency and SQL statements per request. Each run is written to
+benchmarks/results/ and compared with the previous run so regressions show up between versions.
+
+Usage (from backend/):
+    python benchmarks/run_benchmarks.py --organizations 500 --requests 200
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tomllib
+from datetime import datetime, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+sys.path.insert(0, os.path.join(BACKEND_DIR, "src"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+STUB_MARKDOWN = "<!-- section -->\nName: Jane Doe\nDate: 2024-01-01\nSignature: Jane Doe\n"
+
+
+def sample_pdf() -> bytes:
+    """ A one-page PDF that passes the upload preflight. """
+    import io
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    writer.add_blank_page(612, 792)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def install_stubs():
+    """ Replace every network-bound dependency of the upload pipeline with a local stub. """
+    import schema
+    import pipeline
+    import previews
+    import review
+
+    def upload_to_s3(file_obj, bucket_name, s3_key):
+        return f"s3://{bucket_name}/{s3_key}"
+
+    pipeline.upload_to_s3 = upload_to_s3
+    previews.upload_to_s3 = upload_to_s3
+    pipeline.upload_parts_to_s3 = upload_to_s3
+    pipeline.get_document_text = lambda path: {"data": {"markdown": STUB_MARKDOWN}}
+    pipeline.notify_data_extraction = lambda *args, **kwargs: None
+
+    def complete(document_text, system_prompt=None, model=None, response_format=schema.LanguageModelResponse):
+        fields = {"correct": True, "reasoning": "stub", "confidence": 0.95}
+        return response_format(**{name: fields[name] for name in response_format.model_fields})
+
+    review.complete = complete
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "after_cursor_execute", self._increment)
+
+    def _increment(self, *args):
+        self.count += 1
+
+
+def run_scenario(name, requests, counter, make_request):
+    latencies = []
+    errors = 0
+    queries_before = counter.count
+    started = time.perf_counter()
+    for index in range(requests):
+        start = time.perf_counter()
+        response = make_request(index)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    result = {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "queries_per_request": round((counter.count - queries_before) / requests, 2),
+    }
+    print(f"{name:<22} {result['throughput_rps']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f} ms  "
+          f"p99 {result['p99_ms']:>8.2f} ms  {result['queries_per_request']:>6.1f} queries/req  "
+          f"{errors} errors")
+    return result
+
+
+def run(organizations: int, users: int, documents: int, requests: int, seed: int) -> dict:
+    from fastapi.testclient import TestClient
+    import database
+    import synthetic_data
+    import main
+
+    install_stubs()
+    dataset = synthetic_data.generate(organizations, users, documents, seed)
+    counter = QueryCounter(database.engine)
+    with TestClient(main.app) as client:
+        results = run_scenarios(client, dataset, requests, counter, random.Random(seed))
+    return {
+        "dataset": {"organizations": organizations, "users": users, "documents": documents, "seed": seed},
+        "scenarios": results,
+    }
+
+
+def run_scenarios(client, dataset: dict, requests: int, counter: QueryCounter, rng: random.Random) -> dict:
+    import database
+
+    admins = dataset["admins"]
+    pdf_bytes = sample_pdf()
+
+    def login(email):
+        response = client.post("/auth/login", json={"email": email, "password": dataset["password"]})
+        return response.json()["session_token"]
+
+    sample = [rng.choice(admins) for _ in range(min(requests, 50))]
+    tokens = [str(login(email)) for email in sample]
+    with database.engine.connect() as conn:
+        from sqlalchemy import text
+        folder_ids = [row[0] for row in conn.execute(text("SELECT id FROM folders LIMIT 1000"))]
+
+    def headers(index):
+        return {"token": tokens[index % len(tokens)]}
+
+    scenarios = {
+        "login": lambda i: client.post(
+            "/auth/login", json={"email": sample[i % len(sample)], "password": dataset["password"]}
+        ),
+        "documents_all": lambda i: client.get("/organization/document/all", headers=headers(i)),
+        "folders_all": lambda i: client.get("/organization/folder/all", headers=headers(i)),
+        "folder": lambda i: client.get(f"/organization/folder/{folder_ids[i % len(folder_ids)]}", headers=headers(i)),
+        "folder_previews": lambda i: client.get(
+            f"/organization/folder/{folder_ids[i % len(folder_ids)]}/previews", headers=headers(i)
+        ),
+        "compliance_folders": lambda i: client.get("/organization/compliance-folders", headers=headers(i)),
+        "compliance_gaps": lambda i: client.get("/organization/compliance/gaps", headers=headers(i)),
+        "upload_document": lambda i: client.post(
+            "/organization/document/upload_document",
+            params={"name": f"Benchmark upload {i}", "document_type": "other"},
+            files={"file": ("upload.pdf", pdf_bytes, "application/pdf")},
+            headers=headers(i),
+        ),
+    }
+    return {name: run_scenario(name, requests, counter, make_request) for name, make_request in scenarios.items()}
+
+
+def project_version() -> str:
+    with open(os.path.join(BACKEND_DIR, "pyproject.toml"), "rb") as f:
+        return tomllib.load(f)["project"]["version"]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_result(dataset: dict):
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    for name in sorted(os.listdir(RESULTS_DIR), reverse=True):
+        with open(os.path.join(RESULTS_DIR, name)) as f:
+            result = json.load(f)
+        if result.get("dataset") == dataset:
+            return result
+    return None
+
+
+def compare(current: dict, previous: dict, threshold: float) -> list:
+    """ Return the scenarios whose p50 latency regressed by more than threshold. """
+    regressions = []
+    print(f"\nCompared with {previous['version']} ({previous['commit']}, {previous['timestamp']}):")
+    for name, result in current["scenarios"].items():
+        before = previous["scenarios"].get(name)
+        if not before:
+            continue
+        change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] if before["p50_ms"] else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:<22} p50 {before['p50_ms']:>8.2f} -> {result['p50_ms']:>8.2f} ms ({change:+.1%})  "
+              f"queries {before['queries_per_request']} -> {result['queries_per_request']}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API in-process against synthetic tenants.")
+    parser.add_argument("--organizations", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20, help="users per organization")
+    parser.add_argument("--documents", type=int, default=5, help="documents per user")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 slowdown reported as a regression")
+    parser.add_argument("--no-save", action="store_true", help="don't write the result to benchmarks/results")
+    args = parser.parse_args()
+
+    # keep the database and data/ uploads out of the working tree
+    workdir = tempfile.mkdtemp(prefix="carelumi-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.chdir(workdir)
+    # every request comes from the one TestClient address
+    os.environ.setdefault("LOGIN_IP_ATTEMPTS", "0")
+    # uploads are timed back to back from few organizations; admission_overload.py covers the limits
+    os.environ.setdefault("ADMISSION_UPLOAD_RATE", "0")
+    # the synthetic PENDING documents aren't interrupted uploads
+    os.environ.setdefault("RECOVERY", "off")
+
+    result = {
+        "version": project_version(),
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
+        **run(args.organizations, args.users, args.documents, args.requests, args.seed),
+    }
+    previous = previous_result(result["dataset"])
+    regressions = compare(result, previous, args.threshold) if previous else []
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{result['timestamp']}-{result['commit']}.json")
+        with open(path, "w") as f:
+            json.dump(result, f, indent=4)
+        print(f"\nSaved {path}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
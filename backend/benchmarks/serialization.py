@@ -0,0 +1,92 @@
+"""
+Serialization cost of a document listing, per 10k documents.
+
+Seeds one organization with the requested number of documents in a scratch
+database, then times the read path of GET /organization/document/all three ways:
+
+    orm       ORM objects through jsonable_encoder and json.dumps (the old route)
+    rows      row tuples validated by the response model and dumped by pydantic-core,
+              which is what FastAPI does for a route with a response_model
+    orjson    row tuples validated by the response model and rendered with orjson,
+              for FastAPI versions without the pydantic-core fast path
+
+Usage (from backend/):
+    python benchmarks/serialization.py --documents 10000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "src"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+
+def best_of(repeat: int, operation) -> tuple:
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = operation()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare document listing serialization paths.")
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="carelumi-serialization-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.chdir(workdir)
+
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    import database
+    import database_operations
+    import schema
+    import synthetic_data
+
+    synthetic_data.generate(1, 1, args.documents)
+    session = database.SessionLocal()
+    organization_id = session.query(schema.Organization.id).scalar()
+    listing = TypeAdapter(list[schema.DocumentResponse])
+
+    def orm():
+        session.expunge_all()
+        documents = session.query(schema.Document).filter(schema.Document.organization_id == organization_id).all()
+        return json.dumps(jsonable_encoder(documents)).encode("utf-8")
+
+    def rows():
+        documents = database_operations.get_documents_by_organization(session, organization_id)
+        return listing.dump_json(listing.validate_python(documents))
+
+    paths = [("orm", orm), ("rows", rows)]
+    try:
+        import orjson
+
+        def rows_orjson():
+            documents = database_operations.get_documents_by_organization(session, organization_id)
+            return orjson.dumps(listing.dump_python(listing.validate_python(documents), mode="json"))
+
+        paths.append(("orjson", rows_orjson))
+    except ImportError:
+        pass
+
+    scale = 10000 / args.documents
+    baseline = None
+    print(f"{'path':<8} {'ms / 10k docs':>14} {'speedup':>8} {'bytes':>10}")
+    for name, operation in paths:
+        seconds, body = best_of(args.repeat, operation)
+        baseline = baseline or seconds
+        assert len(json.loads(body)) == args.documents
+        print(f"{name:<8} {seconds * scale * 1000:>14.1f} {baseline / seconds:>7.1f}x {len(body):>10}")
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
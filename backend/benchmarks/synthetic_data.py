@@ -0,0 +1,123 @@
+"""
+Synthetic multi-tenant data for load tests and benchmarks.
+
+Usage (from backend/):
+    DATABASE_URL=sqlite:///bench.db python benchmarks/synthetic_data.py --organizations 1000
+"""
+import argparse
+import os
+import random
+import sys
+import uuid
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from sqlalchemy import insert
+import database
+import passwords
+import schema
+
+FIRST_NAMES = ["Alice", "Max", "Jamie", "Priya", "Diego", "Mei", "Sam", "Noor", "Liam", "Ava", "Kofi", "Ines"]
+LAST_NAMES = ["Scott", "Smith", "Garcia", "Patel", "Nguyen", "Okafor", "Kim", "Rossi", "Cohen", "Silva"]
+DOCUMENT_NAMES = ["Training Certificate", "Background Check", "CPR Certification", "TB Test", "Health Form"]
+STAFF_ROLES = [role for role in schema.Role if role not in (schema.Role.ADMIN, schema.Role.DIRECTOR)]
+
+PASSWORD = "password"
+
+
+def _user_row(organization_id: str, index: int, permission: schema.Permission, role: schema.Role,
+              password_hash: str) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "first_name": random.choice(FIRST_NAMES),
+        "last_name": random.choice(LAST_NAMES),
+        "email": f"user{index}@{organization_id[:8]}.example.com",
+        "password": password_hash,
+        "role": role,
+        "permission": permission,
+        "organization_id": organization_id,
+    }
+
+
+def generate(organizations: int, users_per_organization: int, documents_per_user: int, seed: int = 0,
+             batch_size: int = 5000) -> dict:
+    """
+    Insert synthetic organizations with one admin and n-1 staff each, a folder per user and
+    documents per folder. Returns one admin email per organization for driving logins.
+    """
+    random.seed(seed)
+    now = schema.utcnow()
+    # one hash shared by every synthetic user; hashing each would dominate the run
+    password_hash = passwords.hash_password(PASSWORD)
+    database.init_db()
+    rows = {"organizations": [], "users": [], "folders": [], "documents": []}
+    admins = []
+    totals = dict.fromkeys(rows, 0)
+
+    def flush(force=False):
+        # parents first so the foreign keys resolve inside each batch
+        if not force and sum(len(batch) for batch in rows.values()) < batch_size:
+            return
+        with database.engine.begin() as conn:
+            for table, model in (("organizations", schema.Organization), ("users", schema.User),
+                                 ("folders", schema.Folder), ("documents", schema.Document)):
+                if rows[table]:
+                    conn.execute(insert(model), rows[table])
+                    totals[table] += len(rows[table])
+                    rows[table] = []
+
+    for _ in range(organizations):
+        organization_id = str(uuid.uuid4())
+        rows["organizations"].append({"id": organization_id, "name": f"Organization {organization_id[:8]}"})
+        for index in range(users_per_organization):
+            if index == 0:
+                user = _user_row(organization_id, index, schema.Permission.ADMIN, schema.Role.ADMIN, password_hash)
+                admins.append(user["email"])
+            else:
+                user = _user_row(
+                    organization_id, index, schema.Permission.STAFF, random.choice(STAFF_ROLES), password_hash
+                )
+            folder_id = str(uuid.uuid4())
+            rows["users"].append(user)
+            rows["folders"].append({
+                "id": folder_id,
+                "name": f"{user['first_name']} {user['last_name']}",
+                "organization_id": organization_id,
+                "user_id": user["id"],
+            })
+            for _ in range(documents_per_user):
+                document_id = str(uuid.uuid4())
+                status = random.choice(list(schema.DocumentStatus))
+                rows["documents"].append({
+                    "id": document_id,
+                    "name": random.choice(DOCUMENT_NAMES),
+                    "link": "",
+                    "s3_key": f"s3://carelumi-data/organization/{organization_id}/{user['id']}/raw_documents/{document_id}.pdf",
+                    "processed_key": None if status == schema.DocumentStatus.PENDING else
+                        f"organization/{organization_id}/{user['id']}/processed_documents/{document_id}.json",
+                    "status": status,
+                    "document_type": random.choice(list(schema.DocumentType)),
+                    "organization_id": organization_id,
+                    "folder_id": folder_id,
+                    "created_at": now - timedelta(days=random.randint(0, 3 * 365)),
+                })
+        flush()
+    flush(force=True)
+    return {"admins": admins, "password": PASSWORD, **totals}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Populate the database with synthetic tenants.")
+    parser.add_argument("--organizations", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=20, help="users per organization")
+    parser.add_argument("--documents", type=int, default=5, help="documents per user")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    result = generate(args.organizations, args.users, args.documents, args.seed)
+    print(f"Inserted {result['organizations']} organizations, {result['users']} users, "
+          f"{result['folders']} folders, {result['documents']} documents into {database.SQLALCHEMY_DATABASE_URL}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Per-tenant latency of the real upload route while one tenant bulk-uploads.
+
+Unlike admission_overload.py, this drives POST
+/organization/document/upload_document end to end: preflight, the document
+row, previews and the whole pipeline. Only the external services are stubbed,
+with blocking calls like the boto3, requests and OpenAI clients make: S3, Landing AI, the
+EC2 notifier and the review model share --capacity slots, and each call takes
+--service seconds on an idle backend. One noisy tenant fires --burst uploads
+at once while --quiet tenants each upload one document at a time and poll
+their folder list. The mix runs without the in-flight gate, then with it, and
+reports p50/p99 per kind of request and the status codes seen.
+
+An upload holds its database sessions until the pipeline finishes, so without
+the gate the burst outgrows the connection pool, and each checkout blocks the
+event loop until DATABASE_POOL_TIMEOUT. Much past 60 uploads, that round takes
+many minutes.
+
+Usage (from backend/):
+    python benchmarks/upload_overload.py --burst 60 --quiet 4
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "src"))
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float("nan")
+
+
+class BlockingBackend:
+    """ External services sharing capacity slots; a call blocks its thread like a real client would. """
+
+    def __init__(self, capacity: int, service: float):
+        self.capacity = capacity
+        self.service = service
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def call(self):
+        with self.lock:
+            self.active += 1
+        try:
+            remaining = self.service
+            while remaining > 0:
+                step = min(remaining, 0.01)
+                time.sleep(step * max(1, self.active / self.capacity))
+                remaining -= step
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def blank_pdf() -> bytes:
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    writer.add_blank_page(612, 792)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def stub_services(backend: BlockingBackend):
+    import main
+    import pipeline
+    import previews
+    import previews
+    import review
+    import schema
+
+    def upload(file_obj, bucket, key):
+        backend.call()
+        return f"s3://{bucket}/{key}"
+
+    def extract(path):
+        backend.call()
+        return {"data": {"markdown": "Employee name: Jane Doe\nSignature: \nDate: ", "chunks": []}}
+
+    def complete(*args, **kwargs):
+        backend.call()
+        return schema.ScoredModelResponse(correct=True, reasoning="stub", confidence=0.99)
+
+    pipeline.upload_to_s3 = previews.upload_to_s3 = upload
+    pipeline.upload_parts_to_s3 = lambda parts, bucket, key: upload(None, bucket, key)
+    pipeline.get_document_text = extract
+    pipeline.notify_data_extraction = lambda *args: backend.call()
+    review.complete = complete
+    main.update_by_user = lambda user: None
+
+
+async def register(client, name: str) -> dict:
+    email = f"admin@{name}.example.com"
+    await client.post("/registration/admin", json=dict(
+        first_name="Bench", last_name=name, email=email, organization_name=name, role="admin",
+        password="password", confirm_password="password", agree_to_terms=True,
+    ))
+    response = await client.post("/auth/login", json={"email": email, "password": "password"})
+    return {"token": str(response.json()["session_token"])}
+
+
+async def run(gated: bool, burst: int, quiet: int, quiet_uploads: int, pdf: bytes, round_: int) -> dict:
+    import httpx
+    import admission
+    import main
+    import pipeline
+    import previews
+
+    admission.ROUTES["upload"] = admission.RouteLimit(0, 0, gated)
+    admission.gate = admission.Gate()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app, raise_app_exceptions=False), base_url="http://bench", timeout=None)
+    noisy = await register(client, f"noisy{round_}")
+    quiet_headers = [await register(client, f"quiet{round_}-{index}") for index in range(quiet)]
+    latencies = {"noisy": [], "quiet": [], "quiet_list": []}
+    outcomes = Counter()
+    done = asyncio.Event()
+
+    async def upload(kind: str, headers: dict):
+        started = time.perf_counter()
+        response = await client.post(
+            "/organization/document/upload_document", params={"name": kind},
+            files={"file": ("form.pdf", pdf, "application/pdf")}, headers=headers,
+        )
+        outcomes[f"{kind}_{response.status_code}"] += 1
+        if response.status_code < 300:
+            latencies[kind].append(time.perf_counter() - started)
+
+    async def quiet_tenant(headers: dict):
+        for _ in range(quiet_uploads):
+            await upload("quiet", headers)
+
+    async def poll(headers: dict):
+        while not done.is_set():
+            started = time.perf_counter()
+            response = await client.get("/organization/folder/all", headers=headers)
+            outcomes[f"quiet_list_{response.status_code}"] += 1
+            if response.status_code < 300:
+                latencies["quiet_list"].append(time.perf_counter() - started)
+            await asyncio.sleep(0.05)
+
+    pollers = [asyncio.create_task(poll(headers)) for headers in quiet_headers]
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(upload("noisy", noisy) for _ in range(burst)),
+        *(quiet_tenant(headers) for headers in quiet_headers),
+    )
+    elapsed = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*pollers)
+    # let the background pipelines and previews finish so the next round starts idle
+    while pipeline.in_flight:
+        await asyncio.sleep(0.1)
+    await previews.drain()
+    await client.aclose()
+    return {"seconds": elapsed, "latencies": latencies, "outcomes": dict(outcomes)}
+
+
+async def measure(args) -> list:
+    import main
+
+    pdf = blank_pdf()
+    results = []
+    async with main.lifespan(main.app):
+        # start the preflight and preview workers before anything is timed
+        await run(True, 1, 1, 1, pdf, 0)
+        for round_, gated in enumerate((False, True), start=1):
+            results.append((gated, await run(gated, args.burst, args.quiet, args.quiet_uploads, pdf, round_)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure real upload latency under a bulk-upload burst.")
+    parser.add_argument("--burst", type=int, default=60)
+    parser.add_argument("--quiet", type=int, default=4)
+    parser.add_argument("--quiet-uploads", type=int, default=5)
+    parser.add_argument("--capacity", type=int, default=8, help="calls the stubbed services run at full speed")
+    parser.add_argument("--service", type=float, default=0.05, help="seconds per external call on an idle backend")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="carelumi-upload-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("DATABASE_PROFILE", "production")
+    # every upload holds a connection; without the gate the burst outgrows the pool and a
+    # checkout blocks the event loop until it times out, so give up after 2 s rather than 10
+    os.environ.setdefault("DATABASE_POOL_TIMEOUT", "2")
+    os.environ.setdefault("LOGIN_IP_ATTEMPTS", "0")
+    os.environ.setdefault("RECOVERY", "off")
+    os.environ.setdefault("BACKUP_INTERVAL_SECONDS", "0")
+    os.chdir(workdir)
+    os.makedirs("data", exist_ok=True)
+
+    stub_services(BlockingBackend(args.capacity, args.service))
+    for gated, result in asyncio.run(measure(args)):
+        print(f"{'gate' if gated else 'no gate'}: {result['seconds']:.1f} s {result['outcomes']}")
+        for kind, latencies in result["latencies"].items():
+            print(f"  {kind:<10} {len(latencies):>5} requests  p50 {percentile(latencies, 0.5) * 1000:>8.1f} ms  "
+                  f"p99 {percentile(latencies, 0.99) * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
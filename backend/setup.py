@@ -19,19 +19,31 @@ setup(
     install_requires=[
         "fastapi>=0.68.0",
         "sqlalchemy>=1.4.0",
+        "numpy>=1.26.0",
         "openai>=0.11.0",
         "boto3>=1.18.0",
         "python-dotenv>=0.19.0",
         "requests>=2.26.0",
         "pydantic>=1.8.0",
+        "pypdf>=5.0.0",
     ],
 
     # Command-line tools or scripts
     entry_points={
         'console_scripts': [
             'loading=commands:backend_successful',
+            'seed-demo=commands.seed_demo:main',
         ],
     },
 
+    # First-page previews and thumbnails; uploads still work without them
+    extras_require={
+        "previews": ["pypdfium2>=4.0.0", "pillow>=10.0.0"],
+        # zstd for packed extraction results; zlib is used without it
+        "zstd": ["zstandard>=0.22.0"],
+        # orjson responses on FastAPI versions that don't serialize response models in pydantic-core
+        "fast-json": ["orjson>=3.9.0"],
+    },
+
     python_requires='>=3.6',  # Minimum Python version required
 )
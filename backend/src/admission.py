@@ -0,0 +1,248 @@
+"""
+Admission control for expensive routes.
+
+Each route has a token bucket per organization: RATE requests per second with
+bursts of up to BURST. Routes that run the upload pipeline also pass a global
+gate of ADMISSION_MAX_IN_FLIGHT concurrent requests per process. Up to
+ADMISSION_QUEUE more wait for a slot, first come first served, and no
+organization holds more than ADMISSION_ORG_IN_FLIGHT slots, so one tenant's
+bulk upload can't take every slot. A request that finds the queue full, or
+waits longer than ADMISSION_QUEUE_TIMEOUT, is refused at once with a
+Retry-After estimated from recent hold times, which keeps every tenant's tail
+latency bounded by the queue rather than by the backlog.
+
+Buckets live in memory by default. ADMISSION_BACKEND=sqlite keeps them in
+ADMISSION_DB_PATH instead, so every worker process on the host draws from the
+same buckets; the in-flight gate stays per process.
+"""
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import closing
+from dataclasses import dataclass
+import metrics
+
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")
+ADMISSION_DB_PATH = os.getenv("ADMISSION_DB_PATH", "data/admission.db")
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8"))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", "16"))
+ADMISSION_ORG_IN_FLIGHT = int(os.getenv("ADMISSION_ORG_IN_FLIGHT", str(max(1, ADMISSION_MAX_IN_FLIGHT // 2))))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_TRACKED_KEYS = int(os.getenv("ADMISSION_TRACKED_KEYS", "100000"))
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    rate: float  # tokens added per second; 0 disables the bucket
+    burst: float
+    gated: bool  # also passes the in-flight gate
+
+
+ROUTES = {
+    "upload": RouteLimit(
+        float(os.getenv("ADMISSION_UPLOAD_RATE", "1")), float(os.getenv("ADMISSION_UPLOAD_BURST", "20")), True
+    ),
+    "export": RouteLimit(
+        float(os.getenv("ADMISSION_EXPORT_RATE", str(1 / 60))), float(os.getenv("ADMISSION_EXPORT_BURST", "3")), False
+    ),
+}
+
+decisions = metrics.REGISTRY.register(metrics.Counter(
+    "admission_decisions_total", "Requests to limited routes by outcome.", ("route", "outcome")
+))
+waited = metrics.REGISTRY.register(metrics.Histogram(
+    "admission_wait_seconds", "Time admitted requests waited for an in-flight slot.", ("route",)
+))
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def _refill(tokens: float, updated: float, now: float, limit: RouteLimit) -> float:
+    return min(limit.burst, tokens + (now - updated) * limit.rate)
+
+
+def _wait_for(tokens: float, limit: RouteLimit) -> int:
+    return max(1, math.ceil((1 - tokens) / limit.rate))
+
+
+class MemoryBuckets:
+    """ Token buckets in this process, oldest keys dropped beyond max_keys. """
+
+    def __init__(self, max_keys: int = ADMISSION_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key: str, limit: RouteLimit) -> int:
+        """ Take a token; returns 0, or the seconds until one is available. """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (limit.burst, now))
+            tokens = _refill(tokens, updated, now, limit)
+            retry_after = 0 if tokens >= 1 else _wait_for(tokens, limit)
+            self.buckets[key] = (tokens - 1 if not retry_after else tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return retry_after
+
+
+class SqliteBuckets:
+    """ Token buckets in a SQLite file shared by the worker processes on a host. """
+
+    def __init__(self, path: str = ADMISSION_DB_PATH):
+        self.path = path
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _setup(self):
+        with self.lock:
+            if self.ready:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with closing(self._connect()) as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+                )
+            self.ready = True
+
+    def take(self, key: str, limit: RouteLimit) -> int:
+        self._setup()
+        # wall clock, since the processes don't share a monotonic one
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = _refill(*row, now, limit) if row else limit.burst
+                retry_after = 0 if tokens >= 1 else _wait_for(tokens, limit)
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens - 1 if not retry_after else tokens, now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return retry_after
+
+
+class Gate:
+    """
+    At most max_in_flight holders and max_waiting waiters, at most per_org
+    holders per organization. Waiters are woken in arrival order, skipping
+    those whose organization is at its share. Only used from the event loop.
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_waiting: int = ADMISSION_QUEUE,
+                 per_org: int = ADMISSION_ORG_IN_FLIGHT, timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.per_org = per_org
+        self.timeout = timeout
+        self.in_flight = 0
+        self.by_org = {}
+        self.waiters = deque()
+        # moving average of how long a slot is held, for Retry-After
+        self.hold_seconds = 1.0
+
+    def _can_enter(self, organization_id: str) -> bool:
+        return self.in_flight < self.max_in_flight and self.by_org.get(organization_id, 0) < self.per_org
+
+    def _enter(self, organization_id: str):
+        self.in_flight += 1
+        self.by_org[organization_id] = self.by_org.get(organization_id, 0) + 1
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.hold_seconds * (len(self.waiters) + 1) / self.max_in_flight))
+
+    async def acquire(self, organization_id: str):
+        # a waiter that could enter is woken by release at once, so nobody queued is overtaken here
+        if self._can_enter(organization_id):
+            self._enter(organization_id)
+            return
+        if len(self.waiters) >= self.max_waiting:
+            raise Rejected("Server is at capacity", self.retry_after())
+        waiter = (organization_id, asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), self.timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            raise Rejected("Timed out waiting for capacity", self.retry_after())
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter):
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+        elif waiter[1].done() and not waiter[1].cancelled():
+            # the slot was handed over just as the wait ended; pass it on
+            self.release(waiter[0], None)
+
+    def release(self, organization_id: str, held: float = None):
+        if held is not None:
+            self.hold_seconds = 0.8 * self.hold_seconds + 0.2 * held
+        self.in_flight -= 1
+        self.by_org[organization_id] -= 1
+        if not self.by_org[organization_id]:
+            del self.by_org[organization_id]
+        for waiter in list(self.waiters):
+            if not self._can_enter(waiter[0]):
+                continue
+            self.waiters.remove(waiter)
+            self._enter(waiter[0])
+            waiter[1].set_result(None)
+
+
+class Slot:
+    def __init__(self, gate, organization_id: str):
+        self.gate = gate
+        self.organization_id = organization_id
+        self.started = time.monotonic()
+
+    def release(self):
+        if self.gate is not None:
+            self.gate.release(self.organization_id, time.monotonic() - self.started)
+            self.gate = None
+
+
+buckets = SqliteBuckets() if ADMISSION_BACKEND == "sqlite" else MemoryBuckets()
+gate = Gate()
+
+
+async def acquire(route: str, organization_id: str) -> Slot:
+    """ Admit a request to route for organization_id, or raise Rejected. Release the slot when done. """
+    limit = ROUTES[route]
+    if limit.rate > 0:
+        retry_after = buckets.take(f"{route}:{organization_id}", limit)
+        if retry_after:
+            decisions.inc(route, "rate_limited")
+            raise Rejected("Organization is over its request rate for this route", retry_after)
+    if not limit.gated or ADMISSION_MAX_IN_FLIGHT <= 0:
+        decisions.inc(route, "admitted")
+        return Slot(None, organization_id)
+    started = time.monotonic()
+    try:
+        await gate.acquire(organization_id)
+    except Rejected:
+        decisions.inc(route, "shed")
+        raise
+    waited.observe(time.monotonic() - started, route)
+    decisions.inc(route, "admitted")
+    return Slot(gate, organization_id)
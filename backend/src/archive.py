@@ -0,0 +1,192 @@
+"""
+Cold storage for finished documents that only matter as history.
+
+A document is archived once it is finished (not pending or queued), older
+than ARCHIVE_AFTER_DAYS, and either not complete or superseded by a newer
+complete document of the same type in its folder. Compliance only looks at the
+latest document of each type, so it never needs an archived one. The raw and
+processed objects are copied onto themselves in ARCHIVE_STORAGE_CLASS, so every
+key stays valid, and storage_tier becomes "archived". Default listings and the
+compliance report leave archived rows out, and the partial indexes they use
+only cover live rows. Previews stay in STANDARD; they are smaller than the
+minimum billable size of the archive classes.
+
+restore() rehydrates a document on demand. Objects in an instant-access class
+(GLACIER_IR, the *_IA classes) are copied back to STANDARD at once. GLACIER and
+DEEP_ARCHIVE objects need a restore request first, and the document stays
+"restoring" until S3 has made a temporary copy; calling restore() again, or
+`commands.archive_documents restore-pending`, finishes the job.
+"""
+import asyncio
+import os
+from datetime import timedelta
+from sqlalchemy import and_, exists, select, tuple_, update
+from sqlalchemy.orm import Session, aliased
+import database
+import schema
+from syncS3 import BUCKET_NAME, get_s3_client, parse_s3_path
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_STORAGE_CLASS = os.getenv("ARCHIVE_STORAGE_CLASS", "GLACIER_IR")
+# how long S3 keeps the temporary copy of a GLACIER or DEEP_ARCHIVE object, and how fast it makes it
+ARCHIVE_RESTORE_DAYS = int(os.getenv("ARCHIVE_RESTORE_DAYS", "7"))
+ARCHIVE_RESTORE_TIER = os.getenv("ARCHIVE_RESTORE_TIER", "Standard")
+
+ARCHIVED = "archived"
+RESTORING = "restoring"
+STANDARD = "STANDARD"
+# classes that can't be read until a restore request completes
+DEEP_CLASSES = {"GLACIER", "DEEP_ARCHIVE"}
+FINISHED = [status for status in schema.DocumentStatus
+            if status not in (schema.DocumentStatus.PENDING, schema.DocumentStatus.QUEUED)]
+
+
+def object_keys(document) -> list:
+    """ Keys of the raw and processed objects of a document row. """
+    keys = []
+    if document.s3_key:
+        bucket, key = parse_s3_path(document.s3_key)
+        if bucket == BUCKET_NAME:
+            keys.append(key)
+    if document.processed_key:
+        keys.append(document.processed_key)
+    return keys
+
+
+def candidates(session: Session, cutoff, organization_id: str = None, limit: int = 500) -> list:
+    """ Live documents eligible for archiving, oldest first. """
+    document = schema.Document
+    newer = aliased(schema.Document)
+    superseded = exists().where(and_(
+        newer.folder_id == document.folder_id,
+        newer.document_type == document.document_type,
+        newer.status == schema.DocumentStatus.COMPLETE,
+        newer.created_at > document.created_at,
+    ))
+    query = (
+        select(document.id, document.organization_id, document.version, document.s3_key, document.processed_key)
+        .where(document.storage_tier.is_(None))
+        .where(document.status.in_(FINISHED))
+        .where(document.created_at < cutoff)
+        .where((document.status != schema.DocumentStatus.COMPLETE) | superseded)
+    )
+    if organization_id is not None:
+        query = query.where(document.organization_id == organization_id)
+    return list(session.execute(query.order_by(document.created_at).limit(limit)).all())
+
+
+def set_storage_class(key: str, storage_class: str):
+    get_s3_client().copy_object(
+        Bucket=BUCKET_NAME, Key=key, CopySource={"Bucket": BUCKET_NAME, "Key": key},
+        StorageClass=storage_class, MetadataDirective="COPY",
+    )
+
+
+def archive_batch(session: Session, rows: list, pool) -> tuple:
+    """
+    Mark rows archived, unless they changed since they were read, then move
+    their objects. Returns (archived, failed); a row none of whose objects
+    could be moved goes back to hot.
+    """
+    document = schema.Document
+    marked = set(session.execute(
+        update(document)
+        .where(document.storage_tier.is_(None))
+        .where(tuple_(document.id, document.version).in_([(row.id, row.version) for row in rows]))
+        .values(storage_tier=ARCHIVED, archived_at=schema.utcnow())
+        .returning(document.id),
+        execution_options={"synchronize_session": False},
+    ).scalars())
+    session.commit()
+    rows = [row for row in rows if row.id in marked]
+
+    def move(row) -> int:
+        """ How many objects were moved before the first failure, or -1 when all were. """
+        keys = object_keys(row)
+        for moved, key in enumerate(keys):
+            try:
+                set_storage_class(key, ARCHIVE_STORAGE_CLASS)
+            except Exception as e:
+                print(f"Failed to archive document {row.id}: {e}")
+                return moved
+        return -1
+
+    results = list(pool.map(move, rows))
+    # a document with some objects moved stays archived, and restore() brings it back whole
+    untouched = [row.id for row, moved in zip(rows, results) if moved == 0]
+    if untouched:
+        session.execute(
+            update(document).where(document.id.in_(untouched)).values(storage_tier=None, archived_at=None),
+            execution_options={"synchronize_session": False},
+        )
+        session.commit()
+    failed = sum(1 for moved in results if moved != -1)
+    return len(rows) - failed, failed
+
+
+def rehydrate(keys: list) -> bool:
+    """ Move objects back to STANDARD, requesting restores where needed. True once all are hot. """
+    s3 = get_s3_client()
+    ready = True
+    for key in keys:
+        head = s3.head_object(Bucket=BUCKET_NAME, Key=key)
+        storage_class = head.get("StorageClass", STANDARD)
+        if storage_class == STANDARD:
+            continue
+        if storage_class in DEEP_CLASSES:
+            restore = head.get("Restore")
+            if restore is None:
+                s3.restore_object(Bucket=BUCKET_NAME, Key=key, RestoreRequest={
+                    "Days": ARCHIVE_RESTORE_DAYS, "GlacierJobParameters": {"Tier": ARCHIVE_RESTORE_TIER},
+                })
+                ready = False
+                continue
+            if 'ongoing-request="true"' in restore:
+                ready = False
+                continue
+        set_storage_class(key, STANDARD)
+    return ready
+
+
+def restored_values(ready: bool) -> dict:
+    return dict(storage_tier=None, archived_at=None) if ready else dict(storage_tier=RESTORING)
+
+
+async def restore(document: schema.Document) -> bool:
+    """ Rehydrate an archived document; True once it is back in hot storage. """
+    ready = await asyncio.to_thread(rehydrate, object_keys(document))
+    document_id = document.id
+
+    def write(session: Session):
+        session.execute(
+            update(schema.Document)
+            .where(schema.Document.id == document_id, schema.Document.storage_tier.is_not(None))
+            .values(**restored_values(ready)),
+            execution_options={"synchronize_session": False},
+        )
+
+    await database.router.run(document.organization_id, write)
+    return ready
+
+
+def restore_pending(session: Session) -> tuple:
+    """ Finish restores whose temporary copies are ready. Returns (restored, still restoring). """
+    document = schema.Document
+    rows = session.execute(
+        select(document.id, document.s3_key, document.processed_key).where(document.storage_tier == RESTORING)
+    ).all()
+    restored = 0
+    for row in rows:
+        if not rehydrate(object_keys(row)):
+            continue
+        session.execute(
+            update(document).where(document.id == row.id, document.storage_tier == RESTORING).values(**restored_values(True)),
+            execution_options={"synchronize_session": False},
+        )
+        session.commit()
+        restored += 1
+    return restored, len(rows) - restored
+
+
+def cutoff(days: int = ARCHIVE_AFTER_DAYS):
+    return schema.utcnow() - timedelta(days=days)
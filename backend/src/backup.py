@@ -0,0 +1,411 @@
+"""
+Online, incremental backups of the SQLite databases.
+
+A snapshot copies each database (the main one and, with sharding, every
+tenant shard) through SQLite's backup API into a scratch file next to it. In
+WAL mode the copy is a single read transaction, which never blocks writers;
+with the default rollback journal it goes BACKUP_STEP_PAGES at a time so
+writers get the lock in between, and falls back to one step once writes have
+restarted it BACKUP_MAX_RESTARTS times. Each database is copied on its own, so
+a snapshot is consistent within each database but not across them: a shard
+may be a little newer than the main database, and a shard created after the
+snapshot started is left to the next one. The copy is cut into BACKUP_CHUNK_BYTES
+chunks stored under their sha256 (chunks/ab/abcd...), so a snapshot only
+uploads the chunks that changed since any earlier one. A manifest
+(snapshots/<id>.json) listing every database's size, checksum and chunks is
+written last, so a snapshot either exists whole or not at all.
+
+BACKUP_TARGET is a local directory or s3://bucket/prefix; S3 goes through
+syncS3.get_s3_client(), so S3_ENDPOINT_URL (MinIO and friends) and
+S3_LOCAL_ROOT apply. Only the newest BACKUP_KEEP snapshots are kept, and
+chunks no kept snapshot refers to are deleted. A restore fetches the distinct
+chunks in parallel, checks every chunk and the whole file against the
+manifest, runs PRAGMA quick_check, and only then swaps the file in; there is
+no log to replay, so its time only grows with the size of the database.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import database
+import metrics
+from syncS3 import get_s3_client, parse_s3_path
+
+BACKUP_TARGET = os.getenv("BACKUP_TARGET", "data/backups")
+# 0 turns the schedule off; snapshots before a reset and from the command still happen
+BACKUP_INTERVAL_SECONDS = int(os.getenv("BACKUP_INTERVAL_SECONDS", "3600"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "48"))
+BACKUP_CHUNK_BYTES = int(os.getenv("BACKUP_CHUNK_BYTES", str(4 * 1024 * 1024)))
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+BACKUP_WORKERS = int(os.getenv("BACKUP_WORKERS", "8"))
+BACKUP_BEFORE_RESET = os.getenv("BACKUP_BEFORE_RESET", "on")
+BACKUP_LOCK = os.getenv("BACKUP_LOCK", "data/backup.lock")
+
+MAIN = "main"
+
+runs = metrics.REGISTRY.register(metrics.Counter(
+    "backup_runs_total", "Database snapshots, by why they were taken and outcome.", ("reason", "outcome")
+))
+uploaded_bytes = metrics.REGISTRY.register(metrics.Counter(
+    "backup_uploaded_bytes_total", "Compressed chunk bytes written to the backup target.", ()
+))
+one_step_copies = metrics.REGISTRY.register(metrics.Counter(
+    "backup_one_step_copies_total", "Stepped copies that kept restarting and were redone in one step.", ()
+))
+duration = metrics.REGISTRY.register(metrics.Histogram(
+    "backup_duration_seconds", "Time to take a snapshot of every database.", (),
+    buckets=(1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0),
+))
+
+_task = None
+
+
+class BackupError(Exception):
+    pass
+
+
+class LocalTarget:
+    def __init__(self, root: str):
+        self.root = root
+
+    def put(self, name: str, data: bytes):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, name: str) -> bytes:
+        with open(os.path.join(self.root, name), "rb") as f:
+            return f.read()
+
+    def list(self, prefix: str) -> list:
+        base = os.path.join(self.root, prefix)
+        if not os.path.isdir(base):
+            return []
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, "/")
+            for directory, _, files in os.walk(base) for name in files if not name.endswith(".tmp")
+        )
+
+    def delete(self, names: list):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+
+
+class S3Target:
+    def __init__(self, bucket: str, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def put(self, name: str, data: bytes):
+        get_s3_client().put_object(Bucket=self.bucket, Key=self.prefix + name, Body=data)
+
+    def get(self, name: str) -> bytes:
+        return get_s3_client().get_object(Bucket=self.bucket, Key=self.prefix + name)["Body"].read()
+
+    def list(self, prefix: str) -> list:
+        names, token = [], None
+        while True:
+            kwargs = {"ContinuationToken": token} if token else {}
+            page = get_s3_client().list_objects_v2(Bucket=self.bucket, Prefix=self.prefix + prefix, **kwargs)
+            names.extend(item["Key"][len(self.prefix):] for item in page.get("Contents", []))
+            if not page.get("IsTruncated"):
+                return names
+            token = page["NextContinuationToken"]
+
+    def delete(self, names: list):
+        for start in range(0, len(names), 1000):
+            get_s3_client().delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": self.prefix + name} for name in names[start:start + 1000]],
+            })
+
+
+def target(location: str = None):
+    location = location or BACKUP_TARGET
+    if location.startswith("s3://"):
+        return S3Target(*parse_s3_path(location))
+    return LocalTarget(location)
+
+
+def chunk_name(digest: str) -> str:
+    return f"chunks/{digest[:2]}/{digest}"
+
+
+def databases() -> dict:
+    """ Name -> path of every database file to back up. """
+    paths = {MAIN: database.engine.url.database}
+    for organization_id in database.router.organization_ids():
+        paths[organization_id] = database.router.shard_path(organization_id)
+    return paths
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _restart_limit(limit: int):
+    """ A backup progress callback that aborts the copy after `limit` restarts. """
+    last = None
+    restarts = 0
+
+    def progress(status, remaining, total):
+        nonlocal last, restarts
+        # a write from another connection sends the copy back to the first page
+        if last is not None and remaining >= last:
+            restarts += 1
+            if restarts > limit:
+                raise _Restarted()
+        last = remaining
+
+    return progress
+
+
+def copy_online(path: str, destination: str):
+    """ Copy a live database with the backup API, holding writers up as little as it can. """
+    source = sqlite3.connect(path, timeout=30)
+    copy = sqlite3.connect(destination)
+    try:
+        # a WAL reader sees one snapshot and never blocks writers, so copy it in one step
+        if source.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            source.backup(copy)
+            return
+        # otherwise hand the lock back between steps; a write in between restarts the copy,
+        # so under steady writes it might never finish. Past BACKUP_MAX_RESTARTS, copy in one
+        # step, which holds writers off for the length of the copy
+        try:
+            source.backup(
+                copy, pages=BACKUP_STEP_PAGES, progress=_restart_limit(BACKUP_MAX_RESTARTS), sleep=BACKUP_STEP_SLEEP
+            )
+        except _Restarted:
+            one_step_copies.inc()
+            source.backup(copy)
+    finally:
+        copy.close()
+        source.close()
+
+
+def store(store_target, path: str, known: set, pool) -> dict:
+    """ Upload the chunks of a database file the target doesn't have yet. Returns its manifest entry. """
+    chunks, pending, whole = [], [], hashlib.sha256()
+    written = 0
+    with open(path, "rb") as f:
+        while data := f.read(BACKUP_CHUNK_BYTES):
+            whole.update(data)
+            digest = hashlib.sha256(data).hexdigest()
+            chunks.append(digest)
+            if digest in known:
+                continue
+            known.add(digest)
+            body = zlib.compress(data, 1)
+            pending.append(pool.submit(store_target.put, chunk_name(digest), body))
+            written += len(body)
+            # keep only a few chunks in memory at a time
+            if len(pending) >= BACKUP_WORKERS * 2:
+                pending.pop(0).result()
+    for future in pending:
+        future.result()
+    uploaded_bytes.inc(amount=written)
+    return {"size": os.path.getsize(path), "sha256": whole.hexdigest(), "chunks": chunks, "uploaded": written}
+
+
+def snapshots(store_target=None) -> list:
+    """ Manifests in the target, oldest first. """
+    store_target = store_target or target()
+    return [json.loads(store_target.get(name)) for name in store_target.list("snapshots/") if name.endswith(".json")]
+
+
+def snapshot(reason: str = "manual", location: str = None, wait: bool = False) -> dict:
+    """
+    Snapshot every database. Returns the manifest, or None when nothing
+    changed since the last snapshot or, unless `wait`, when another process
+    is taking one.
+    """
+    os.makedirs(os.path.dirname(BACKUP_LOCK) or ".", exist_ok=True)
+    with open(BACKUP_LOCK, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            runs.inc(reason, "busy")
+            return None
+        started = time.perf_counter()
+        try:
+            manifest = _snapshot(reason, target(location))
+        except Exception:
+            runs.inc(reason, "failed")
+            raise
+        duration.observe(time.perf_counter() - started)
+        runs.inc(reason, "unchanged" if manifest is None else "ok")
+        return manifest
+
+
+def _snapshot(reason: str, store_target) -> dict:
+    existing = store_target.list("chunks/")
+    known = {name.rsplit("/", 1)[1] for name in existing}
+    previous = snapshots(store_target)
+    entries = {}
+    with ThreadPoolExecutor(max_workers=BACKUP_WORKERS) as pool:
+        for name, path in databases().items():
+            if not path or not os.path.exists(path):
+                continue
+            fd, scratch = tempfile.mkstemp(prefix=".backup-", suffix=".db", dir=os.path.dirname(os.path.abspath(path)))
+            os.close(fd)
+            try:
+                copy_online(path, scratch)
+                entries[name] = store(store_target, scratch, known, pool)
+            finally:
+                os.remove(scratch)
+    if previous and {name: entry["sha256"] for name, entry in entries.items()} == \
+            {name: entry["sha256"] for name, entry in previous[-1]["databases"].items()}:
+        return None
+    now = datetime.now(timezone.utc)
+    manifest = {
+        "id": now.strftime("%Y%m%dT%H%M%S%fZ"),
+        "created_at": now.isoformat(),
+        "reason": reason,
+        "chunk_bytes": BACKUP_CHUNK_BYTES,
+        "databases": entries,
+    }
+    store_target.put(f"snapshots/{manifest['id']}.json", json.dumps(manifest).encode())
+    prune(store_target, previous + [manifest], existing)
+    return manifest
+
+
+def prune(store_target, manifests: list, chunk_names: list, keep: int = BACKUP_KEEP):
+    """ Delete all but the newest `keep` snapshots, then the chunks none of the kept ones use. """
+    expired, kept = manifests[:-keep], manifests[-keep:]
+    if not expired:
+        return 0
+    store_target.delete([f"snapshots/{manifest['id']}.json" for manifest in expired])
+    used = {digest for manifest in kept for entry in manifest["databases"].values() for digest in entry["chunks"]}
+    store_target.delete([name for name in chunk_names if name.rsplit("/", 1)[1] not in used])
+    return len(expired)
+
+
+def find(snapshot_id: str = None, store_target=None) -> dict:
+    manifests = snapshots(store_target)
+    if not manifests:
+        raise BackupError("No snapshots in the backup target")
+    if snapshot_id is None:
+        return manifests[-1]
+    for manifest in manifests:
+        if manifest["id"] == snapshot_id:
+            return manifest
+    raise BackupError(f"No snapshot {snapshot_id}")
+
+
+def rebuild(store_target, entry: dict, chunk_bytes: int, path: str, pool):
+    """ Write one database of a snapshot to `path`, checking every chunk and the whole file. """
+    offsets = {}
+    for index, digest in enumerate(entry["chunks"]):
+        offsets.setdefault(digest, []).append(index * chunk_bytes)
+
+    with open(path, "wb") as f:
+        f.truncate(entry["size"])
+        fd = f.fileno()
+
+        def fetch(digest: str):
+            try:
+                data = zlib.decompress(store_target.get(chunk_name(digest)))
+            except zlib.error:
+                data = None
+            if data is None or hashlib.sha256(data).hexdigest() != digest:
+                raise BackupError(f"Chunk {digest} is corrupt")
+            for offset in offsets[digest]:
+                os.pwrite(fd, data, offset)
+
+        list(pool.map(fetch, offsets))
+        os.fsync(fd)
+    whole = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(BACKUP_CHUNK_BYTES):
+            whole.update(data)
+    if whole.hexdigest() != entry["sha256"]:
+        raise BackupError(f"{path} does not match the snapshot checksum")
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise BackupError(f"{path} failed the integrity check: {result}")
+
+
+def restore(snapshot_id: str = None, output_dir: str = None, workers: int = BACKUP_WORKERS, location: str = None) -> dict:
+    """
+    Restore a snapshot (the newest by default). With `output_dir` the files go
+    there as main.db and shards/<organization>.db; otherwise they replace the
+    live databases, which must not be in use, and the old files are kept
+    beside them as *.before-restore.
+    """
+    store_target = target(location)
+    manifest = find(snapshot_id, store_target)
+    paths = {}
+    for name in manifest["databases"]:
+        if output_dir:
+            paths[name] = os.path.join(output_dir, "main.db" if name == MAIN else os.path.join("shards", f"{name}.db"))
+        else:
+            paths[name] = database.engine.url.database if name == MAIN else database.router.shard_path(name)
+    staged = {name: f"{path}.restoring" for name, path in paths.items()}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for name, entry in manifest["databases"].items():
+                os.makedirs(os.path.dirname(os.path.abspath(paths[name])), exist_ok=True)
+                rebuild(store_target, entry, manifest["chunk_bytes"], staged[name], pool)
+    except Exception:
+        for path in staged.values():
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    # every file checked out; only now touch the live ones
+    for name, path in paths.items():
+        if os.path.exists(path):
+            os.replace(path, f"{path}.before-restore")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.replace(staged[name], path)
+    return manifest
+
+
+async def schedule():
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_SECONDS)
+        try:
+            manifest = await asyncio.to_thread(snapshot, "scheduled")
+            if manifest is not None:
+                uploaded = sum(entry["uploaded"] for entry in manifest["databases"].values())
+                print(f"Backup {manifest['id']} done, {uploaded} bytes uploaded")
+        except Exception as e:
+            print(f"Scheduled backup failed: {e}")
+
+
+async def before_reset():
+    """ Snapshot ahead of a destructive reset; raises if the snapshot fails. """
+    if BACKUP_BEFORE_RESET == "on":
+        await asyncio.to_thread(snapshot, "reset", wait=True)
+
+
+def start():
+    global _task
+    if BACKUP_INTERVAL_SECONDS > 0:
+        _task = asyncio.create_task(schedule())
+
+
+async def shutdown():
+    if _task is not None and not _task.done():
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
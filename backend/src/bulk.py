@@ -0,0 +1,210 @@
+"""
+Status changes and re-processing for many documents in one request.
+
+Documents are picked by id, optionally with the version the caller last saw,
+or by a filter on folder, type and status within the caller's organization.
+The change is one set-based UPDATE through the tenant's writer, guarded by
+each row's version, so a document changed since it was read is reported as a
+conflict instead of being overwritten. Subscribers get one bulk event rather
+than one per row.
+
+Re-queued documents are set to QUEUED and rewound to the stage before the work
+to redo (pipeline.RAW_STORED for extraction, pipeline.NOTIFIED for review),
+then processed in the background in batches of BULK_BATCH_SIZE, within the
+organization's budget. Whatever the budget doesn't allow stays queued for
+`commands.budgets process-queued`.
+"""
+import asyncio
+import os
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.orm import Session
+import database
+import events
+import metrics
+import pipeline
+import schema
+
+BULK_MAX_DOCUMENTS = int(os.getenv("BULK_MAX_DOCUMENTS", "5000"))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "50"))
+
+# work to redo -> the stage a document is rewound to
+REQUEUE_STAGES = {
+    "extraction": pipeline.RAW_STORED,
+    "review": pipeline.NOTIFIED,
+}
+# statuses owned by the pipeline, which only a requeue may set
+PIPELINE_STATUSES = {schema.DocumentStatus.PENDING, schema.DocumentStatus.QUEUED}
+
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+CONFLICT = "conflict"
+NOT_FOUND = "not_found"
+NOT_READY = "not_ready"
+
+outcomes = metrics.REGISTRY.register(metrics.Counter(
+    "bulk_document_results_total", "Per-document results of bulk operations.", ("operation", "outcome")
+))
+
+_tasks = set()
+
+
+class BulkError(Exception):
+    pass
+
+
+def validate(request: schema.BulkDocumentRequest):
+    if (request.documents is None) == (request.filter is None):
+        raise BulkError("Give either documents or filter")
+    if (request.status is None) == (request.requeue is None):
+        raise BulkError("Give either status or requeue")
+    if request.status in PIPELINE_STATUSES:
+        raise BulkError(f"Status {request.status.value} is set by the pipeline; use requeue")
+    if request.documents is not None and len(request.documents) > BULK_MAX_DOCUMENTS:
+        raise BulkError(f"At most {BULK_MAX_DOCUMENTS} documents per request")
+
+
+def select_targets(session: Session, organization_id: str, request: schema.BulkDocumentRequest) -> list:
+    """ Current (id, version, status, s3_key, processed_key, storage_tier) of the documents the request names. """
+    document = schema.Document
+    query = select(
+        document.id, document.version, document.status, document.s3_key, document.processed_key, document.storage_tier
+    ).where(document.organization_id == organization_id)
+    if request.documents is not None:
+        query = query.where(document.id.in_({ref.id for ref in request.documents}))
+    else:
+        if request.filter.folder_id is not None:
+            query = query.where(document.folder_id == request.filter.folder_id)
+        if request.filter.document_type is not None:
+            query = query.where(document.document_type == request.filter.document_type)
+        if request.filter.status is not None:
+            query = query.where(document.status == request.filter.status)
+    rows = session.execute(query.order_by(document.created_at).limit(BULK_MAX_DOCUMENTS + 1)).all()
+    if len(rows) > BULK_MAX_DOCUMENTS:
+        raise BulkError(f"The filter matches more than {BULK_MAX_DOCUMENTS} documents; narrow it")
+    return rows
+
+
+def plan(request: schema.BulkDocumentRequest, rows: list) -> tuple:
+    """ (results by id, (id, version) pairs to update). """
+    current = {row.id: row for row in rows}
+    expected = {ref.id: ref.version for ref in request.documents} if request.documents is not None else {}
+    order = [ref.id for ref in request.documents] if request.documents is not None else [row.id for row in rows]
+    results, pairs = {}, []
+    for document_id in order:
+        row = current.get(document_id)
+        if row is None:
+            results[document_id] = schema.BulkDocumentResult(id=document_id, outcome=NOT_FOUND)
+            continue
+        result = schema.BulkDocumentResult(id=document_id, outcome=UPDATED, version=row.version, status=row.status)
+        results[document_id] = result
+        if expected.get(document_id) is not None and expected[document_id] != row.version:
+            result.outcome = CONFLICT
+        elif request.requeue == "extraction" and not row.s3_key:
+            result.outcome = NOT_READY
+        elif request.requeue == "review" and not row.processed_key:
+            result.outcome = NOT_READY
+        elif request.requeue and row.storage_tier is not None:
+            # restore it first (see archive.restore)
+            result.outcome = NOT_READY
+        elif row.status in PIPELINE_STATUSES:
+            # already on its way through the pipeline
+            result.outcome = CONFLICT if request.requeue else UNCHANGED
+        elif request.status is not None and row.status == request.status:
+            result.outcome = UNCHANGED
+        else:
+            pairs.append((row.id, row.version))
+    return results, pairs
+
+
+async def apply(session: Session, organization_id: str, request: schema.BulkDocumentRequest) -> schema.BulkDocumentResponse:
+    """ Validate, plan and write the change, publish it, and schedule any requeue. """
+    validate(request)
+    rows = select_targets(session, organization_id, request)
+    # the writer has its own connection; don't hold this one open meanwhile
+    session.close()
+    results, pairs = plan(request, rows)
+    previous = {row.id: row.status for row in rows}
+
+    values = {"version": schema.Document.version + 1}
+    if request.requeue is not None:
+        values.update(
+            status=schema.DocumentStatus.QUEUED,
+            processing_stage=REQUEUE_STAGES[request.requeue],
+            processing_updated_at=schema.utcnow(),
+        )
+    else:
+        values["status"] = request.status
+
+    def write(db: Session) -> list:
+        if not pairs:
+            return []
+        # one statement; a row whose version moved since it was read doesn't match
+        return db.execute(
+            update(schema.Document)
+            .where(schema.Document.organization_id == organization_id)
+            .where(tuple_(schema.Document.id, schema.Document.version).in_(pairs))
+            .values(**values)
+            .returning(schema.Document.id, schema.Document.version, schema.Document.folder_id),
+            execution_options={"synchronize_session": False},
+        ).all()
+
+    updated = await database.router.run(organization_id, write)
+    written = {row.id: row for row in updated}
+    for document_id, _ in pairs:
+        result = results[document_id]
+        if document_id in written:
+            result.version = written[document_id].version
+            result.status = values["status"]
+        else:
+            result.outcome = CONFLICT
+    operation = f"requeue_{request.requeue}" if request.requeue else "status"
+    for result in results.values():
+        outcomes.inc(operation, result.outcome)
+
+    if updated:
+        events.publish_bulk_status(organization_id, values["status"], [
+            {"document_id": row.id, "folder_id": row.folder_id, "previous_status": previous[row.id]}
+            for row in updated
+        ])
+    if request.requeue is not None and updated:
+        schedule(organization_id, [row.id for row in updated])
+    return schema.BulkDocumentResponse(
+        results=list(results.values()),
+        updated=len(updated),
+        requeued=len(updated) if request.requeue is not None else 0,
+    )
+
+
+def schedule(organization_id: str, document_ids: list):
+    """
+    Process re-queued documents in the background, BULK_BATCH_SIZE at a time.
+    The pipeline runs its external calls in threads, so a large requeue
+    doesn't hold up other requests on the event loop.
+    """
+
+    async def run():
+        for start in range(0, len(document_ids), BULK_BATCH_SIZE):
+            if pipeline.draining:
+                return
+            session = (await database.router.open(organization_id)).sessionmaker()
+            try:
+                await pipeline.process_queued(session, organization_id, document_ids[start:start + BULK_BATCH_SIZE])
+            except Exception as e:
+                print(f"Failed to process re-queued documents for {organization_id}: {e}")
+            finally:
+                session.close()
+
+    task = asyncio.create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def shutdown():
+    """
+    Stop re-queued batches once the pipeline has drained (see recovery.shutdown).
+    A document cut short resumes from its checkpoint; the rest stay queued.
+    """
+    for task in list(_tasks):
+        task.cancel()
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
@@ -0,0 +1,213 @@
+"""
+Local document-type classifier: hashed word n-grams and a linear model in NumPy.
+
+Extracted markdown is split into lowercase words; words and word pairs are
+hashed into 2**FEATURE_BITS buckets, counted with sublinear tf and L2
+normalized. A softmax regression over those features is trained from labeled
+extractions (see commands.classify_documents) and saved to
+CLASSIFIER_MODEL_PATH. Everything runs on the CPU with no network, and a batch
+is featurized and scored with a handful of array operations, so a backlog of
+thousands of documents takes seconds once the text is fetched.
+
+Without a model file nothing is classified and uploads keep the type they
+were given.
+"""
+import os
+import re
+import time
+import zlib
+from functools import lru_cache
+import numpy as np
+import metrics
+import schema
+
+CLASSIFIER_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", "data/document_type_model.npz")
+# below this probability the document is filed as OTHER
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.6"))
+FEATURE_BITS = 18
+# the title and first fields name the document type; the rest only adds noise
+MAX_TEXT_CHARS = 20000
+
+# document_type_source values
+USER = "user"
+CLASSIFIER = "classifier"
+
+# Landing AI chunk comments and anchors carry ids, not content
+_MARKUP = re.compile(r"<!--.*?-->|<a id=['\"][^'\"]*['\"]>\s*</a>", re.DOTALL)
+_WORD = re.compile(r"[a-z][a-z0-9]+")
+_PAIR_MULTIPLIER = np.uint64(0x9E3779B1)
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+predictions = metrics.REGISTRY.register(metrics.Counter(
+    "document_type_predictions_total", "Document types assigned by the local classifier.", ("document_type",)
+))
+latency = metrics.REGISTRY.register(metrics.Histogram(
+    "document_type_classify_seconds", "Time to featurize and score one batch of documents.", ()
+))
+
+
+def words(text: str) -> list:
+    return _WORD.findall(_MARKUP.sub(" ", text[:MAX_TEXT_CHARS]).lower())
+
+
+def featurize(texts: list, feature_bits: int = FEATURE_BITS) -> tuple:
+    """
+    Sparse features for texts as (rows, columns, values), sorted by row. Each
+    distinct word is hashed once per batch; pairs are combined from the word
+    hashes arithmetically.
+    """
+    token_lists = [words(text) for text in texts]
+    lengths = np.array([len(tokens) for tokens in token_lists], dtype=np.int64)
+    flat = [token for tokens in token_lists for token in tokens]
+    if not flat:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    codes = {token: zlib.crc32(token.encode("utf-8")) for token in dict.fromkeys(flat)}
+    hashes = np.fromiter(map(codes.__getitem__, flat), dtype=np.uint64, count=len(flat))
+    token_rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+    # a pair never spans two documents
+    same_document = token_rows[1:] == token_rows[:-1]
+    pair_hashes = ((hashes[:-1] * _PAIR_MULTIPLIER) & _MASK32) ^ (hashes[1:] + np.uint64(1))
+    all_hashes = np.concatenate([hashes, pair_hashes[same_document]])
+    all_rows = np.concatenate([token_rows, token_rows[1:][same_document]])
+
+    dimension = 1 << feature_bits
+    columns = (all_hashes & np.uint64(dimension - 1)).astype(np.int64)
+    keys, counts = np.unique(all_rows * dimension + columns, return_counts=True)
+    rows, columns = keys // dimension, keys % dimension
+    values = (1 + np.log(counts)).astype(np.float32)
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(texts)))
+    values /= norms[rows].astype(np.float32)
+    return rows, columns, values
+
+
+def _scores(features: tuple, count: int, weights: np.ndarray, bias: np.ndarray) -> np.ndarray:
+    rows, columns, values = features
+    contributions = weights[columns] * values[:, None]
+    scores = np.empty((count, weights.shape[1]), dtype=np.float64)
+    for label in range(weights.shape[1]):
+        scores[:, label] = np.bincount(rows, weights=contributions[:, label], minlength=count)
+    return scores + bias
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exponentials = np.exp(scores)
+    return exponentials / exponentials.sum(axis=1, keepdims=True)
+
+
+class Model:
+    """ Softmax regression weights over hashed features, one column per document type. """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, classes: list, feature_bits: int = FEATURE_BITS):
+        self.weights = weights
+        self.bias = bias
+        self.classes = [schema.DocumentType(label) for label in classes]
+        self.feature_bits = feature_bits
+
+    def probabilities(self, texts: list) -> np.ndarray:
+        features = featurize(texts, self.feature_bits)
+        return _softmax(_scores(features, len(texts), self.weights, self.bias))
+
+    def predict(self, texts: list, min_confidence: float = CLASSIFIER_MIN_CONFIDENCE) -> list:
+        """
+        (document type, confidence) per text. A best guess below min_confidence
+        is filed as OTHER, with the model's probability for OTHER.
+        """
+        if not texts:
+            return []
+        started = time.perf_counter()
+        probabilities = self.probabilities(texts)
+        best = probabilities.argmax(axis=1)
+        # train() always includes OTHER
+        other = self.classes.index(schema.DocumentType.OTHER)
+        results = []
+        for row, label in enumerate(best):
+            if probabilities[row, label] < min_confidence:
+                label = other
+            document_type = self.classes[label]
+            predictions.inc(document_type.value)
+            results.append((document_type, round(float(probabilities[row, label]), 4)))
+        latency.observe(time.perf_counter() - started)
+        return results
+
+    def save(self, path: str = CLASSIFIER_MODEL_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            temp_path, weights=self.weights, bias=self.bias,
+            classes=np.array([label.value for label in self.classes]), feature_bits=np.array(self.feature_bits)
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str = CLASSIFIER_MODEL_PATH) -> "Model":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["weights"], data["bias"], list(data["classes"]), int(data["feature_bits"]))
+
+
+def train(texts: list, labels: list, epochs: int = 200, learning_rate: float = 0.1, l2: float = 1e-5,
+          feature_bits: int = FEATURE_BITS) -> Model:
+    """
+    Fit softmax regression to labeled texts with full-batch Adam. Types are
+    weighted inversely to their frequency, so a backlog that is mostly OTHER
+    doesn't teach the model to answer OTHER for everything.
+    """
+    classes = sorted({schema.DocumentType(label) for label in labels}, key=list(schema.DocumentType).index)
+    if schema.DocumentType.OTHER not in classes:
+        classes.append(schema.DocumentType.OTHER)
+    targets = np.array([classes.index(schema.DocumentType(label)) for label in labels])
+    count = len(texts)
+    rows, columns, values = featurize(texts, feature_bits)
+    # only buckets seen in training can get a weight, so optimize over those alone
+    used, compact = np.unique(columns, return_inverse=True)
+    features = (rows, compact, values)
+    one_hot = np.zeros((count, len(classes)))
+    one_hot[np.arange(count), targets] = 1
+    frequency = np.bincount(targets, minlength=len(classes))
+    sample_weights = (count / (len(classes) * np.maximum(frequency, 1)))[targets] / count
+
+    weights = np.zeros((len(used), len(classes)))
+    bias = np.zeros(len(classes))
+    moments = [np.zeros_like(weights), np.zeros_like(weights), np.zeros_like(bias), np.zeros_like(bias)]
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    for step in range(1, epochs + 1):
+        errors = (_softmax(_scores(features, count, weights, bias)) - one_hot) * sample_weights[:, None]
+        gradient = np.empty_like(weights)
+        for label in range(len(classes)):
+            gradient[:, label] = np.bincount(compact, weights=values * errors[rows, label], minlength=len(used))
+        gradient += l2 * weights
+        for parameter, grad, first, second in ((weights, gradient, moments[0], moments[1]),
+                                               (bias, errors.sum(axis=0), moments[2], moments[3])):
+            first *= beta1
+            first += (1 - beta1) * grad
+            second *= beta2
+            second += (1 - beta2) * grad * grad
+            parameter -= learning_rate * (first / (1 - beta1 ** step)) / (np.sqrt(second / (1 - beta2 ** step)) + epsilon)
+
+    full = np.zeros((1 << feature_bits, len(classes)), dtype=np.float32)
+    full[used] = weights
+    return Model(full, bias, [label.value for label in classes], feature_bits)
+
+
+@lru_cache(maxsize=None)
+def get_model():
+    """ The saved model, or None when none has been trained. Loaded once per process. """
+    if not os.path.exists(CLASSIFIER_MODEL_PATH):
+        return None
+    return Model.load(CLASSIFIER_MODEL_PATH)
+
+
+def classify(markdown: str):
+    """ (document type, confidence) for one extraction, or None without a model. """
+    model = get_model()
+    if model is None:
+        return None
+    return model.predict([markdown])[0]
+
+
+def initial_source(document_type: schema.DocumentType):
+    """ An uploader who picked a type other than OTHER has labeled the document themselves. """
+    return USER if document_type != schema.DocumentType.OTHER else None
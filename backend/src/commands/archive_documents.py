@@ -0,0 +1,57 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import archive
+import database
+
+
+def archive_all(organization_id: str, days: int, batch_size: int, workers: int, dry_run: bool) -> tuple:
+    """ Archive every eligible document. Returns (archived, failed), or (eligible, 0) for a dry run. """
+    cutoff = archive.cutoff(days)
+    archived = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _, session in database.router.iter_sessions():
+            if dry_run:
+                archived += len(archive.candidates(session, cutoff, organization_id, limit=None))
+                continue
+            while rows := archive.candidates(session, cutoff, organization_id, limit=batch_size):
+                moved, errors = archive.archive_batch(session, rows, pool)
+                archived += moved
+                failed += errors
+                if not moved:
+                    # the rest would fail the same way; try again on the next run
+                    break
+    return archived, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old finished documents to cold storage, or finish restores.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    run = subcommands.add_parser("archive", help="archive superseded or rejected documents past the retention window")
+    run.add_argument("--organization")
+    run.add_argument("--older-than-days", type=int, default=archive.ARCHIVE_AFTER_DAYS)
+    run.add_argument("--batch-size", type=int, default=500)
+    run.add_argument("--workers", type=int, default=16, help="objects moved in parallel")
+    run.add_argument("--dry-run", action="store_true", help="only count the documents that would be archived")
+    subcommands.add_parser("restore-pending", help="finish restores whose objects S3 has made readable")
+    args = parser.parse_args()
+
+    database.init_db()
+    started = time.perf_counter()
+    if args.command == "archive":
+        archived, failed = archive_all(args.organization, args.older_than_days, args.batch_size, args.workers, args.dry_run)
+        verb = "Would archive" if args.dry_run else "Archived"
+        print(f"{verb} {archived} documents to {archive.ARCHIVE_STORAGE_CLASS} in {time.perf_counter() - started:.1f} s"
+              + (f", {failed} failed" if failed else ""))
+    else:
+        restored = waiting = 0
+        for _, session in database.router.iter_sessions():
+            counts = archive.restore_pending(session)
+            restored += counts[0]
+            waiting += counts[1]
+        print(f"Restored {restored} documents, {waiting} still waiting on S3")
+    database.router.close()
+
+
+if __name__ == "__main__":
+    main()
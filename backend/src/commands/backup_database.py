@@ -0,0 +1,44 @@
+import argparse
+import time
+import backup
+import database
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Take, list or restore snapshots of the SQLite databases.")
+    parser.add_argument("--target", help=f"backup directory or s3://bucket/prefix (default {backup.BACKUP_TARGET})")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("snapshot", help="take a snapshot now; safe while the server is running")
+    subcommands.add_parser("list", help="list the snapshots in the target")
+    restore = subcommands.add_parser("restore", help="restore a snapshot; stop the server first unless --output is given")
+    restore.add_argument("--snapshot", help="snapshot id (default: the newest)")
+    restore.add_argument("--output", help="write the databases to this directory instead of replacing the live ones")
+    restore.add_argument("--workers", type=int, default=backup.BACKUP_WORKERS, help="chunks fetched in parallel")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "snapshot":
+        database.init_db()
+        manifest = backup.snapshot("manual", args.target, wait=True)
+        if manifest is None:
+            print("Nothing changed since the last snapshot.")
+        else:
+            uploaded = sum(entry["uploaded"] for entry in manifest["databases"].values())
+            print(f"Snapshot {manifest['id']} of {len(manifest['databases'])} databases in "
+                  f"{time.perf_counter() - started:.1f} s, {uploaded} bytes uploaded")
+    elif args.command == "list":
+        for manifest in backup.snapshots(backup.target(args.target)):
+            size = sum(entry["size"] for entry in manifest["databases"].values())
+            print(f"{manifest['id']}  {manifest['reason']:<9}  {len(manifest['databases']):>4} databases  {size:>14} bytes")
+    else:
+        try:
+            manifest = backup.restore(args.snapshot, args.output, args.workers, args.target)
+        except backup.BackupError as e:
+            raise SystemExit(f"Restore failed: {e}")
+        print(f"Restored snapshot {manifest['id']} ({len(manifest['databases'])} databases) "
+              f"in {time.perf_counter() - started:.1f} s")
+    database.router.close()
+
+
+if __name__ == "__main__":
+    main()
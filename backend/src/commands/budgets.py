@@ -0,0 +1,56 @@
+import argparse
+import asyncio
+import database
+import local_blobs
+import metering
+import pipeline
+import schema
+
+
+def set_budget(organization_id: str, daily: float = None, monthly: float = None,
+               action: schema.BudgetAction = schema.BudgetAction.THROTTLE):
+    """ Set an organization's limits in dollars; None removes that limit. """
+    session = database.router.session_for(organization_id)
+    try:
+        budget = metering.get_budget(session, organization_id) or schema.OrganizationBudget(organization_id=organization_id)
+        budget.daily_limit_micros = round(daily * metering.MICROS) if daily is not None else None
+        budget.monthly_limit_micros = round(monthly * metering.MICROS) if monthly is not None else None
+        budget.action = action
+        session.merge(budget)
+        session.commit()
+    finally:
+        session.close()
+
+
+async def process_all(organization_id: str = None) -> int:
+    processed = 0
+    for _, session in database.router.iter_sessions():
+        processed += await pipeline.process_queued(session, organization_id)
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage per-organization spending on extraction and review.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    limit = subcommands.add_parser("set", help="set an organization's daily and monthly limits in dollars")
+    limit.add_argument("organization")
+    limit.add_argument("--daily", type=float)
+    limit.add_argument("--monthly", type=float)
+    limit.add_argument("--action", choices=[action.value for action in schema.BudgetAction], default="throttle",
+                       help="throttle refuses uploads with 429; queue stores them for later")
+    queued = subcommands.add_parser("process-queued", help="process documents queued while over budget")
+    queued.add_argument("--organization")
+    args = parser.parse_args()
+
+    database.init_db()
+    if args.command == "set":
+        set_budget(args.organization, args.daily, args.monthly, schema.BudgetAction(args.action))
+        print(f"Budget for {args.organization}: daily={args.daily} monthly={args.monthly} action={args.action}")
+    else:
+        local_blobs.rebuild()
+        print(f"Processed {asyncio.run(process_all(args.organization))} queued documents.")
+    database.router.close()
+
+
+if __name__ == "__main__":
+    main()
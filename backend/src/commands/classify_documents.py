@@ -0,0 +1,149 @@
+import argparse
+import json
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import or_, select, update
+import classifier
+import database
+import pipeline
+import schema
+
+
+def markdown_for(key: str) -> str:
+    """ Only the markdown section is fetched from a packed extraction. """
+    return pipeline.open_processed(key).markdown()
+
+
+def fetch_texts(pool: ThreadPoolExecutor, keys: list) -> list:
+    return list(pool.map(markdown_for, keys))
+
+
+def labeled_documents(session) -> list:
+    """ (processed_key, document_type) for every extraction whose type a user set. """
+    return list(session.execute(
+        select(schema.Document.processed_key, schema.Document.document_type)
+        .where(schema.Document.document_type_source == classifier.USER)
+        .where(schema.Document.processed_key.is_not(None))
+    ).all())
+
+
+def load_labels(path: str) -> tuple:
+    """ Extra examples from a JSON-lines file of {"text": ..., "document_type": ...}. """
+    texts, labels = [], []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                example = json.loads(line)
+                texts.append(example["text"])
+                labels.append(schema.DocumentType(example["document_type"]))
+    return texts, labels
+
+
+def train(workers: int, labels_path: str = None, holdout: float = 0.2, output: str = classifier.CLASSIFIER_MODEL_PATH):
+    texts, labels = load_labels(labels_path) if labels_path else ([], [])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _, session in database.router.iter_sessions():
+            rows = labeled_documents(session)
+            texts += fetch_texts(pool, [key for key, _ in rows])
+            labels += [document_type for _, document_type in rows]
+    if not texts:
+        raise SystemExit("No labeled extractions to train from.")
+    print(f"Training on {len(texts)} examples: {dict(Counter(label.value for label in labels))}")
+
+    order = list(range(len(texts)))
+    random.Random(0).shuffle(order)
+    split = int(len(order) * holdout)
+    if split:
+        held_out, kept = order[:split], order[split:]
+        model = classifier.train([texts[i] for i in kept], [labels[i] for i in kept])
+        predicted = model.predict([texts[i] for i in held_out], min_confidence=0)
+        correct = sum(predicted_type == labels[i] for (predicted_type, _), i in zip(predicted, held_out))
+        print(f"Held-out accuracy: {correct}/{len(held_out)} ({correct / len(held_out):.1%})")
+    # the saved model learns from every example
+    model = classifier.train(texts, labels)
+    model.save(output)
+    classifier.get_model.cache_clear()
+    print(f"Saved model to {output}")
+
+
+def pending(session, organization_id: str = None) -> list:
+    """ Extracted documents whose type no user has set. """
+    query = (
+        select(schema.Document.id, schema.Document.processed_key)
+        .where(schema.Document.processed_key.is_not(None))
+        .where(or_(schema.Document.document_type_source.is_(None),
+                   schema.Document.document_type_source != classifier.USER))
+    )
+    if organization_id:
+        query = query.where(schema.Document.organization_id == organization_id)
+    return list(session.execute(query).all())
+
+
+def reclassify_session(session, model: classifier.Model, pool: ThreadPoolExecutor, organization_id: str = None,
+                       batch_size: int = 500, dry_run: bool = False) -> Counter:
+    counts = Counter()
+    rows = pending(session, organization_id)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        predictions = model.predict(fetch_texts(pool, [key for _, key in batch]))
+        counts.update(document_type.value for document_type, _ in predictions)
+        if dry_run:
+            continue
+        # one executemany per batch; a user override that landed meanwhile is left alone
+        session.execute(
+            update(schema.Document)
+            .where(or_(schema.Document.document_type_source.is_(None),
+                       schema.Document.document_type_source != classifier.USER))
+            # a bulk change planned against the old type must see a conflict (see bulk.apply)
+            .values(version=schema.Document.version + 1),
+            [
+                {"id": document_id, "document_type": document_type, "document_type_confidence": confidence,
+                 "document_type_source": classifier.CLASSIFIER}
+                for (document_id, _), (document_type, confidence) in zip(batch, predictions)
+            ],
+            execution_options={"synchronize_session": None},
+        )
+        session.commit()
+    return counts
+
+
+def reclassify(workers: int, organization_id: str = None, batch_size: int = 500, dry_run: bool = False) -> Counter:
+    model = classifier.get_model()
+    if model is None:
+        raise SystemExit(f"No model at {classifier.CLASSIFIER_MODEL_PATH}; run the train command first.")
+    counts = Counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _, session in database.router.iter_sessions():
+            counts += reclassify_session(session, model, pool, organization_id, batch_size, dry_run)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local document-type classifier and apply it to stored extractions.")
+    parser.add_argument("--workers", type=int, default=16, help="extractions fetched from S3 in parallel")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    fit = subcommands.add_parser("train", help="train on documents whose type a user set")
+    fit.add_argument("--labels", help="extra examples as JSON lines with text and document_type")
+    fit.add_argument("--holdout", type=float, default=0.2, help="fraction held out to report accuracy")
+    fit.add_argument("--output", default=classifier.CLASSIFIER_MODEL_PATH)
+    run = subcommands.add_parser("reclassify", help="classify every extracted document not typed by a user")
+    run.add_argument("--organization")
+    run.add_argument("--batch-size", type=int, default=500)
+    run.add_argument("--dry-run", action="store_true", help="only report the types that would be assigned")
+    args = parser.parse_args()
+
+    database.init_db()
+    if args.command == "train":
+        train(args.workers, args.labels, args.holdout, args.output)
+    else:
+        started = time.perf_counter()
+        counts = reclassify(args.workers, args.organization, args.batch_size, args.dry_run)
+        verb = "Would classify" if args.dry_run else "Classified"
+        print(f"{verb} {sum(counts.values())} documents in {time.perf_counter() - started:.1f} s: {dict(counts)}")
+    database.router.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+import database
+import processed_format
+import schema
+from syncS3 import download_from_s3, get_s3_client, upload_to_s3, BUCKET_NAME
+
+
+def packed_key(key: str) -> str:
+    return key[:-len(".json")] + ".pack"
+
+
+def convert(key: str, dry_run: bool = False) -> tuple:
+    """ Repack one plain-JSON extraction under its .pack key. Returns (json bytes, packed bytes). """
+    original = download_from_s3(BUCKET_NAME, key)
+    packed = processed_format.encode(json.loads(original))
+    if not dry_run:
+        upload_to_s3(io.BytesIO(packed), BUCKET_NAME, packed_key(key))
+    return len(original), len(packed)
+
+
+def pending(session) -> list:
+    return list(session.execute(
+        select(schema.Document.id, schema.Document.processed_key)
+        .where(schema.Document.processed_key.like("%.json"))
+    ).all())
+
+
+def migrate_session(session, workers: int, dry_run: bool, delete_old: bool) -> tuple:
+    rows = pending(session)
+    before = after = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (document_id, key), sizes in zip(rows, pool.map(lambda row: convert(row[1], dry_run), rows)):
+            before += sizes[0]
+            after += sizes[1]
+            if dry_run:
+                continue
+            # point the row at the new object only once it's uploaded, so readers never see a missing key
+            session.query(schema.Document).filter(schema.Document.id == document_id).update(
+                {"processed_key": packed_key(key)}
+            )
+            session.commit()
+            if delete_old:
+                get_s3_client().delete_object(Bucket=BUCKET_NAME, Key=key)
+    return len(rows), before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Repack plain-JSON extraction results in the compact format.")
+    parser.add_argument("--workers", type=int, default=8, help="objects converted in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="only report the size change")
+    parser.add_argument("--delete-old", action="store_true", help="delete each .json object once its row points at the .pack")
+    args = parser.parse_args()
+
+    database.init_db()
+    documents = before = after = 0
+    for _, session in database.router.iter_sessions():
+        counts = migrate_session(session, args.workers, args.dry_run, args.delete_old)
+        documents += counts[0]
+        before += counts[1]
+        after += counts[2]
+    ratio = after / before if before else 1
+    verb = "Would repack" if args.dry_run else "Repacked"
+    print(f"{verb} {documents} extractions: {before} -> {after} bytes ({ratio:.1%})")
+    database.router.close()
+
+
+if __name__ == "__main__":
+    main()
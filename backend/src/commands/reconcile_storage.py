@@ -0,0 +1,327 @@
+"""
+Reconcile the documents table with the objects in the S3 bucket.
+
+The bucket is listed rather than probed: every organization/{id}/ prefix is
+split into ranges of RANGE_PREFIXES user prefixes, and the ranges are listed
+page by page in parallel. The listing is written as a manifest sorted by key
+(one JSON line of [key, size, last modified] per object) and merge-joined
+against the keys the documents table refers to, read in the same order, so a
+run costs one LIST per thousand objects plus a HEAD only for keys that look
+missing.
+
+Findings go to report.jsonl next to the manifest:
+- missing: a document refers to a key that isn't in the bucket. With --repair
+  a raw upload still in data/ is uploaded again, a lost extraction is re-queued
+  from its raw upload, and a lost preview is cleared.
+- orphan: an object under raw_documents/, processed_documents/ or previews/
+  that no document refers to, older than --grace seconds so uploads still
+  being recorded aren't counted. --delete-orphans deletes them.
+
+Usage (from backend/src):
+    python -m commands.reconcile_storage --repair
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from sqlalchemy import func, literal, literal_column, select, union_all, update
+import database
+import local_blobs
+import pipeline
+import schema
+from syncS3 import BUCKET_NAME, get_s3_client, upload_to_s3
+
+RECONCILE_DIR = "data/reconcile"
+ROOT = "organization/"
+S3_PREFIX = f"s3://{BUCKET_NAME}/"
+PAGE_SIZE = 1000
+# user prefixes per listed range; a small organization is a single range
+RANGE_PREFIXES = 100
+DELETE_BATCH = 1000
+# the pipeline writes these; anything else, like admin_metadata.json, is left alone
+MANAGED = re.compile(r"^organization/[^/]+/[^/]+/(raw_documents|processed_documents|previews)/")
+
+MISSING = "missing"
+ORPHAN = "orphan"
+
+
+class OrderError(Exception):
+    pass
+
+
+@dataclass
+class Finding:
+    kind: str
+    key: str
+    organization_id: str = None
+    document_id: str = None
+    column: str = None
+    size: int = None
+    action: str = None
+
+
+def list_level(client, prefix: str) -> list:
+    """ The prefixes one level below prefix, in key order. """
+    children, token = [], None
+    while True:
+        page = client.list_objects_v2(
+            Bucket=BUCKET_NAME, Prefix=prefix, Delimiter="/", MaxKeys=PAGE_SIZE,
+            **({"ContinuationToken": token} if token else {}),
+        )
+        children.extend(common["Prefix"] for common in page.get("CommonPrefixes", []))
+        if not page.get("IsTruncated"):
+            return children
+        token = page["NextContinuationToken"]
+
+
+def plan_ranges(client, pool: ThreadPoolExecutor) -> list:
+    """
+    (prefix, start, end) key ranges covering every organization prefix in
+    order; start and end are None at the ends of the prefix.
+    """
+    organizations = list_level(client, ROOT)
+    ranges = []
+    for organization, users in zip(organizations, pool.map(lambda prefix: list_level(client, prefix), organizations)):
+        bounds = [None] + users[RANGE_PREFIXES::RANGE_PREFIXES] + [None]
+        ranges.extend((organization, start, end) for start, end in zip(bounds, bounds[1:]))
+    return ranges
+
+
+def list_range(client, prefix: str, start: str, end: str, path: str) -> int:
+    """ Write the objects in [start, end) under prefix to path in key order; returns how many. """
+    count, token = 0, None
+    with open(path, "w") as f:
+        while True:
+            kwargs = {"ContinuationToken": token} if token else {"StartAfter": start[:-1]} if start else {}
+            page = client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=prefix, MaxKeys=PAGE_SIZE, **kwargs)
+            for entry in page.get("Contents", []):
+                key = entry["Key"]
+                if start and key < start:
+                    # between start[:-1] and start, i.e. in the previous range
+                    continue
+                if end and key >= end:
+                    return count
+                f.write(json.dumps([key, entry["Size"], entry["LastModified"].timestamp()]) + "\n")
+                count += 1
+            if not page.get("IsTruncated"):
+                return count
+            token = page["NextContinuationToken"]
+
+
+def build_manifest(client, path: str, workers: int) -> int:
+    """ List the bucket in parallel ranges into a manifest sorted by key. Returns the object count. """
+    parts = f"{path}.parts"
+    os.makedirs(parts, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ranges = plan_ranges(client, pool)
+        paths = [os.path.join(parts, f"{index:08d}") for index in range(len(ranges))]
+        counts = list(pool.map(lambda task: list_range(client, *task[0], task[1]), zip(ranges, paths)))
+    # the ranges are disjoint and in key order, so concatenating them keeps the order
+    with open(path, "wb") as manifest:
+        for part in paths:
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, manifest)
+    shutil.rmtree(parts)
+    return sum(counts)
+
+
+def read_manifest(path: str):
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def references(session):
+    """ (key, document id, organization id, column) for every object the documents refer to, by key. """
+    document = schema.Document
+
+    def refs(key, column: str, condition):
+        return select(
+            key.label("key"), document.id.label("document_id"), document.organization_id, literal(column).label("column")
+        ).where(condition)
+
+    query = union_all(
+        refs(func.substr(document.s3_key, len(S3_PREFIX) + 1), "s3_key", document.s3_key.startswith(S3_PREFIX)),
+        refs(document.processed_key, "processed_key", document.processed_key.is_not(None)),
+        refs(document.preview_key, "preview_key", document.preview_key.is_not(None)),
+        # the thumbnail sits next to the preview (see previews.fetch)
+        refs(func.replace(document.preview_key, "_preview.jpg", "_thumbnail.jpg"), "preview_key",
+             document.preview_key.like("%\\_preview.jpg", escape="\\")),
+    ).order_by(literal_column("key"))
+    for row in session.execute(query, execution_options={"yield_per": 5000}):
+        if row.key.startswith(ROOT):
+            yield row
+
+
+def all_references():
+    """ references() of every shard; organization shards come in key order. """
+    for _, session in database.router.iter_sessions():
+        yield from references(session)
+
+
+def merge_join(objects, refs):
+    """
+    Walk two key-ordered streams together, yielding (key, manifest entry or
+    None, [references]) once per key found in either.
+    """
+    objects, refs = iter(objects), iter(refs)
+    entry, ref = next(objects, None), next(refs, None)
+    last_object = last_ref = ""
+    while entry is not None or ref is not None:
+        if entry is not None and entry[0] < last_object or ref is not None and ref.key < last_ref:
+            raise OrderError("Manifest or references are not in key order")
+        if ref is None or entry is not None and entry[0] < ref.key:
+            last_object = entry[0]
+            yield entry[0], entry, []
+            entry = next(objects, None)
+            continue
+        key, matched = ref.key, []
+        while ref is not None and ref.key == key:
+            matched.append(ref)
+            last_ref = key
+            ref = next(refs, None)
+        if entry is not None and entry[0] == key:
+            last_object = key
+            yield key, entry, matched
+            entry = next(objects, None)
+        else:
+            yield key, None, matched
+
+
+def exists(client, key: str) -> bool:
+    page = client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=key, MaxKeys=1)
+    return any(entry["Key"] == key for entry in page.get("Contents", []))
+
+
+def delete_orphans(client, keys: list):
+    for start in range(0, len(keys), DELETE_BATCH):
+        client.delete_objects(
+            Bucket=BUCKET_NAME, Delete={"Objects": [{"Key": key} for key in keys[start:start + DELETE_BATCH]], "Quiet": True}
+        )
+
+
+def repair(client, findings: list):
+    """ Fix what can be fixed for missing objects, recording the action on each finding. """
+    lost_raw = set()
+    for finding in findings:
+        if finding.column != "s3_key":
+            continue
+        path = os.path.join(local_blobs.BLOB_DIR, local_blobs.blob_name(finding.document_id))
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                upload_to_s3(f, BUCKET_NAME, finding.key)
+            finding.action = "reuploaded"
+        else:
+            lost_raw.add(finding.document_id)
+            finding.action = "unrecoverable"
+
+    document = schema.Document
+    handled = set()
+    for finding in findings:
+        if finding.column == "s3_key":
+            continue
+        if (finding.document_id, finding.column) in handled:
+            # the thumbnail of a preview already cleared
+            finding.action = "cleared"
+            continue
+        handled.add((finding.document_id, finding.column))
+        if finding.column == "processed_key":
+            if finding.document_id in lost_raw:
+                finding.action = "unrecoverable"
+                continue
+            # extract again from the raw upload, within the organization's budget
+            values = dict(
+                processed_key=None, status=schema.DocumentStatus.QUEUED, processing_stage=pipeline.RAW_STORED,
+                processing_updated_at=schema.utcnow(), version=document.version + 1,
+            )
+            finding.action = "requeued"
+        else:
+            values = dict(preview_key=None)
+            finding.action = "cleared"
+        session = database.router.session_for(finding.organization_id)
+        try:
+            # only if the row still points at the missing key
+            result = session.execute(
+                update(document)
+                .where(document.id == finding.document_id)
+                .where(getattr(document, finding.column) == (
+                    finding.key if finding.column == "processed_key" else finding.key.replace("_thumbnail.jpg", "_preview.jpg")
+                ))
+                .values(**values),
+                execution_options={"synchronize_session": False},
+            )
+            session.commit()
+            if result.rowcount != 1:
+                finding.action = "changed"
+        finally:
+            session.close()
+
+
+def reconcile(output: str, workers: int, grace: float, fix: bool, remove_orphans: bool) -> dict:
+    client = get_s3_client()
+    os.makedirs(output, exist_ok=True)
+    manifest = os.path.join(output, "manifest.jsonl")
+    counts = dict.fromkeys(("objects", "references", "matched", "recent", "unmanaged", MISSING, ORPHAN), 0)
+    started = time.perf_counter()
+    counts["objects"] = build_manifest(client, manifest, workers)
+    counts["list_seconds"] = round(time.perf_counter() - started, 1)
+
+    cutoff = time.time() - grace
+    missing, orphans = [], []
+    for key, entry, refs in merge_join(read_manifest(manifest), all_references()):
+        counts["references"] += len(refs)
+        if entry is not None and refs:
+            counts["matched"] += 1
+        elif entry is not None:
+            if not MANAGED.match(key):
+                counts["unmanaged"] += 1
+            elif entry[2] > cutoff:
+                counts["recent"] += 1
+            else:
+                orphans.append(Finding(ORPHAN, key, organization_id=key.split("/")[1], size=entry[1]))
+        else:
+            missing.extend(
+                Finding(MISSING, key, ref.organization_id, ref.document_id, ref.column) for ref in refs
+            )
+    # written since it was listed, or the listing raced the upload
+    missing = [finding for finding in missing if not exists(client, finding.key)]
+    counts[MISSING], counts[ORPHAN] = len(missing), len(orphans)
+
+    if fix:
+        repair(client, missing)
+    if remove_orphans:
+        delete_orphans(client, [finding.key for finding in orphans])
+        for finding in orphans:
+            finding.action = "deleted"
+    with open(os.path.join(output, "report.jsonl"), "w") as f:
+        for finding in missing + orphans:
+            f.write(json.dumps({name: value for name, value in asdict(finding).items() if value is not None}) + "\n")
+    counts["seconds"] = round(time.perf_counter() - started, 1)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the documents table with the S3 bucket and report or repair drift.")
+    parser.add_argument("--workers", type=int, default=32, help="listing requests in flight")
+    parser.add_argument("--grace", type=float, default=3600, help="seconds before an unreferenced object counts as an orphan")
+    parser.add_argument("--output", help="directory for manifest.jsonl and report.jsonl")
+    parser.add_argument("--repair", action="store_true", help="re-upload, re-queue or clear documents whose objects are missing")
+    parser.add_argument("--delete-orphans", action="store_true", help="delete orphaned objects")
+    args = parser.parse_args()
+
+    database.init_db()
+    output = args.output or os.path.join(RECONCILE_DIR, time.strftime("%Y%m%dT%H%M%S"))
+    counts = reconcile(output, args.workers, args.grace, args.repair, args.delete_orphans)
+    print(f"Listed {counts['objects']} objects in {counts['list_seconds']} s, reconciled in {counts['seconds']} s: "
+          f"{counts['matched']} matched, {counts[MISSING]} missing, {counts[ORPHAN]} orphaned, "
+          f"{counts['recent']} too recent to judge, {counts['unmanaged']} not managed by the pipeline")
+    print(f"Report written to {os.path.join(output, 'report.jsonl')}")
+    database.router.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import backup
+import database
+import database_operations
+import passwords
+import schema
+from commands.shard_database import migrate_organization, prune_organization
+
+
+def seed_demo_data():
+    """ Add the demo organization with one admin, two staff and their documents. """
+    organization = schema.Organization(name="Demo Organization")
+    password = passwords.hash_password("password")
+    admin = schema.User(
+        first_name="Alice",
+        last_name="Scott",
+        email="alice@example.com",
+        password=password,
+        role=schema.Role.ADMIN,
+        permission=schema.Permission.ADMIN,
+        organization=organization
+    )
+    staff1 = schema.User(
+        first_name="Max",
+        last_name="Smith",
+        email="max@example.com",
+        password=password,
+        role=schema.Role.STAFF,
+        permission=schema.Permission.STAFF,
+        organization=organization
+    )
+    staff2 = schema.User(
+        first_name="Jamie",
+        last_name="Garcia",
+        email="jamie@example.com",
+        password=password,
+        role=schema.Role.STAFF,
+        permission=schema.Permission.STAFF,
+        organization=organization
+    )
+    folder1 = schema.Folder(
+        name=f"{admin.first_name} {admin.last_name}",
+        organization=organization,
+        user=admin
+    )
+    folder2 = schema.Folder(
+        name=f"{staff1.first_name} {staff1.last_name}",
+        organization=organization,
+        user=staff1
+    )
+    folder3 = schema.Folder(
+        name=f"{staff2.first_name} {staff2.last_name}",
+        organization=organization,
+        user=staff2
+    )
+    doc1 = schema.Document(
+        name="Max's Training Certificate",
+        link="http://example.com/max_training.pdf",
+        organization=organization,
+        folder=folder2,
+    )
+    doc2 = schema.Document(
+        name="Jamie's Background Check",
+        link="http://example.com/jamie_background_check.pdf",
+        organization=organization,
+        folder=folder3,
+        document_type=schema.DocumentType.BACKGROUND_CHECK,
+    )
+    doc3 = schema.Document(
+        name="Jamie's Training Certificate",
+        link="http://example.com/jamie_training.pdf",
+        organization=organization,
+        folder=folder3,
+    )
+    session = database.SessionLocal()
+    session.add_all([organization, admin, staff1, staff2, folder1, folder2, folder3, doc1, doc2, doc3])
+    session.commit()
+    organization_id = organization.id
+    session.close()
+    return organization_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the demo organization into the database.")
+    parser.add_argument("--reset", action="store_true", help="drop every table first (destroys all data)")
+    args = parser.parse_args()
+    if args.reset:
+        if backup.BACKUP_BEFORE_RESET == "on":
+            backup.snapshot("reset", wait=True)
+        database.reset_db()
+    else:
+        database.init_db()
+    session = database.SessionLocal()
+    try:
+        if database_operations.get_user_by_email(session, email="alice@example.com"):
+            print("Demo data is already loaded.")
+            return
+    finally:
+        session.close()
+    organization_id = seed_demo_data()
+    if database.router.sharded:
+        migrate_organization(organization_id)
+        prune_organization(organization_id)
+        database.router.close()
+    print("Demo data loaded.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import delete, select
+import database
+import schema
+import sharding
+
+
+def migrate_organization(organization_id: str) -> dict:
+    """ Copy an organization's rows from the shared database into its own shard. """
+    shard = database.router.shard_for(organization_id)
+    return sharding.copy_organization(database.Base.metadata, database.engine, shard.engine, organization_id, replace=True)
+
+
+def prune_organization(organization_id: str):
+    """
+    Remove tenant data from the shared database once it lives in the shard.
+    Organizations and users stay behind because login reads them there.
+    """
+    with database.engine.begin() as conn:
+        for table in reversed(database.Base.metadata.sorted_tables):
+            if table.name in ("organizations", "users") or "organization_id" not in table.c:
+                continue
+            conn.execute(delete(table).where(table.c.organization_id == organization_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the shared database into one shard per organization.")
+    parser.add_argument("--organization", action="append", help="only migrate these organization ids")
+    parser.add_argument("--workers", type=int, default=4, help="organizations copied in parallel")
+    parser.add_argument("--prune", action="store_true", help="delete migrated folders and documents from the shared database")
+    args = parser.parse_args()
+    if not database.router.sharded:
+        parser.error("set DATABASE_SHARDING=organization so the shards are used afterwards")
+
+    database.init_db()
+    organization_ids = args.organization
+    if not organization_ids:
+        with database.engine.connect() as conn:
+            organization_ids = list(conn.execute(select(schema.Organization.id)).scalars())
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for organization_id, counts in zip(organization_ids, pool.map(migrate_organization, organization_ids)):
+            print(f"{organization_id}: " + ", ".join(f"{count} {table}" for table, count in counts.items()))
+    if args.prune:
+        for organization_id in organization_ids:
+            prune_organization(organization_id)
+        print(f"Pruned {len(organization_ids)} organizations from the shared database.")
+    database.router.close()
+
+
+if __name__ == "__main__":
+    main()
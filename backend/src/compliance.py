@@ -0,0 +1,174 @@
+from dataclasses import dataclass
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import schema
+
+
+@dataclass(frozen=True)
+class Requirement:
+    document_type: schema.DocumentType
+    max_age_days: int
+
+
+# Which documents each role must keep on file, and how old the newest complete
+# one may be before it has to be renewed.
+BASE = (
+    Requirement(schema.DocumentType.BACKGROUND_CHECK, 5 * 365),
+    Requirement(schema.DocumentType.TB_TEST, 2 * 365),
+    Requirement(schema.DocumentType.HEALTH_ASSESSMENT, 365),
+)
+CLASSROOM = BASE + (
+    Requirement(schema.DocumentType.TRAINING_CERTIFICATE, 365),
+    Requirement(schema.DocumentType.CPR_FIRST_AID, 2 * 365),
+)
+KITCHEN = BASE + (
+    Requirement(schema.DocumentType.FOOD_HANDLER_PERMIT, 3 * 365),
+)
+
+REQUIREMENTS = {
+    schema.Role.TEACHER: CLASSROOM,
+    schema.Role.ASSISTANT_TEACHER: CLASSROOM,
+    schema.Role.SUBSTITUTE_TEACHER: CLASSROOM,
+    schema.Role.TEACHER_AIDE: CLASSROOM,
+    schema.Role.STAFF: BASE,
+    schema.Role.COOK_KITCHEN_STAFF: KITCHEN,
+    schema.Role.MAINTENANCE_STAFF: BASE,
+    schema.Role.ADMINISTRATIVE_ASSISTANT: BASE,
+    schema.Role.ADMIN: BASE,
+    schema.Role.DIRECTOR: CLASSROOM,
+    schema.Role.OTHER: BASE,
+}
+
+ROLES = list(schema.Role)
+DOCUMENT_TYPES = list(schema.DocumentType)
+SECONDS_PER_DAY = 86400
+
+
+def requirement_matrix(requirements: dict = REQUIREMENTS) -> np.ndarray:
+    """ roles x document types, holding the maximum age in seconds or -1 where not required. """
+    matrix = np.full((len(ROLES), len(DOCUMENT_TYPES)), -1, dtype=np.int64)
+    for role, role_requirements in requirements.items():
+        for requirement in role_requirements:
+            matrix[ROLES.index(role), DOCUMENT_TYPES.index(requirement.document_type)] = (
+                requirement.max_age_days * SECONDS_PER_DAY
+            )
+    return matrix
+
+
+MATRIX = requirement_matrix()
+_MISSING = np.iinfo(np.int64).min
+
+
+def evaluate_arrays(user_roles: np.ndarray, doc_users: np.ndarray, doc_types: np.ndarray,
+                    doc_times: np.ndarray, now: int, matrix: np.ndarray = MATRIX):
+    """
+    Core of the evaluator, all array operations.
+
+    user_roles: role index per user. doc_users, doc_types, doc_times: user index,
+    document type index and epoch seconds per complete document.
+    Returns (required, satisfied, latest), each users x document types.
+    """
+    latest = np.full((len(user_roles), matrix.shape[1]), _MISSING, dtype=np.int64)
+    np.maximum.at(latest, (doc_users, doc_types), doc_times)
+    max_age = matrix[user_roles]
+    required = max_age >= 0
+    satisfied = required & (latest != _MISSING) & (now - latest <= max_age)
+    return required, satisfied, latest
+
+
+def evaluate_organization(session: Session, organization_id: str, now: datetime = None,
+                          user_id: str = None) -> schema.OrganizationComplianceReport:
+    """ Compute requirement gaps for every user in an organization with two queries. """
+    now = now or schema.utcnow()
+    users_query = select(schema.User.id, schema.User.first_name, schema.User.last_name, schema.User.role).where(
+        schema.User.organization_id == organization_id
+    )
+    if user_id:
+        users_query = users_query.where(schema.User.id == user_id)
+    users = session.execute(users_query.order_by(schema.User.id)).all()
+    documents = session.execute(
+        select(schema.Folder.user_id, schema.Document.document_type, schema.Document.created_at)
+        .join(schema.Folder, schema.Document.folder_id == schema.Folder.id)
+        .where(
+            schema.Document.organization_id == organization_id,
+            schema.Document.status == schema.DocumentStatus.COMPLETE,
+            # only superseded documents are archived, so the latest of each type is always live
+            schema.Document.storage_tier.is_(None),
+            schema.Folder.user_id.is_not(None),
+        )
+    ).all()
+
+    user_ids = np.array([user.id for user in users], dtype=str)
+    role_index = {role: index for index, role in enumerate(ROLES)}
+    type_index = {document_type: index for index, document_type in enumerate(DOCUMENT_TYPES)}
+    user_roles = np.array([role_index[user.role] for user in users], dtype=np.int64)
+
+    if documents and len(user_ids):
+        doc_user_ids = np.array([row.user_id for row in documents], dtype=str)
+        # user_ids is sorted by the query, so a binary search maps documents to users
+        positions = np.searchsorted(user_ids, doc_user_ids)
+        positions = np.minimum(positions, len(user_ids) - 1)
+        known = user_ids[positions] == doc_user_ids
+        doc_users = positions[known]
+        doc_types = np.array([type_index[row.document_type] for row in documents], dtype=np.int64)[known]
+        doc_times = np.array(
+            [row.created_at or datetime.min for row in documents], dtype="datetime64[s]"
+        ).astype(np.int64)[known]
+    else:
+        doc_users = doc_types = doc_times = np.empty(0, dtype=np.int64)
+
+    now_seconds = np.datetime64(now, "s").astype(np.int64)
+    required, satisfied, latest = evaluate_arrays(user_roles, doc_users, doc_types, doc_times, now_seconds)
+    gaps = required & ~satisfied
+
+    required_per_user = required.sum(axis=1).tolist()
+    satisfied_per_user = satisfied.sum(axis=1).tolist()
+    gap_users, gap_types = np.nonzero(gaps)
+    gap_latest = latest[gap_users, gap_types]
+    gap_max_age = (MATRIX[user_roles[gap_users], gap_types] // SECONDS_PER_DAY).tolist()
+    gap_found = (gap_latest != _MISSING).tolist()
+    # the missing sentinel converts to NaT, which tolist() turns into None
+    gap_latest = gap_latest.astype("datetime64[s]").tolist()
+
+    user_gaps = [[] for _ in users]
+    for index, type_position, max_age_days, found, latest_at in zip(
+        gap_users.tolist(), gap_types.tolist(), gap_max_age, gap_found, gap_latest
+    ):
+        user_gaps[index].append(schema.RequirementGap(
+            document_type=DOCUMENT_TYPES[type_position],
+            reason="expired" if found else "missing",
+            max_age_days=max_age_days,
+            latest_document_at=latest_at if found else None,
+        ))
+    reports = [
+        schema.UserComplianceReport(
+            user_id=user.id,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            role=user.role,
+            required=required_per_user[index],
+            satisfied=satisfied_per_user[index],
+            gaps=user_gaps[index],
+        )
+        for index, user in enumerate(users)
+    ]
+
+    total_required = int(required.sum())
+    total_satisfied = int(satisfied.sum())
+    gaps_per_type = gaps.sum(axis=0)
+    return schema.OrganizationComplianceReport(
+        organization_id=organization_id,
+        evaluated_at=now,
+        staff_count=len(users),
+        compliant_staff=sum(1 for required_count, satisfied_count in zip(required_per_user, satisfied_per_user)
+                            if required_count == satisfied_count),
+        required=total_required,
+        satisfied=total_satisfied,
+        compliance_percentage=round(100 * total_satisfied / total_required, 1) if total_required else 100.0,
+        gaps_by_document_type={
+            DOCUMENT_TYPES[index]: int(count) for index, count in enumerate(gaps_per_type) if count
+        },
+        users=reports,
+    )
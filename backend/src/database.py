@@ -1,11 +1,153 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import declarative_base, sessionmaker
+import metrics
+from write_queue import WriteQueue
+from sharding import Shard, TenantRouter
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///database.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# "organization" gives every tenant its own SQLite file under SHARD_DIR; the
+# database above then only serves as the directory of organizations and users.
+DATABASE_SHARDING = os.getenv("DATABASE_SHARDING", "off")
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+SHARD_CACHE_SIZE = int(os.getenv("SHARD_CACHE_SIZE", "256"))
+
+# Bump when the schema changes. New tables and nullable columns are added
+# automatically; anything else (indexes, backfills) goes in MIGRATIONS under
+# the version that introduces it. Fresh databases are built by create_all.
+SCHEMA_VERSION = 13
+MIGRATIONS = {
+    2: ["UPDATE documents SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"],
+    # types picked by hand before the classifier existed are the user's
+    8: ["UPDATE documents SET document_type_source = 'user' WHERE document_type != 'OTHER'"],
+    9: ["CREATE INDEX IF NOT EXISTS ix_documents_status_stage ON documents (status, processing_stage)"],
+    # 10: documents.version, added by add_missing_columns
+    11: [
+        "CREATE INDEX IF NOT EXISTS ix_documents_live_organization ON documents (organization_id) WHERE storage_tier IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_documents_live_folder ON documents (folder_id) WHERE storage_tier IS NULL",
+    ],
+    # 13: idempotency_keys.document_id, added by add_missing_columns
+}
+# Steps that only run on tenant shards, never on the directory database.
+SHARD_MIGRATIONS = {
+    # shards used to get whole users rows; password hashes (and legacy
+    # plaintext never rehashed there) stay in the directory database only
+    12: ["UPDATE users SET password = ''"],
+}
+
+# "default" keeps SQLite's stock settings; "production" turns on WAL, relaxed
+# fsync, a bigger page cache, memory-mapped reads and a busy timeout, and sizes
+# the connection pool for concurrent requests.
+DATABASE_PROFILE = os.getenv("DATABASE_PROFILE", "default")
+SQLITE_PRAGMAS = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative is KiB, so 64 MiB
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "foreign_keys": "ON",
+        "temp_store": "MEMORY",
+    },
+}
+POOL_OPTIONS = {
+    "default": {},
+    "production": {
+        "pool_size": int(os.getenv("DATABASE_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DATABASE_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DATABASE_POOL_TIMEOUT", "10")),
+        "pool_pre_ping": False,
+    },
+}
+
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = DATABASE_PROFILE):
+    engine = create_engine(
+        url, connect_args={"check_same_thread": False}, **POOL_OPTIONS[profile]
+    )
+    pragmas = SQLITE_PRAGMAS[profile]
+    if pragmas:
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
+    return metrics.instrument_engine(engine)
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Small writes (status changes, folder creation) go through one writer thread
+# and are group-committed instead of contending for SQLite's write lock.
+writer = WriteQueue(SessionLocal)
+
 Base = declarative_base()
+
+
+def get_schema_version(bind=engine) -> int:
+    with bind.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def set_schema_version(conn, version: int):
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def init_db(bind=engine) -> bool:
+    """
+    Bring the database up to SCHEMA_VERSION without touching existing rows.
+    Returns False when it was already current, which is the common fast path.
+    """
+    version = get_schema_version(bind)
+    if version == SCHEMA_VERSION:
+        return False
+    import schema  # registers the models on Base.metadata
+
+    with bind.begin() as conn:
+        existing = conn.exec_driver_sql("SELECT count(*) FROM sqlite_master WHERE type = 'table'").scalar()
+        # databases created before versioning are at the first schema version
+        version = max(version, 1) if existing else SCHEMA_VERSION
+        Base.metadata.create_all(bind=conn)
+        add_missing_columns(conn)
+        for step in range(version + 1, SCHEMA_VERSION + 1):
+            statements = MIGRATIONS.get(step, [])
+            if bind is not engine:
+                statements = statements + SHARD_MIGRATIONS.get(step, [])
+            for statement in statements:
+                conn.exec_driver_sql(statement)
+        set_schema_version(conn, SCHEMA_VERSION)
+    return True
+
+
+def add_missing_columns(conn):
+    """ ALTER existing tables to add model columns they don't have yet. """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            conn.exec_driver_sql(ddl)
+
+
+def reset_db(bind=engine):
+    """ Drop every table and recreate the current schema. Destroys all data. """
+    import schema  # registers the models on Base.metadata
+
+    Base.metadata.drop_all(bind=bind)
+    with bind.begin() as conn:
+        Base.metadata.create_all(bind=conn)
+        set_schema_version(conn, SCHEMA_VERSION)
+
+
+# Resolves the session for a tenant; see sharding.TenantRouter.
+router = TenantRouter(
+    Shard(engine, SessionLocal, writer), DATABASE_SHARDING, SHARD_DIR, create_db_engine, init_db, SHARD_CACHE_SIZE
+)
@@ -1,5 +1,12 @@
 import schema
+import events
+import database
+import sharding
+from datetime import timedelta
+from sqlalchemy import String, cast, delete, func, tuple_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 
 def get_user(db: Session, user_id: int):
     return db.query(schema.User).filter(schema.User.id == user_id).first()
@@ -7,35 +14,93 @@ def get_user(db: Session, user_id: int):
 def get_user_by_email(db: Session, email: str):
     return db.query(schema.User).filter(schema.User.email == email).first()
 
+def set_user_password(db: Session, user_id: str, password_hash: str):
+    db.execute(update(schema.User).where(schema.User.id == user_id).values(password=password_hash))
+    db.commit()
+
 def get_organization(db: Session, organization_id: str):
     return db.query(schema.Organization).filter(schema.Organization.id == organization_id).first()
 
 def get_folder(db: Session, folder_id: str):
     return db.query(schema.Folder).filter(schema.Folder.id == folder_id).first()
 
-def get_documents_by_organization(db: Session, organization_id: str):
-    return db.query(schema.Document).filter(schema.Document.organization_id == organization_id).all()
+def get_folder_by_user(db: Session, user_id: str):
+    return db.query(schema.Folder).filter(schema.Folder.user_id == user_id).first()
+
+# Read-only listings select plain column tuples: no ORM objects are hydrated or
+# added to the identity map, and the response models validate the rows directly.
+def columns(model) -> tuple:
+    return tuple(model.__table__.columns)
+
+# Listings leave out archived documents unless asked for them; the ix_documents_live_*
+# partial indexes only cover rows matching this exact IS NULL term.
+def live(include_archived: bool = False) -> list:
+    return [] if include_archived else [schema.Document.storage_tier.is_(None)]
+
+def get_documents_by_organization(db: Session, organization_id: str, include_archived: bool = False):
+    return db.query(*columns(schema.Document)).filter(
+        schema.Document.organization_id == organization_id, *live(include_archived)
+    ).all()
 
 def get_folders_by_organization(db: Session, organization_id: str):
-    return db.query(schema.Folder).filter(schema.Folder.organization_id == organization_id).all()
+    return db.query(*columns(schema.Folder)).filter(schema.Folder.organization_id == organization_id).all()
 
-def get_documents_by_folder(db: Session, folder_id: str):
-    return db.query(schema.Document).filter(schema.Document.folder_id == folder_id).all()
+def get_documents_by_folder(db: Session, folder_id: str, include_archived: bool = False):
+    return db.query(*columns(schema.Document)).filter(
+        schema.Document.folder_id == folder_id, *live(include_archived)
+    ).all()
 
 def get_document(db: Session, document_id: str):
     return db.query(schema.Document).filter(schema.Document.id == document_id).first()
 
+def set_document_type(db: Session, document: schema.Document, document_type: schema.DocumentType,
+                      source: str, confidence: float = None) -> schema.Document:
+    document.document_type = document_type
+    document.document_type_source = source
+    document.document_type_confidence = confidence
+    document.version = schema.Document.version + 1
+    db.commit()
+    db.refresh(document)
+    return document
+
+def get_document_previews(db: Session, folder_id: str, organization_id: str):
+    return db.query(
+        schema.Document.id, schema.Document.name, schema.Document.status, schema.Document.preview_key
+    ).filter(schema.Document.folder_id == folder_id, schema.Document.organization_id == organization_id, *live()).all()
+
+def get_export_rows(db: Session, organization_id: str, folder_id: str = None, include_archived: bool = False,
+                    after: tuple = None, limit: int = None):
+    """
+    Document columns plus folder_name for an export, folder by folder. A page
+    of limit rows follows the export_key (folder name, created_at, id) of the
+    last row of the previous page.
+    """
+    created = func.coalesce(cast(schema.Document.created_at, String), "")
+    query = (
+        db.query(*columns(schema.Document), schema.Folder.name.label("folder_name"), created.label("created_key"))
+        .join(schema.Folder, schema.Document.folder_id == schema.Folder.id)
+        .filter(schema.Document.organization_id == organization_id, *live(include_archived))
+    )
+    if folder_id is not None:
+        query = query.filter(schema.Document.folder_id == folder_id)
+    if after is not None:
+        query = query.filter(tuple_(schema.Folder.name, created, schema.Document.id) > tuple_(*after))
+    return query.order_by(schema.Folder.name, created, schema.Document.id).limit(limit).all()
+
+def export_key(row) -> tuple:
+    return row.folder_name, row.created_key, row.id
+
 def get_all_organizations(db: Session):
-    return db.query(schema.Organization).all()
+    return db.query(*columns(schema.Organization)).all()
 
 def get_all_users(db: Session):
-    return db.query(schema.User).all()
+    return db.query(*columns(schema.User)).all()
 
 def get_all_folders(db: Session):
-    return db.query(schema.Folder).all()
+    return db.query(*columns(schema.Folder)).all()
 
 def get_all_documents(db: Session):
-    return db.query(schema.Document).all()
+    return db.query(*columns(schema.Document)).all()
 
 def get_compliance_folder_response(db: Session, organization_id: str) -> schema.ComplianceFoldersResponse:
     folders = db.query(schema.Folder).filter(schema.Folder.organization_id == organization_id).all()
@@ -58,3 +123,100 @@ def get_compliance_folder_response(db: Session, organization_id: str) -> schema.
         ))
     return schema.ComplianceFoldersResponse(folders=folder_responses)
 
+
+async def set_document_status(document: schema.Document, status: schema.DocumentStatus, **values):
+    """
+    Write the new status through the group-committing writer, mirror it onto the
+    caller's loaded object without dirtying its session, then publish the change.
+    Extra column values are written in the same statement.
+    """
+    previous_status = document.status
+    if previous_status == status and not values:
+        return
+    document_id = document.id
+
+    def write(db: Session):
+        return db.execute(
+            update(schema.Document).where(schema.Document.id == document_id)
+            .values(status=status, version=schema.Document.version + 1, **values)
+            .returning(schema.Document.version)
+        ).scalar()
+
+    version = await database.router.run(document.organization_id, write)
+    for column, value in {"status": status, "version": version, **values}.items():
+        set_committed_value(document, column, value)
+    if previous_status != status:
+        events.publish_document_status(document, previous_status)
+
+def mirror_to_shard(user: schema.User):
+    """ Copy the user and their organization from the directory database into the tenant's shard. """
+    if not database.router.sharded:
+        return
+    shard = database.router.shard_for(user.organization_id)
+    organizations, users = schema.Organization.__table__, schema.User.__table__
+    sharding.copy_rows(database.engine, shard.engine, organizations, organizations.c.id == user.organization_id)
+    sharding.copy_rows(database.engine, shard.engine, users, users.c.id == user.id)
+
+# An in-flight claim older than this is assumed to belong to a crashed request.
+IDEMPOTENCY_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+def claim_idempotency_key(db: Session, key: str, user: schema.User, request_path: str):
+    """
+    Claim an Idempotency-Key for this request. Returns None when the caller now
+    owns the key, or the existing record for a key that was already used.
+    """
+    db.add(schema.IdempotencyKey(
+        key=key, user_id=user.id, organization_id=user.organization_id, request_path=request_path
+    ))
+    try:
+        db.commit()
+        return None
+    except IntegrityError:
+        db.rollback()
+    record = db.get(schema.IdempotencyKey, (key, user.id))
+    if record is not None and record.status_code is None \
+            and record.created_at < schema.utcnow() - IDEMPOTENCY_CLAIM_TIMEOUT:
+        record.created_at = schema.utcnow()
+        db.commit()
+        return None
+    return record
+
+def store_idempotent_response(db: Session, key: str, user_id: str, status_code: int, response: str):
+    db.execute(
+        update(schema.IdempotencyKey)
+        .where(schema.IdempotencyKey.key == key, schema.IdempotencyKey.user_id == user_id)
+        .values(status_code=status_code, response=response)
+    )
+    db.commit()
+
+def release_idempotency_key(db: Session, key: str, user_id: str, document_id: str = None):
+    """
+    Give up a claim whose request failed, so the client can retry with the same
+    key. A claim whose request already created a document keeps pointing at it,
+    and the retry resumes that document instead of creating another.
+    """
+    db.rollback()
+    claim = (schema.IdempotencyKey.key == key, schema.IdempotencyKey.user_id == user_id)
+    if document_id is None:
+        db.execute(delete(schema.IdempotencyKey).where(*claim))
+    else:
+        db.execute(update(schema.IdempotencyKey).where(*claim).values(document_id=document_id))
+    db.commit()
+
+def take_over_idempotency_key(db: Session, record: schema.IdempotencyKey):
+    """
+    Claim a key whose earlier request failed after creating a document. Returns
+    the document id, or None if the key is in use or another retry got it first.
+    """
+    key, user_id, document_id = record.key, record.user_id, record.document_id
+    if document_id is None:
+        return None
+    result = db.execute(
+        update(schema.IdempotencyKey)
+        .where(schema.IdempotencyKey.key == key, schema.IdempotencyKey.user_id == user_id,
+               schema.IdempotencyKey.status_code.is_(None), schema.IdempotencyKey.document_id == document_id)
+        .values(document_id=None, created_at=schema.utcnow()),
+        execution_options={"synchronize_session": False},
+    )
+    db.commit()
+    return document_id if result.rowcount == 1 else None
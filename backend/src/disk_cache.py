@@ -0,0 +1,105 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class DiskCache:
+    """
+    Byte-bounded LRU cache of small files in one directory. Recency is tracked
+    in memory and rebuilt from file mtimes on first use, so a restart keeps the
+    cache warm without an index file. Writes go through a temp file and rename.
+    """
+
+    # entries kept even when over budget, so a file just written is still there to serve
+    min_entries = 1
+
+    def __init__(self, root: str, max_bytes: int, suffix: str = ""):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.entries = None  # name -> size, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _load(self):
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name.endswith(self.suffix) and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(found))
+        self.size = sum(self.entries.values())
+
+    def path(self, name: str) -> str:
+        if os.path.basename(name) != name or name.startswith("."):
+            raise ValueError(f"Invalid cache entry name: {name!r}")
+        return os.path.join(self.root, name)
+
+    def get(self, name: str):
+        """ Path of a cached entry, or None on a miss. """
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            if name not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+            self.hits += 1
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.size -= self.entries.pop(name, 0)
+            return None
+        return path
+
+    def put(self, name: str, data: bytes) -> str:
+        path = self.path(name)
+        with self.lock:
+            if self.entries is None:
+                self._load()
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.size += len(data) - self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            evicted = self._evict()
+        self._remove(evicted)
+        return path
+
+    def _evictable(self, name: str) -> bool:
+        return True
+
+    def _evict(self) -> list:
+        """ Drop least recently used entries until under budget. Call with the lock held; returns their names. """
+        evicted = []
+        for name in list(self.entries):
+            if self.size <= self.max_bytes or len(self.entries) <= self.min_entries:
+                break
+            if self._evictable(name):
+                self.size -= self.entries.pop(name)
+                evicted.append(name)
+        return evicted
+
+    def _remove(self, names: list):
+        for name in names:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    def discard(self, name: str):
+        with self.lock:
+            if self.entries is not None:
+                self.size -= self.entries.pop(name, 0)
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
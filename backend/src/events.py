@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import closing
+
+# "memory" fans out inside this process only, "sqlite" shares events between
+# every worker on the host through a small append-only table.
+EVENT_BUS = os.getenv("EVENT_BUS", "memory")
+EVENT_BUS_PATH = os.getenv("EVENT_BUS_PATH", "data/events.db")
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+EVENT_POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", "0.25"))
+EVENT_RETENTION_SECONDS = int(os.getenv("EVENT_RETENTION_SECONDS", "300"))
+EVENT_PRUNE_INTERVAL = float(os.getenv("EVENT_PRUNE_INTERVAL", "60"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    A bounded per-client queue. When a client falls behind, the oldest events
+    are dropped and the client is told to resync instead of stalling publishers.
+    """
+
+    def __init__(self, bus, organization_id: str, maxsize: int = EVENT_QUEUE_SIZE):
+        self.bus = bus
+        self.organization_id = organization_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """ In-process publish/subscribe keyed by organization id. """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, organization_id: str) -> Subscription:
+        subscription = Subscription(self, organization_id)
+        self.subscribers[organization_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscribers.get(subscription.organization_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self.subscribers[subscription.organization_id]
+
+    def publish(self, organization_id: str, event: dict):
+        self.deliver(organization_id, event)
+
+    def close(self):
+        pass
+
+    def deliver(self, organization_id: str, event: dict):
+        # Publishers may run on worker threads, so hand the event to each
+        # subscriber's own loop rather than touching its queue directly.
+        for subscription in list(self.subscribers.get(organization_id, ())):
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # the subscriber's loop has already shut down
+                self.unsubscribe(subscription)
+
+
+class SqliteEventBus(EventBus):
+    """
+    Shares events between workers on one host. Publishing appends a row to a
+    local SQLite table and every worker tails the table to fan events out to
+    its own subscribers.
+
+    Publishers only queue the event: one writer thread inserts whatever is
+    queued in a single transaction and drops rows older than the retention
+    window every EVENT_PRUNE_INTERVAL seconds.
+    """
+
+    def __init__(self, path: str = EVENT_BUS_PATH):
+        super().__init__()
+        self.path = path
+        self.last_id = None
+        self.poller = None
+        self.pending = queue.Queue()
+        self.writer = None
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "organization_id TEXT NOT NULL, "
+                "payload TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def subscribe(self, organization_id: str) -> Subscription:
+        subscription = super().subscribe(organization_id)
+        if self.poller is None or self.poller.done():
+            self.poller = asyncio.get_running_loop().create_task(self._poll())
+        return subscription
+
+    def publish(self, organization_id: str, event: dict):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write, name="event-writer", daemon=True)
+                self.writer.start()
+            self.pending.put((organization_id, json.dumps(event), time.time()))
+
+    def close(self):
+        """ Write whatever is queued and stop the writer thread. """
+        with self.lock:
+            writer, self.writer = self.writer, None
+            if writer is None:
+                return
+            self.pending.put(None)
+        writer.join()
+
+    def _write(self):
+        pruned = time.monotonic()
+        with closing(self._connect()) as conn:
+            while True:
+                rows, stop = [self.pending.get()], False
+                try:
+                    while True:
+                        rows.append(self.pending.get_nowait())
+                except queue.Empty:
+                    pass
+                if None in rows:
+                    rows, stop = [row for row in rows if row is not None], True
+                try:
+                    with conn:
+                        conn.executemany("INSERT INTO events (organization_id, payload, created_at) VALUES (?, ?, ?)", rows)
+                        if time.monotonic() - pruned >= EVENT_PRUNE_INTERVAL:
+                            conn.execute("DELETE FROM events WHERE created_at < ?", (time.time() - EVENT_RETENTION_SECONDS,))
+                            pruned = time.monotonic()
+                except sqlite3.Error:
+                    logger.exception("Dropped %d events", len(rows))
+                if stop:
+                    return
+
+    def _read_since(self, last_id):
+        with closing(self._connect()) as conn, conn:
+            if last_id is None:
+                row = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()
+                return row[0], []
+            rows = conn.execute(
+                "SELECT id, organization_id, payload FROM events WHERE id > ? ORDER BY id",
+                (last_id,),
+            ).fetchall()
+        return (rows[-1][0] if rows else last_id), rows
+
+    async def _poll(self):
+        while self.subscribers:
+            self.last_id, rows = await asyncio.to_thread(self._read_since, self.last_id)
+            for _, organization_id, payload in rows:
+                self.deliver(organization_id, json.loads(payload))
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+        self.poller = None
+
+
+def create_bus() -> EventBus:
+    if EVENT_BUS == "sqlite":
+        return SqliteEventBus()
+    return EventBus()
+
+
+bus = create_bus()
+
+
+def publish_document_status(document, previous_status=None):
+    """ Broadcast a document status transition to the document's organization. """
+    bus.publish(document.organization_id, {
+        "document_id": document.id,
+        "folder_id": document.folder_id,
+        "organization_id": document.organization_id,
+        "status": getattr(document.status, "value", document.status),
+        "previous_status": getattr(previous_status, "value", previous_status),
+        "timestamp": time.time(),
+    })
+
+
+def publish_bulk_status(organization_id: str, status, changes: list):
+    """
+    Broadcast one status transition shared by many documents; each change has
+    document_id, folder_id and previous_status.
+    """
+    bus.publish(organization_id, {
+        "type": "bulk_status",
+        "organization_id": organization_id,
+        "status": getattr(status, "value", status),
+        "documents": [
+            {**change, "previous_status": getattr(change["previous_status"], "value", change["previous_status"])}
+            for change in changes
+        ],
+        "timestamp": time.time(),
+    })
+
+
+async def sse_stream(subscription: Subscription):
+    """ Format a subscription as a text/event-stream body. """
+    try:
+        yield "retry: 3000\n\n"
+        dropped = 0
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if subscription.dropped != dropped:
+                # the client missed events; it should reload the listing once
+                dropped = subscription.dropped
+                yield f"event: resync\ndata: {json.dumps({'dropped': dropped})}\n\n"
+            yield f"event: {event.get('type', 'document_status')}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        subscription.close()
@@ -0,0 +1,247 @@
+"""
+Streaming ZIP export of a folder or a whole organization.
+
+The archive is written on the fly into a non-seekable sink, so entries use data
+descriptors and nothing has to be rewound. Each export reads up to
+EXPORT_CONCURRENCY raw PDFs from S3 ahead of the writer on its own threads,
+each handing over at most EXPORT_QUEUE_CHUNKS chunks of EXPORT_CHUNK_BYTES at a
+time, so a slow client only holds up its own readers. Rows are read
+EXPORT_ROW_BATCH at a time, in a thread, and the manifest is spooled to a
+temporary file as the documents go by. Memory therefore stays around concurrency * (queue + 1)
+chunks whatever the size of the export.
+"""
+import asyncio
+import csv
+import os
+import re
+import tempfile
+import threading
+import zipfile
+from collections import deque
+import database
+import database_operations
+import metrics
+from syncS3 import open_s3_stream, parse_s3_path
+
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "4"))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(1024 * 1024)))
+EXPORT_QUEUE_CHUNKS = int(os.getenv("EXPORT_QUEUE_CHUNKS", "4"))
+EXPORT_ROW_BATCH = int(os.getenv("EXPORT_ROW_BATCH", "500"))
+# DOS timestamps can't go earlier
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+MANIFEST_FIELDS = (
+    "id", "name", "link", "s3_key", "processed_key", "status", "organization_id", "folder_id",
+    "folder_name", "archive_path", "error",
+)
+
+_UNSAFE = re.compile(r"[^\w.() -]+")
+
+exported = metrics.REGISTRY.register(metrics.Counter(
+    "export_documents_total", "Documents written to ZIP exports, by outcome.", ("outcome",)
+))
+exported_bytes = metrics.REGISTRY.register(metrics.Counter(
+    "export_bytes_total", "Bytes streamed to clients in ZIP exports.", ()
+))
+
+
+class _Sink:
+    """ Write-only file object for ZipFile; the generator drains what was written. """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        exported_bytes.inc(amount=len(data))
+        return data
+
+
+class _Fetch:
+    """ One raw PDF streamed from S3 by its own thread through a bounded queue on the event loop. """
+    DONE = object()
+
+    def __init__(self, s3_path: str, loop: asyncio.AbstractEventLoop, cancelled: threading.Event):
+        self.s3_path = s3_path
+        self.loop = loop
+        self.cancelled = cancelled
+        self.size = None
+        self.error = None
+        self.ready = asyncio.Event()
+        self.chunks = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+
+    def start(self):
+        threading.Thread(target=self.run, name="export", daemon=True).start()
+
+    def _put(self, item) -> bool:
+        # waits while the queue is full; gives up once the export is cancelled
+        future = asyncio.run_coroutine_threadsafe(self.chunks.put(item), self.loop)
+        while not self.cancelled.is_set():
+            try:
+                future.result(timeout=0.5)
+                return True
+            except TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def _ready(self):
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    def run(self):
+        try:
+            self.size, body = open_s3_stream(*parse_s3_path(self.s3_path))
+            self._ready()
+            try:
+                for chunk in body.iter_chunks(EXPORT_CHUNK_BYTES):
+                    if not self._put(chunk):
+                        return
+            finally:
+                body.close()
+            self._put(self.DONE)
+        except Exception as e:
+            if self.size is not None:
+                self._put(e)
+            else:
+                self.error = e
+                self._ready()
+
+    async def chunks_async(self):
+        while True:
+            item = await self.chunks.get()
+            if item is self.DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def export_pages(organization_id: str, folder_id: str = None, include_archived: bool = False):
+    """
+    The rows of an export, in lists of EXPORT_ROW_BATCH. Each page is read in
+    its own short session, so a long download holds no transaction open.
+    """
+    after = None
+    while True:
+        session = database.router.session_for(organization_id)
+        try:
+            rows = database_operations.get_export_rows(
+                session, organization_id, folder_id, include_archived, after=after, limit=EXPORT_ROW_BATCH
+            )
+        finally:
+            session.close()
+        if rows:
+            yield rows
+        if len(rows) < EXPORT_ROW_BATCH:
+            return
+        after = database_operations.export_key(rows[-1])
+
+
+def archive_path(row) -> str:
+    folder = _UNSAFE.sub("_", row.folder_name or "Unfiled").strip() or "Unfiled"
+    name = _UNSAFE.sub("_", row.name).strip() or "document"
+    if name.lower().endswith(".pdf"):
+        name = name[:-4]
+    return f"{folder}/{name}-{row.id[:8]}.pdf"
+
+
+async def stream_zip(pages, manifest: bool = True):
+    """
+    Yield a ZIP of the raw PDFs for pages (an iterable of lists of document
+    columns plus folder_name), in order, with an optional manifest.csv. Each
+    page is read in a thread, off the event loop. Documents without an S3 copy,
+    and archived ones (which S3 may refuse to read until they are restored),
+    are only listed in the manifest.
+    """
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, "w", allowZip64=True)
+    cancelled = threading.Event()
+    loop = asyncio.get_running_loop()
+    pages = iter(pages)
+    rows = deque()
+    # rows read from the iterable, with their fetch when they have an S3 copy; at
+    # most EXPORT_CONCURRENCY fetches are running ahead of the writer
+    ahead = deque()
+    fetching = 0
+    records = tempfile.SpooledTemporaryFile(max_size=EXPORT_CHUNK_BYTES, mode="w+", encoding="utf-8", newline="")
+    writer = csv.DictWriter(records, fieldnames=MANIFEST_FIELDS)
+    writer.writeheader()
+
+    async def read_ahead():
+        nonlocal fetching
+        while fetching < EXPORT_CONCURRENCY:
+            if not rows:
+                # the next page is a database query; don't run it on the event loop
+                rows.extend(await asyncio.to_thread(next, pages, ()))
+                if not rows:
+                    return
+            row = rows.popleft()
+            fetch = None
+            if row.s3_key and row.storage_tier is None:
+                fetch = _Fetch(row.s3_key, loop, cancelled)
+                fetch.start()
+                fetching += 1
+            ahead.append((row, fetch))
+
+    try:
+        while True:
+            await read_ahead()
+            if not ahead:
+                break
+            row, fetch = ahead.popleft()
+            record = {field: getattr(row, field, None) for field in MANIFEST_FIELDS}
+            record["status"] = row.status.value if row.status is not None else None
+            if fetch is None:
+                record["error"] = "not uploaded" if not row.s3_key else f"{row.storage_tier}; restore it first"
+                exported.inc("skipped")
+                writer.writerow(record)
+                continue
+            fetching -= 1
+            await read_ahead()
+            await fetch.ready.wait()
+            if fetch.error is not None:
+                record["error"] = str(fetch.error)
+                exported.inc("failed")
+                writer.writerow(record)
+                continue
+            info = zipfile.ZipInfo(
+                archive_path(row), date_time=row.created_at.timetuple()[:6] if row.created_at else ZIP_EPOCH
+            )
+            info.compress_type = zipfile.ZIP_STORED  # PDFs are already compressed
+            info.file_size = fetch.size
+            try:
+                with archive.open(info, "w") as entry:
+                    async for chunk in fetch.chunks_async():
+                        entry.write(chunk)
+                        yield sink.drain()
+                record["archive_path"] = info.filename
+                exported.inc("exported")
+            except Exception as e:
+                # the entry is closed short; the manifest says so
+                record["archive_path"] = info.filename
+                record["error"] = f"truncated: {e}"
+                exported.inc("failed")
+            writer.writerow(record)
+            yield sink.drain()
+
+        if manifest:
+            info = zipfile.ZipInfo("manifest.csv", date_time=ZIP_EPOCH)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            records.seek(0)
+            with archive.open(info, "w") as entry:
+                while text := records.read(EXPORT_CHUNK_BYTES):
+                    entry.write(text.encode("utf-8"))
+                    yield sink.drain()
+        archive.close()
+        yield sink.drain()
+    finally:
+        # a client that disconnects stops the readers at their next chunk
+        cancelled.set()
+        records.close()
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import closing
+import metrics
+
+LLM_CACHE = os.getenv("LLM_CACHE", "on")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "data/llm_cache.db")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000"))
+# eviction runs every this many writes rather than on each one
+EVICT_EVERY = 100
+
+lookups = metrics.REGISTRY.register(metrics.Counter(
+    "llm_cache_lookups_total", "LLM verdict cache lookups by result.", ("model", "result")
+))
+tokens_saved = metrics.REGISTRY.register(metrics.Counter(
+    "llm_cache_tokens_saved_total", "Prompt and completion tokens not spent thanks to cache hits.", ("model",)
+))
+
+# Landing AI markdown carries per-extraction chunk ids, page coordinates and anchors
+# that differ between two uploads of the same blank form.
+_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_ANCHOR = re.compile(r"<a id=['\"][^'\"]*['\"]>\s*</a>")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    text = _ANCHOR.sub("", _COMMENT.sub("<!-- -->", text))
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def namespace(system_prompt: str, model: str) -> str:
+    """ Identifies a prompt and model pair; changing either starts a fresh namespace. """
+    return hashlib.sha256(json.dumps([system_prompt, model]).encode("utf-8")).hexdigest()[:16]
+
+
+def cache_key(system_prompt: str, model: str, text: str) -> str:
+    return hashlib.sha256(json.dumps([system_prompt, model, normalize(text)]).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent cache of parsed model responses in a local SQLite file. Entries
+    expire after ttl seconds and the least recently used are evicted beyond
+    max_entries.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: int = LLM_CACHE_TTL_SECONDS,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.writes = 0
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _setup(self):
+        with self.lock:
+            if self.ready:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, "
+                    "namespace TEXT NOT NULL, "
+                    "model TEXT NOT NULL, "
+                    "response TEXT NOT NULL, "
+                    "prompt_tokens INTEGER NOT NULL DEFAULT 0, "
+                    "completion_tokens INTEGER NOT NULL DEFAULT 0, "
+                    "created_at REAL NOT NULL, "
+                    "accessed_at REAL NOT NULL, "
+                    "hits INTEGER NOT NULL DEFAULT 0)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+            self.ready = True
+
+    def get(self, system_prompt: str, model: str, text: str):
+        """ The cached response JSON for this prompt, model and text, or None. """
+        self._setup()
+        key = cache_key(system_prompt, model, text)
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT response, prompt_tokens, completion_tokens FROM llm_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE llm_cache SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        if row is None:
+            lookups.inc(model, "miss")
+            return None
+        lookups.inc(model, "hit")
+        tokens_saved.inc(model, amount=row[1] + row[2])
+        return row[0]
+
+    def put(self, system_prompt: str, model: str, text: str, response: str,
+            prompt_tokens: int = 0, completion_tokens: int = 0):
+        self._setup()
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache "
+                "(key, namespace, model, response, prompt_tokens, completion_tokens, created_at, accessed_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (cache_key(system_prompt, model, text), namespace(system_prompt, model), model, response,
+                 prompt_tokens, completion_tokens, now, now),
+            )
+        with self.lock:
+            self.writes += 1
+            due = self.writes % EVICT_EVERY == 1
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """ Drop expired entries, then the least recently used beyond max_entries. """
+        self._setup()
+        with closing(self._connect()) as conn, conn:
+            removed = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+            removed += conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        return removed
+
+    def retain_namespaces(self, namespaces) -> int:
+        """ Bust every entry written under a prompt or model that is no longer in use. """
+        self._setup()
+        namespaces = list(namespaces)
+        placeholders = ",".join("?" * len(namespaces))
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                f"DELETE FROM llm_cache WHERE namespace NOT IN ({placeholders})", namespaces
+            ).rowcount
+
+    def stats(self) -> dict:
+        self._setup()
+        with closing(self._connect()) as conn:
+            entries, hits, tokens = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hits), 0), "
+                "COALESCE(SUM(hits * (prompt_tokens + completion_tokens)), 0) FROM llm_cache"
+            ).fetchone()
+        return {"entries": entries, "hits": hits, "tokens_saved": tokens}
+
+
+cache = LLMCache() if LLM_CACHE == "on" else None
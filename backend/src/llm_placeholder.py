@@ -1,19 +1,100 @@
+import os
+import time
+from functools import lru_cache
+from dotenv import load_dotenv
+import schema
+import metrics
+import llm_cache
+import metering
+
+load_dotenv()
+
+SYSTEM_PROMPT = """
+You are a meticulous healthcare-compliance analyst.
+Your job is to read the text of a compliance form and decide whether it has been filled out correctly.
+The user message will contain the complete form.
+Sections will be separated by an html comment <!-- comment -->.
+Some sections will be general instructions, others will contain fields that need to be filled out, and others should be left blank.
+Your output should be in the following json format {"correct": boolean, "reasoning": string}
+"""
+
+# Asked of the small first-pass model, which also rates how sure it is so the
+# review can escalate uncertain verdicts.
+SCORED_SYSTEM_PROMPT = SYSTEM_PROMPT.rstrip() + """
+Also rate how confident you are in your decision from 0 to 1.
+Your output should be in the following json format {"correct": boolean, "reasoning": string, "confidence": number}
+"""
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# point at a local stub to exercise the review without the real API
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/openai/")
+MODEL = os.getenv("REVIEW_LARGE_MODEL", "gemini-2.0-flash")
+SMALL_MODEL = os.getenv("REVIEW_SMALL_MODEL", "gemini-2.0-flash-lite")
 
 
-def get_llm_response(document_text: str) -> schema.LanguageModelResponse:
-    client = OpenAI(
+@lru_cache(maxsize=None)
+def get_client():
+    """ Create the OpenAI-compatible Gemini client on first use and reuse its connection pool. """
+    from openai import OpenAI
+    return OpenAI(
         api_key=GEMINI_API_KEY,
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
+        base_url=LLM_BASE_URL
     )
 
-    completion = client.beta.chat.completions.parse(
-        model="gemini-2.0-flash",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": document_text},
-        ],
-        response_format=schema.LanguageModelResponse,
+
+@lru_cache(maxsize=None)
+def get_cache():
+    """ The verdict cache, with entries from earlier prompts or models busted on first use. """
+    if llm_cache.cache is not None:
+        llm_cache.cache.retain_namespaces([
+            llm_cache.namespace(SYSTEM_PROMPT, MODEL),
+            llm_cache.namespace(SCORED_SYSTEM_PROMPT, SMALL_MODEL),
+        ])
+    return llm_cache.cache
+
+
+def complete(document_text: str, system_prompt: str = SYSTEM_PROMPT, model: str = MODEL,
+             response_format=schema.LanguageModelResponse):
+    """ One structured completion, answered from the verdict cache when possible and metered either way. """
+    # identical text under the same prompt and model gets the same verdict, so
+    # re-reviews and blank template forms don't pay for another completion
+    cache = get_cache()
+    if cache is not None:
+        cached = cache.get(system_prompt, model, document_text)
+        if cached is not None:
+            metering.record("gemini", model, cached=True, request_bytes=len(document_text), response_bytes=len(cached))
+            return response_format.model_validate_json(cached)
+
+    client = get_client()
+
+    started = time.perf_counter()
+    with metrics.timed("gemini", "chat_completion"):
+        completion = client.beta.chat.completions.parse(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": document_text},
+            ],
+            response_format=response_format,
+        )
+
+    latency = time.perf_counter() - started
+    response = completion.choices[0].message.parsed
+    usage = completion.usage
+    prompt_tokens = usage.prompt_tokens if usage else 0
+    completion_tokens = usage.completion_tokens if usage else 0
+    response_json = response.model_dump_json() if response is not None else ""
+    metering.record(
+        "gemini", model, request_bytes=len(system_prompt) + len(document_text), response_bytes=len(response_json),
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, latency=latency
     )
+    if cache is not None and response is not None:
+        cache.put(
+            system_prompt, model, document_text, response_json,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+        )
+    return response
+
 
-    return completion.choices[0].message.parsed
+def get_llm_response(document_text: str) -> schema.LanguageModelResponse:
+    return complete(document_text)
@@ -0,0 +1,182 @@
+"""
+Lifecycle of uploaded PDFs in data/.
+
+An upload is pinned from the moment it passes preflight until its raw copy is
+confirmed in S3, and while any stage is still reading it. After that it's an
+ordinary cache entry: kept for fast re-processing while it fits in
+BLOB_CACHE_BYTES, and deleted when it's the least recently used or hasn't been
+touched for BLOB_MAX_AGE_SECONDS. A file that's gone is fetched back from S3.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import select
+import database
+import metrics
+import schema
+from disk_cache import DiskCache
+from syncS3 import download_from_s3, parse_s3_path
+
+# pipeline.local_path() writes here
+BLOB_DIR = "data"
+BLOB_CACHE_BYTES = int(os.getenv("BLOB_CACHE_BYTES", str(2 * 1024 * 1024 * 1024)))
+BLOB_MAX_AGE_SECONDS = int(os.getenv("BLOB_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+
+evictions = metrics.REGISTRY.register(metrics.Counter(
+    "local_blob_evictions_total", "Uploaded PDFs deleted from local disk, by reason.", ("reason",)
+))
+
+
+def blob_name(document_id: str) -> str:
+    return f"{document_id}.pdf"
+
+
+class BlobCache(DiskCache):
+    """ DiskCache of uploads where unconfirmed or in-use files are never evicted. """
+    min_entries = 0
+
+    def __init__(self, root: str, max_bytes: int, max_age: float):
+        super().__init__(root, max_bytes, suffix=".pdf")
+        self.max_age = max_age
+        self.used = {}  # name -> last use, for age eviction
+        self.unconfirmed = set()  # not in S3 yet
+        self.leases = Counter()
+        self.lock = threading.RLock()
+
+    def _load(self):
+        super()._load()
+        self.used = {}
+        for name in self.entries:
+            try:
+                self.used[name] = os.path.getmtime(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    def _evictable(self, name: str) -> bool:
+        return name not in self.unconfirmed and not self.leases[name]
+
+    def _evict(self) -> list:
+        cutoff = time.time() - self.max_age
+        aged = [
+            name for name in self.entries
+            if self.used.get(name, 0) < cutoff and self._evictable(name)
+        ]
+        for name in aged:
+            self.size -= self.entries.pop(name)
+        over_budget = super()._evict()
+        for name in aged + over_budget:
+            self.used.pop(name, None)
+        if aged:
+            evictions.inc("age", amount=len(aged))
+        if over_budget:
+            evictions.inc("budget", amount=len(over_budget))
+        return aged + over_budget
+
+    def _touch(self, name: str):
+        self.entries.move_to_end(name)
+        self.used[name] = time.time()
+
+    def add(self, document_id: str):
+        """ Track an upload that was just written to data/; it stays until confirm(). """
+        name = blob_name(document_id)
+        size = os.path.getsize(self.path(name))
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            self.size += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+            self.unconfirmed.add(name)
+            self._touch(name)
+
+    def confirm(self, document_id: str):
+        """ The raw upload is safely in S3, so the local copy may be evicted once nothing is using it. """
+        name = blob_name(document_id)
+        with self.lock:
+            self.unconfirmed.discard(name)
+            evicted = self._evict() if self.entries is not None else []
+        self._remove(evicted)
+
+    def acquire(self, document_id: str):
+        name = blob_name(document_id)
+        with self.lock:
+            self.leases[name] += 1
+            if self.entries is not None and name in self.entries:
+                self._touch(name)
+
+    def release(self, document_id: str):
+        name = blob_name(document_id)
+        with self.lock:
+            self.leases[name] -= 1
+            if self.leases[name] <= 0:
+                del self.leases[name]
+            evicted = self._evict() if self.entries is not None else []
+        self._remove(evicted)
+
+    @contextmanager
+    def lease(self, document_id: str):
+        """ Keep a document's local copy on disk for the duration of the block. """
+        self.acquire(document_id)
+        try:
+            yield self.path(blob_name(document_id))
+        finally:
+            self.release(document_id)
+
+    def discard(self, name: str):
+        with self.lock:
+            self.unconfirmed.discard(name)
+            self.used.pop(name, None)
+        super().discard(name)
+
+    def ensure(self, document_id: str, s3_path: str = None) -> str:
+        """ Local path of an upload, downloading the raw copy from S3 when it was evicted. """
+        name = blob_name(document_id)
+        path = self.get(name)
+        if path is not None:
+            with self.lock:
+                self.used[name] = time.time()
+            return path
+        if os.path.exists(self.path(name)):
+            # written but never tracked, e.g. still waiting on preflight
+            return self.path(name)
+        if not s3_path:
+            raise FileNotFoundError(f"No local or S3 copy of document {document_id}")
+        return self.put(name, download_from_s3(*parse_s3_path(s3_path)))
+
+    def put(self, name: str, data: bytes) -> str:
+        with self.lock:
+            # set before put() evicts, or the new entry would look infinitely old
+            self.used[name] = time.time()
+        return super().put(name, data)
+
+    def rebuild(self, confirmed: set):
+        """ Re-index data/ after a restart. Files not in `confirmed` are treated as not yet in S3. """
+        with self.lock:
+            self._load()
+            self.unconfirmed = set(self.entries) - confirmed
+            evicted = self._evict()
+        self._remove(evicted)
+
+
+store = BlobCache(BLOB_DIR, BLOB_CACHE_BYTES, BLOB_MAX_AGE_SECONDS)
+
+
+def rebuild():
+    """
+    Rebuild the index at startup. Uploads whose document has an S3 copy, and
+    leftovers no document refers to, become evictable. Uploads still waiting on
+    S3, e.g. queued ones, stay pinned.
+    """
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    names = {entry.name for entry in os.scandir(BLOB_DIR) if entry.is_file() and entry.name.endswith(".pdf")}
+    document_ids = [name[:-len(".pdf")] for name in names]
+    waiting = set()
+    for _, session in database.router.iter_sessions():
+        for start in range(0, len(document_ids), 500):
+            waiting.update(session.execute(
+                select(schema.Document.id)
+                .where(schema.Document.id.in_(document_ids[start:start + 500]), schema.Document.s3_key.is_(None))
+            ).scalars())
+    store.rebuild(names - {blob_name(document_id) for document_id in waiting})
+    print(f"Indexed {len(store.entries)} local uploads ({store.size} bytes, {len(store.unconfirmed)} not yet in S3)")
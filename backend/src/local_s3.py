@@ -0,0 +1,214 @@
+"""
+A stand-in for the S3 client backed by a local directory, for tests and dev.
+
+Set S3_LOCAL_ROOT and syncS3.get_s3_client() returns one of these instead of
+a boto3 client; objects live at S3_LOCAL_ROOT/<bucket>/<key>. It covers the
+calls this backend makes, with boto3's argument and response shapes. Listings
+come from a sorted in-memory index, so they are paginated and ordered like
+S3's without walking the directory on every page. Storage classes and
+restores are only tracked in memory.
+"""
+import bisect
+import io
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class NoSuchUpload(Exception):
+    pass
+
+
+class InvalidObjectState(Exception):
+    pass
+
+
+class LocalS3:
+    exceptions = SimpleNamespace(NoSuchKey=NoSuchKey, NoSuchUpload=NoSuchUpload, InvalidObjectState=InvalidObjectState)
+    # classes that can't be read without a restore; restores here complete at once
+    deep_classes = {"GLACIER", "DEEP_ARCHIVE"}
+
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self.keys = {}  # bucket -> sorted keys
+        self.meta = {}  # (bucket, key) -> (size, last modified)
+        self.uploads = {}  # upload id -> (bucket, key, {part number: bytes})
+        self.classes = {}  # (bucket, key) -> storage class other than STANDARD
+        self.restored = set()  # (bucket, key) of deep-archive objects with a restored copy
+        self._load()
+
+    def _load(self):
+        if not os.path.isdir(self.root):
+            return
+        for bucket in os.listdir(self.root):
+            base = os.path.join(self.root, bucket)
+            for directory, _, files in os.walk(base):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    stat = os.stat(path)
+                    self.index(bucket, os.path.relpath(path, base).replace(os.sep, "/"), stat.st_size, stat.st_mtime)
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.normpath(os.path.join(self.root, bucket)) + os.sep):
+            raise ValueError(f"Key escapes the bucket: {key}")
+        return path
+
+    def index(self, bucket: str, key: str, size: int, modified: float):
+        """ Record an object in the listing index. """
+        with self.lock:
+            keys = self.keys.setdefault(bucket, [])
+            if (bucket, key) not in self.meta:
+                bisect.insort(keys, key)
+            self.meta[(bucket, key)] = (size, modified)
+
+    def _unindex(self, bucket: str, key: str):
+        with self.lock:
+            if self.meta.pop((bucket, key), None) is not None:
+                keys = self.keys[bucket]
+                del keys[bisect.bisect_left(keys, key)]
+
+    def put_object(self, Bucket: str, Key: str, Body=b"", **kwargs):
+        data = Body.encode() if isinstance(Body, str) else Body if isinstance(Body, bytes) else Body.read()
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.index(Bucket, Key, len(data), os.path.getmtime(path))
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket: str, Key: str, **kwargs):
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read())
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None, **kwargs):
+        if self.classes.get((Bucket, Key)) in self.deep_classes and (Bucket, Key) not in self.restored:
+            raise InvalidObjectState(Key)
+        try:
+            with open(self._path(Bucket, Key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise NoSuchKey(Key)
+        if Range:
+            start, _, end = Range.removeprefix("bytes=").partition("-")
+            data = data[int(start):int(end) + 1 if end else None]
+        return {"Body": _Body(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs):
+        meta = self.meta.get((Bucket, Key))
+        if meta is None:
+            raise NoSuchKey(Key)
+        response = {"ContentLength": meta[0], "LastModified": datetime.fromtimestamp(meta[1], timezone.utc)}
+        if (Bucket, Key) in self.classes:
+            response["StorageClass"] = self.classes[(Bucket, Key)]
+        if (Bucket, Key) in self.restored:
+            response["Restore"] = 'ongoing-request="false"'
+        return response
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: dict, StorageClass: str = "STANDARD", **kwargs):
+        source = (CopySource["Bucket"], CopySource["Key"])
+        if source != (Bucket, Key):
+            self.put_object(Bucket=Bucket, Key=Key, Body=self.get_object(Bucket=source[0], Key=source[1])["Body"])
+        elif self.classes.get(source) in self.deep_classes and source not in self.restored:
+            raise InvalidObjectState(Key)
+        self.restored.discard((Bucket, Key))
+        if StorageClass == "STANDARD":
+            self.classes.pop((Bucket, Key), None)
+        else:
+            self.classes[(Bucket, Key)] = StorageClass
+        return {}
+
+    def restore_object(self, Bucket: str, Key: str, RestoreRequest: dict = None, **kwargs):
+        if (Bucket, Key) not in self.meta:
+            raise NoSuchKey(Key)
+        self.restored.add((Bucket, Key))
+        return {}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        self._unindex(Bucket, Key)
+        self.classes.pop((Bucket, Key), None)
+        self.restored.discard((Bucket, Key))
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: dict, **kwargs):
+        for item in Delete["Objects"]:
+            self.delete_object(Bucket=Bucket, Key=item["Key"])
+        return {"Deleted": [{"Key": item["Key"]} for item in Delete["Objects"]]}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", Delimiter: str = None, MaxKeys: int = 1000,
+                        ContinuationToken: str = None, StartAfter: str = None, **kwargs):
+        with self.lock:
+            keys = self.keys.get(Bucket, [])
+            after = max(ContinuationToken or "", StartAfter or "")
+            position = bisect.bisect_right(keys, after) if after else 0
+            position = max(position, bisect.bisect_left(keys, Prefix))
+            contents, prefixes, last = [], [], None
+            while position < len(keys) and len(contents) + len(prefixes) < MaxKeys:
+                key = keys[position]
+                if not key.startswith(Prefix):
+                    break
+                cut = key.find(Delimiter, len(Prefix)) if Delimiter else -1
+                if cut >= 0:
+                    common = key[:cut + len(Delimiter)]
+                    prefixes.append({"Prefix": common})
+                    # skip the rest of the common prefix; the token sorts after all of it
+                    last = common + "\U0010ffff"
+                    position = bisect.bisect_left(keys, last)
+                    continue
+                size, modified = self.meta[(Bucket, key)]
+                contents.append({
+                    "Key": key, "Size": size, "LastModified": datetime.fromtimestamp(modified, timezone.utc),
+                })
+                last = key
+                position += 1
+            truncated = position < len(keys) and keys[position].startswith(Prefix)
+        response = {"KeyCount": len(contents) + len(prefixes), "IsTruncated": truncated}
+        if contents:
+            response["Contents"] = contents
+        if prefixes:
+            response["CommonPrefixes"] = prefixes
+        if truncated:
+            response["NextContinuationToken"] = last
+        return response
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs):
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = (Bucket, Key, {})
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body, **kwargs):
+        if UploadId not in self.uploads:
+            raise NoSuchUpload(UploadId)
+        self.uploads[UploadId][2][PartNumber] = Body.read()
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict, **kwargs):
+        if UploadId not in self.uploads:
+            raise NoSuchUpload(UploadId)
+        parts = self.uploads.pop(UploadId)[2]
+        body = b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+        return self.put_object(Bucket=Bucket, Key=Key, Body=body)
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs):
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+class _Body(io.BytesIO):
+    """ A streaming body with the iter_chunks() that botocore's has. """
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024):
+        while chunk := self.read(chunk_size):
+            yield chunk
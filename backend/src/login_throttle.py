@@ -0,0 +1,101 @@
+"""
+Login attempt throttling, checked before any password is hashed.
+
+Each client IP gets LOGIN_IP_ATTEMPTS attempts per LOGIN_WINDOW_SECONDS, and
+each account LOGIN_ACCOUNT_FAILURES failed attempts in the same window. A
+successful login clears the account's failures. Counts are kept in memory
+per process and bounded to LOGIN_TRACKED_KEYS keys. A limit of 0 disables
+that check.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+import metrics
+
+LOGIN_WINDOW_SECONDS = int(os.getenv("LOGIN_WINDOW_SECONDS", "900"))
+LOGIN_IP_ATTEMPTS = int(os.getenv("LOGIN_IP_ATTEMPTS", "100"))
+LOGIN_ACCOUNT_FAILURES = int(os.getenv("LOGIN_ACCOUNT_FAILURES", "5"))
+LOGIN_TRACKED_KEYS = int(os.getenv("LOGIN_TRACKED_KEYS", "100000"))
+
+outcomes = metrics.REGISTRY.register(metrics.Counter(
+    "login_attempts_total", "Login attempts by outcome.", ("outcome",)
+))
+
+
+class SlidingWindow:
+    """ Timestamps of recent events per key, oldest keys dropped beyond max_keys. """
+
+    def __init__(self, window: float, max_keys: int):
+        self.window = window
+        self.max_keys = max_keys
+        self.events = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _recent(self, key: str, now: float):
+        events = self.events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self.events[key]
+            return None
+        return events
+
+    def retry_after(self, key: str, limit: int) -> int:
+        """ Seconds until key is below limit again, or 0 if it already is. """
+        if not limit:
+            return 0
+        now = time.time()
+        with self.lock:
+            events = self._recent(key, now)
+            if events is None or len(events) < limit:
+                return 0
+            return max(1, int(events[-limit] + self.window - now) + 1)
+
+    def add(self, key: str):
+        now = time.time()
+        with self.lock:
+            events = self._recent(key, now)
+            if events is None:
+                events = self.events[key] = deque()
+            self.events.move_to_end(key)
+            events.append(now)
+            while len(self.events) > self.max_keys:
+                self.events.popitem(last=False)
+
+    def clear(self, key: str):
+        with self.lock:
+            self.events.pop(key, None)
+
+
+attempts_by_ip = SlidingWindow(LOGIN_WINDOW_SECONDS, LOGIN_TRACKED_KEYS)
+failures_by_account = SlidingWindow(LOGIN_WINDOW_SECONDS, LOGIN_TRACKED_KEYS)
+
+
+def account_key(email: str) -> str:
+    return email.strip().lower()
+
+
+def check(email: str, ip: str) -> int:
+    """ Record an attempt from ip; returns a Retry-After in seconds if it must be refused, else 0. """
+    retry_after = max(
+        attempts_by_ip.retry_after(ip, LOGIN_IP_ATTEMPTS),
+        failures_by_account.retry_after(account_key(email), LOGIN_ACCOUNT_FAILURES),
+    )
+    if retry_after:
+        outcomes.inc("throttled")
+        return retry_after
+    attempts_by_ip.add(ip)
+    return 0
+
+
+def failed(email: str):
+    outcomes.inc("failed")
+    failures_by_account.add(account_key(email))
+
+
+def succeeded(email: str):
+    outcomes.inc("succeeded")
+    failures_by_account.clear(account_key(email))
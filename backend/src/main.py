@@ -1,71 +1,68 @@
-from fastapi import FastAPI, Depends, HTTPException, Header, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, Header, UploadFile, File, Request, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, FileResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
+from typing import Optional
 import database
 import schema
 import database_operations
+import events
+import export
+import bulk
+import archive
+import backup
+import recovery
+import admission
+import classifier
+import compliance
+import metrics
+import pipeline
+import metering
+import local_blobs
+import login_throttle
+import passwords
+import previews
+import workers
+import resumable_uploads
+import asyncio
 import random
-from openai import OpenAI
+import json
+import logging
+import uuid
 import os
 from dotenv import load_dotenv
-import requests
-from syncS3 import upload_to_s3, write_s3_json, read_s3_json,update_by_user
-from llm_placeholder import get_llm_response
-from triggerEC2 import notify_data_extraction
-
-os.makedirs("data", exist_ok=True)
-SYSTEM_PROMPT = """
-You are a meticulous healthcare-compliance analyst.
-Your job is to read the text of a compliance form and decide whether it has been filled out correctly.
-The user message will contain the complete form.
-Sections will be separated by an html comment <!-- comment -->.
-Some sections will be general instructions, others will contain fields that need to be filled out, and others should be left blank.
-Your output should be in the following json format {"correct": boolean, "reasoning": string}
-"""
+from syncS3 import write_s3_json, read_s3_json,update_by_user
 
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-LANDING_AI_API_KEY = os.getenv("VISION_AGENT_API_KEY")
-ec2_url = "http://54.234.159.7:8000/extract"
+# modules that log rather than print (recovery, pipeline, events) go to stderr
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(levelname)s %(name)s: %(message)s")
+# httpx logs every outbound request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
-schema.Base.metadata.create_all(bind=database.engine)
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 active_tokens = {}
 TOKEN_BITS = 32
 
 
-
-def get_document_text(path: str) -> str:
-    url = 'https://api.va.landing.ai/v1/tools/agentic-document-analysis'
-    files = {'pdf': open(path, 'rb')}
-    data = {
-        'include_marginalia': 'true',
-        'include_metadata_in_markdown': 'true',
-    }
-    headers = {
-        'Authorization': f'Basic {LANDING_AI_API_KEY}'
-    }
-
-    response = requests.post(url, files=files, data=data, headers=headers)
-    return response.json()
-
-
 def get_token(user: schema.User):
     token = random.getrandbits(TOKEN_BITS)
     active_tokens[token] = user.id
     return token
 
-def create_user_folder(user: schema.User, session: Session):
-    folder = schema.Folder(
-        name=f"{user.first_name} {user.last_name}",
-        organization_id=user.organization_id,
-        user_id=user.id
-    )
-    session.add(folder)
-    session.commit()
+async def create_user_folder(user: schema.User):
+    name = f"{user.first_name} {user.last_name}"
+    organization_id, user_id = user.organization_id, user.id
+    # opening a new tenant's shard migrates it; keep that off the event loop
+    await asyncio.to_thread(database_operations.mirror_to_shard, user)
+
+    def write(session: Session):
+        session.add(schema.Folder(name=name, organization_id=organization_id, user_id=user_id))
+
+    await database.router.run(organization_id, write)
 
 # Use sqlalchemy asyncio in future
 def get_session():
@@ -75,92 +72,124 @@ def get_session():
     finally:
         db.close()
 
-def get_staff(token: int = Header(..., alias="token"), session: Session = Depends(get_session)) -> schema.User:
-    if token in active_tokens:
-        return database_operations.get_user(session, active_tokens[token])
-    raise HTTPException(status_code=403, detail="Invalid token.")
-
-def get_admin(token: int = Header(..., alias="token"), session: Session = Depends(get_session)) -> schema.User:
+def get_principal(token: int = Header(..., alias="token"), session: Session = Depends(get_session)) -> schema.User:
     if token in active_tokens:
         user = database_operations.get_user(session, active_tokens[token])
-        if user.permission == schema.Permission.ADMIN:
+        if user:
             return user
-        raise HTTPException(status_code=403, detail="User does not have admin privileges")
     raise HTTPException(status_code=403, detail="Invalid token.")
 
+def get_staff(user: schema.User = Depends(get_principal)) -> schema.User:
+    return user
+
+def get_admin(user: schema.User = Depends(get_principal)) -> schema.User:
+    if user.permission == schema.Permission.ADMIN:
+        return user
+    raise HTTPException(status_code=403, detail="User does not have admin privileges")
+
+# Session on the database that holds the caller's organization (see database.router)
+def get_tenant_session(user: schema.User = Depends(get_principal)):
+    db = database.router.session_for(user.organization_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Holds an admission slot for an expensive route while the request runs (see admission.ROUTES)
+def admitted(route: str):
+    async def admit(user: schema.User = Depends(get_principal), session: Session = Depends(get_session)):
+        organization_id = user.organization_id
+        # end the principal lookup's transaction so a queued request doesn't hold a pooled
+        # connection; the user reloads on first use after admission
+        session.rollback()
+        try:
+            slot = await admission.acquire(route, organization_id)
+        except admission.Rejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        try:
+            yield
+        finally:
+            slot.release()
+    return admit
+
+class IdempotencyClaim:
+    """ What a request did under its Idempotency-Key, handed to the handler. """
+
+    def __init__(self, document_id: Optional[str] = None):
+        # the document an earlier attempt created, or the one this attempt created once it is committed
+        self.document_id = document_id
+
+async def idempotent(session: Session, key: Optional[str], user: schema.User, request_path: str, handler):
+    """
+    Run handler(claim) -> (status_code, content) at most once per Idempotency-Key.
+    Retries with a used key get the recorded response back; retries while the
+    first attempt is still running get a 409. A retry after an attempt that failed
+    once its document existed gets that document in claim.document_id to resume.
+    """
+    claim = IdempotencyClaim()
+    if not key:
+        status_code, content = await handler(claim)
+        return JSONResponse(status_code=status_code, content=content)
+    record = database_operations.claim_idempotency_key(session, key, user, request_path)
+    if record is not None:
+        if record.request_path != request_path:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if record.status_code is not None:
+            return JSONResponse(
+                status_code=record.status_code, content=json.loads(record.response),
+                headers={"Idempotent-Replayed": "true"}
+            )
+        claim.document_id = database_operations.take_over_idempotency_key(session, record)
+        if claim.document_id is None:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    try:
+        status_code, content = await handler(claim)
+    except BaseException:
+        database_operations.release_idempotency_key(session, key, user.id, claim.document_id)
+        raise
+    database_operations.store_idempotent_response(session, key, user.id, status_code, json.dumps(content))
+    return JSONResponse(status_code=status_code, content=content)
+
+def upload_error(e: resumable_uploads.UploadError) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail)
+
 @asynccontextmanager
-async def load_demo_data(app: FastAPI):
-    database.Base.metadata.drop_all(bind=database.engine)
-    database.Base.metadata.create_all(bind=database.engine)
-    organization = schema.Organization(name="Demo Organization")
-    admin = schema.User(
-        first_name="Alice",
-        last_name="Scott",
-        email="alice@example.com",
-        password="password",
-        role=schema.Role.ADMIN,
-        permission=schema.Permission.ADMIN,
-        organization=organization
-    )
-    staff1 = schema.User(
-        first_name="Max",
-        last_name="Smith",
-        email="max@example.com",
-        password="password",
-        role=schema.Role.STAFF,
-        permission=schema.Permission.STAFF,
-        organization=organization
-    )
-    staff2 = schema.User(
-        first_name="Jamie",
-        last_name="Garcia",
-        email="jamie@example.com",
-        password="password",
-        role=schema.Role.STAFF,
-        permission=schema.Permission.STAFF,
-        organization=organization
-    )
-    folder1 = schema.Folder(
-        name=f"{admin.first_name} {admin.last_name}",
-        organization=organization,
-        user=admin
-    )
-    folder2 = schema.Folder(
-        name=f"{staff1.first_name} {staff1.last_name}",
-        organization=organization,
-        user=staff1
-    )
-    folder3 = schema.Folder(
-        name=f"{staff2.first_name} {staff2.last_name}",
-        organization=organization,
-        user=staff2
-    )
-    doc1 = schema.Document(
-        name="Max's Training Certificate",
-        link="http://example.com/max_training.pdf",
-        organization=organization,
-        folder=folder2,
-    )
-    doc2 = schema.Document(
-        name="Jamie's Background Check",
-        link="http://example.com/jamie_background_check.pdf",
-        organization=organization,
-        folder=folder3,
-        document_type=schema.DocumentType.BACKGROUND_CHECK,
-    )
-    doc3 = schema.Document(
-        name="Jamie's Training Certificate",
-        link="http://example.com/jamie_training.pdf",
-        organization=organization,
-        folder=folder3,
-    )
-    session = database.SessionLocal()
-    session.add_all([organization, admin, staff1, staff2, folder1, folder2, folder3, doc1, doc2, doc3])
-    session.commit()
-    session.close()
+async def lifespan(app: FastAPI):
+    # only creates or upgrades the schema when the stored version is behind;
+    # demo data is loaded explicitly with `python -m commands.seed_demo`
+    os.makedirs("data", exist_ok=True)
+    database.init_db()
+    local_blobs.rebuild()
+    recovery.start()
+    backup.start()
     yield
+    await backup.shutdown()
+    await recovery.shutdown()
+    await bulk.shutdown()
+    await previews.drain()
+    workers.shutdown()
+    await asyncio.to_thread(events.bus.close)
+    database.router.close()
+
+def fast_response_class():
+    """
+    orjson for FastAPI versions that render every response with json.dumps. Newer
+    versions already serialize response models to JSON bytes in pydantic-core,
+    and a custom default class would switch that off, so they keep the default.
+    """
+    import inspect
+    from fastapi.routing import serialize_response
+    if "dump_json" in inspect.signature(serialize_response).parameters:
+        return None
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        return None
+    from fastapi.responses import ORJSONResponse
+    return ORJSONResponse
 
-app = FastAPI(lifespan=load_demo_data)
+response_class = fast_response_class()
+app = FastAPI(lifespan=lifespan, **({"default_response_class": response_class} if response_class else {}))
 
 app.add_middleware(
     CORSMiddleware,
@@ -169,21 +198,44 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 @app.get("/")
 def home():
     return {"message": "Welcome to the CareLumi backend api!"}
 
 @app.post("/auth/login")
-async def login(request: schema.LoginRequest, session: Session = Depends(get_session)):
+async def login(request: schema.LoginRequest, http_request: Request, session: Session = Depends(get_session)):
+    # throttled before the lookup and the hash, so a stuffing burst costs no CPU once refused
+    retry_after = login_throttle.check(request.email, http_request.client.host if http_request.client else "")
+    if retry_after:
+        raise HTTPException(status_code=429, detail="Too many login attempts", headers={"Retry-After": str(retry_after)})
     user = database_operations.get_user_by_email(session, email=request.email)
+    # hand the connection back to the pool now: during a burst, logins waiting on
+    # a hash or on teardown would otherwise hold every pooled connection
+    session.close()
     if not user:
+        login_throttle.failed(request.email)
         raise HTTPException(status_code=404, detail="User not found")
-    if user.password == request.password:
-        token = get_token(user)
-        return {"status": True, "session_token": token}
-    else:
+    try:
+        matches, rehashed = await passwords.verify_async(user.password, request.password)
+    except passwords.PoolBusy:
+        raise HTTPException(status_code=503, detail="Too many logins in progress", headers={"Retry-After": "1"})
+    if not matches:
+        login_throttle.failed(request.email)
         return {"status": False}
+    login_throttle.succeeded(request.email)
+    if rehashed:
+        # plaintext or older-cost rows are upgraded on their first successful login
+        database_operations.set_user_password(session, user.id, rehashed)
+    token = get_token(user)
+    return {"status": True, "session_token": token}
+
+async def hash_password(password: str) -> str:
+    try:
+        return await passwords.hash_async(password)
+    except passwords.PoolBusy:
+        raise HTTPException(status_code=503, detail="Too many registrations in progress", headers={"Retry-After": "1"})
 
 @app.post("/registration/staff")
 async def register_staff(staff: schema.StaffRegistration, session: Session = Depends(get_session)):
@@ -194,11 +246,12 @@ async def register_staff(staff: schema.StaffRegistration, session: Session = Dep
     organization = database_operations.get_organization(session, organization_id=staff.organization_id)
     if not organization:
         raise HTTPException(status_code=404, detail="Organization not found")
+    password = await hash_password(staff.password)
     user = schema.User(
         first_name=staff.first_name,
         last_name=staff.last_name,
         email=staff.email,
-        password=staff.password,
+        password=password,
         role=staff.role,
         permission=schema.Permission.STAFF,
         organization_id=staff.organization_id
@@ -208,7 +261,7 @@ async def register_staff(staff: schema.StaffRegistration, session: Session = Dep
 
     session.add(user)
     session.commit()
-    create_user_folder(user, session)
+    await create_user_folder(user)
     return JSONResponse(status_code=201, content={"status": True, "user": user.to_dict()})
 
 @app.post("/registration/admin")
@@ -217,6 +270,7 @@ async def register_admin(staff: schema.AdminRegistration, session: Session = Dep
         raise HTTPException(status_code=400, detail="Passwords do not match")
     if not staff.agree_to_terms:
         raise HTTPException(status_code=400, detail="You must agree to the terms and conditions")
+    password = await hash_password(staff.password)
     organization = schema.Organization(name=staff.organization_name)
     session.add(organization)
     session.commit()
@@ -224,7 +278,7 @@ async def register_admin(staff: schema.AdminRegistration, session: Session = Dep
         first_name=staff.first_name,
         last_name=staff.last_name,
         email=staff.email,
-        password=staff.password,
+        password=password,
         role=staff.role,
         permission=schema.Permission.ADMIN,
         organization=organization
@@ -236,94 +290,383 @@ async def register_admin(staff: schema.AdminRegistration, session: Session = Dep
     session.commit()
 
     
-    create_user_folder(user, session)
+    await create_user_folder(user)
     return JSONResponse(status_code=201, content={"status": True, "user": user.to_dict()})
 
 # User can only upload to their own folder for now
-@app.post("/organization/document/upload_document")
+@app.post("/organization/document/upload_document", dependencies=[Depends(admitted("upload"))])
 async def upload_document(
     name: str,
-    document_type: schema.DocumentType,
     file: UploadFile,
+    document_type: schema.DocumentType = schema.DocumentType.OTHER,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     user: schema.User = Depends(get_staff),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_tenant_session)
 ):
-    # in production, need to validate file isn't malicious and is valid pdf
-    document = schema.Document(
-        name=name,
-        link="",
-        organization_id=user.organization_id,
-        folder=user.folder,
-        status=schema.DocumentStatus.PENDING,
-        document_type=document_type
-    )
-    session.add(document)
-    session.commit()
-    with open(f"data/{document.id}.pdf", "wb") as f:
+    async def handler(claim: IdempotencyClaim):
+        if claim.document_id is not None:
+            return await resume_upload(session, claim.document_id, user, file)
+        queued = metering.enforce_budget(session, user.organization_id)
+        # the file is on disk and checked before the row exists, so a failed write
+        # or a rejected file leaves no orphaned PENDING document
+        document_id = str(uuid.uuid4())
         # https://fastapi.tiangolo.com/reference/uploadfile/#fastapi.UploadFile.file
-        f.write(file.file.read())
-
-    file.file.seek(0)
-    #reset the file pointer
-
-    bucket_name = "carelumi-data"
-    s3_key = f"organization/{user.organization_id}/{user.id}/raw_documents/{document.id}.pdf"
-    s3_path = upload_to_s3(file.file, bucket_name, s3_key)
-    document.s3_key = s3_path
-    session.commit()
-    #upload the files to S3 and update the new s3_key attribute of document to keep track of things.
-
-    document_text = get_document_text(f"data/{document.id}.pdf")
-
-
-    processed_key = f"organization/{user.organization_id}/{user.id}/processed_documents/{document.id}.json"
-    document.processed_key = processed_key
-
-    upload_to_s3(document_text, bucket_name, processed_key)
-    session.commit()
-    #upload the extracted text to S3
+        pipeline.write_local(document_id, file.file)
+        report = await pipeline.check_upload(document_id)
+        document = schema.Document(
+            id=document_id,
+            name=name,
+            link="",
+            organization_id=user.organization_id,
+            folder=database_operations.get_folder_by_user(session, user_id=user.id),
+            document_type=document_type,
+            document_type_source=classifier.initial_source(document_type),
+            **pipeline.preflight_columns(report, queued)
+        )
+        session.add(document)
+        session.commit()
+        # from here on a failed attempt leaves its document for a retry to resume
+        claim.document_id = document_id
+        events.publish_document_status(document)
+        if document.status == schema.DocumentStatus.QUARANTINED:
+            return 202, {"message": f"Document quarantined: {report['reason']}", "document": document.to_dict()}
+        previews.schedule(document, user.id, pipeline.local_path(document_id))
+        if queued:
+            return 202, {"message": "Document queued until the organization's budget resets", "document": document.to_dict()}
+
+        llm_response = await pipeline.process_document(session, document, user.id, file.file)
+        return 201, {"message": "Document uploaded successfully", "llm_response": llm_response.model_dump()}
+
+    return await idempotent(session, idempotency_key, user, "/organization/document/upload_document", handler)
+
+async def resume_upload(session: Session, document_id: str, user: schema.User, file: UploadFile):
+    """ Finish the document an earlier attempt under the same Idempotency-Key created, from its last stage. """
+    document = database_operations.get_document(session, document_id=document_id)
+    if document.status != schema.DocumentStatus.PENDING:
+        # recovery finished it in the meantime
+        return 201, {"message": "Document uploaded successfully", "document": document.to_dict()}
+    if document.id in pipeline.in_flight or not recovery.claim(session, document):
+        return 202, {"message": "Document is already being processed", "document": document.to_dict()}
+    document.processing_stage = pipeline.infer_stage(document)
+    llm_response = await pipeline.process_document(session, document, user.id, file.file)
+    return 201, {"message": "Document uploaded successfully", "llm_response": llm_response.model_dump()}
+
+# Resumable uploads: init, PUT each chunk at its byte offset (in any order, re-sending
+# any that failed), then complete. GET reports which offsets are still missing.
+@app.post("/organization/document/uploads", status_code=201)
+async def create_upload(
+    request: schema.ResumableUploadRequest,
+    user: schema.User = Depends(get_staff)
+):
+    try:
+        manifest = await asyncio.to_thread(
+            resumable_uploads.store.create,
+            user.id, user.organization_id, request.name, request.document_type.value, request.size, request.chunk_size
+        )
+    except resumable_uploads.UploadError as e:
+        raise upload_error(e)
+    return await asyncio.to_thread(resumable_uploads.store.status, manifest)
 
-    notify_data_extraction(ec2_url, user.organization_id, user.id, document.id)
+@app.get("/organization/document/uploads/{upload_id}")
+async def get_upload(upload_id: str, user: schema.User = Depends(get_staff)):
+    try:
+        manifest = await asyncio.to_thread(resumable_uploads.store.get, upload_id, user.id)
+        return await asyncio.to_thread(resumable_uploads.store.status, manifest)
+    except resumable_uploads.UploadError as e:
+        raise upload_error(e)
+
+@app.put("/organization/document/uploads/{upload_id}")
+async def put_upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    user: schema.User = Depends(get_staff)
+):
+    try:
+        manifest = await asyncio.to_thread(resumable_uploads.store.get, upload_id, user.id)
+        await resumable_uploads.store.write_chunk(manifest, offset, request.stream())
+        return await asyncio.to_thread(resumable_uploads.store.status, manifest)
+    except resumable_uploads.UploadError as e:
+        raise upload_error(e)
+
+@app.post("/organization/document/uploads/{upload_id}/complete", dependencies=[Depends(admitted("upload"))])
+async def complete_upload(
+    upload_id: str,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    user: schema.User = Depends(get_staff),
+    session: Session = Depends(get_tenant_session)
+):
+    try:
+        manifest = await asyncio.to_thread(resumable_uploads.store.get, upload_id, user.id)
+    except resumable_uploads.UploadError as e:
+        raise upload_error(e)
+
+    async def handler(claim: IdempotencyClaim):
+        document_id = manifest["document_id"]
+        document = database_operations.get_document(session, document_id=document_id)
+        if document is not None and document.status != schema.DocumentStatus.PENDING:
+            # finalized by an earlier attempt
+            return 200, {"message": "Document uploaded successfully", "document": document.to_dict()}
+        if manifest.get("completed"):
+            raise HTTPException(status_code=409, detail="Upload is already being finalized")
+        status = await asyncio.to_thread(resumable_uploads.store.status, manifest)
+        if not status["complete"]:
+            raise HTTPException(status_code=409, detail={"message": "Upload is missing chunks", **status})
+        queued = metering.enforce_budget(session, user.organization_id)
+        with metrics.span("upload", "disk_write"):
+            await asyncio.to_thread(resumable_uploads.store.assemble, manifest, pipeline.local_path(document_id))
+        report = await pipeline.check_upload(document_id)
+        created = document is None
+        if created:
+            document = schema.Document(
+                id=document_id,
+                name=manifest["name"],
+                link="",
+                organization_id=user.organization_id,
+                folder=database_operations.get_folder_by_user(session, user_id=user.id),
+                document_type=schema.DocumentType(manifest["document_type"]),
+                document_type_source=classifier.initial_source(schema.DocumentType(manifest["document_type"])),
+                **pipeline.preflight_columns(report, queued)
+            )
+            session.add(document)
+        else:
+            columns = pipeline.preflight_columns(report, queued)
+            if document.processing_stage:
+                # keep an earlier attempt's checkpoint, so its paid stages aren't redone
+                del columns["processing_stage"]
+            for column, value in columns.items():
+                setattr(document, column, value)
+        try:
+            session.commit()
+        except IntegrityError:
+            if not created:
+                raise
+            # a concurrent complete for the same upload inserted the row first and is finalizing it
+            session.rollback()
+            document = database_operations.get_document(session, document_id=document_id)
+            return 202, {"message": "Upload is already being finalized", "document": document.to_dict()}
+        events.publish_document_status(document)
+        if document.status == schema.DocumentStatus.QUARANTINED:
+            await asyncio.to_thread(resumable_uploads.store.mark_complete, manifest)
+            return 202, {"message": f"Document quarantined: {report['reason']}", "document": document.to_dict()}
+        previews.schedule(document, user.id, pipeline.local_path(document_id))
+        if queued:
+            await asyncio.to_thread(resumable_uploads.store.mark_complete, manifest)
+            return 202, {"message": "Document queued until the organization's budget resets", "document": document.to_dict()}
+        llm_response = await pipeline.process_document(
+            session, document, user.id, resumable_uploads.store.s3_parts(manifest)
+        )
+        await asyncio.to_thread(resumable_uploads.store.mark_complete, manifest)
+        return 201, {
+            "message": "Document uploaded successfully",
+            "document": document.to_dict(),
+            "llm_response": llm_response.model_dump()
+        }
+
+    return await idempotent(
+        session, idempotency_key, user, f"/organization/document/uploads/{upload_id}/complete", handler
+    )
 
-    
-    return JSONResponse(status_code=201, content={"message": "Document uploaded successfully", "llm_response": llm_response.json()})
+@app.delete("/organization/document/uploads/{upload_id}")
+async def abort_upload(upload_id: str, user: schema.User = Depends(get_staff)):
+    try:
+        await asyncio.to_thread(resumable_uploads.store.get, upload_id, user.id)
+    except resumable_uploads.UploadError as e:
+        raise upload_error(e)
+    await asyncio.to_thread(resumable_uploads.store.delete, upload_id)
+    return {"message": "Upload aborted"}
 
-@app.get("/organization/document/all")
+@app.get("/organization/document/all", response_model=list[schema.DocumentResponse])
 async def get_all_documents(
+    include_archived: bool = False,
     user: schema.User = Depends(get_admin),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_tenant_session)
 ):
-    return database_operations.get_documents_by_organization(session, organization_id=user.organization_id)
+    return database_operations.get_documents_by_organization(
+        session, organization_id=user.organization_id, include_archived=include_archived
+    )
 
-@app.get("/organization/folder/all")
+@app.get("/organization/folder/all", response_model=list[schema.FolderSummary])
 async def get_all_folders(
     user: schema.User = Depends(get_admin),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_tenant_session)
 ):
     return database_operations.get_folders_by_organization(session, organization_id=user.organization_id)
 
+# Server-sent stream of document status transitions for the admin's organization
+@app.get("/organization/document/events")
+async def document_events(token: int = Header(..., alias="token")):
+    # resolve the admin with a short-lived session so open streams don't pin pooled connections
+    session = database.SessionLocal()
+    try:
+        user = get_admin(get_principal(token, session))
+    finally:
+        session.close()
+    subscription = events.bus.subscribe(user.organization_id)
+    return StreamingResponse(
+        events.sse_stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Only admin can access documents from a specific folder or specific document
-@app.get("/organization/folder/{folder_id}")
+@app.get("/organization/folder/{folder_id}", response_model=list[schema.DocumentResponse])
 async def get_folder(
     folder_id: str,
+    include_archived: bool = False,
     user: schema.User = Depends(get_admin),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_tenant_session)
+):
+    return database_operations.get_documents_by_folder(session, folder_id=folder_id, include_archived=include_archived)
+
+def export_response(pages, filename: str, manifest: bool) -> StreamingResponse:
+    return StreamingResponse(
+        export.stream_zip(pages, manifest),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"}
+    )
+
+# Every raw PDF in a folder, or in the whole organization, as one streamed ZIP for inspections
+@app.get("/organization/folder/{folder_id}/export", dependencies=[Depends(admitted("export"))])
+async def export_folder(
+    folder_id: str,
+    manifest: bool = True,
+    include_archived: bool = False,
+    user: schema.User = Depends(get_admin),
+    session: Session = Depends(get_tenant_session)
+):
+    folder = database_operations.get_folder(session, folder_id=folder_id)
+    if not folder or folder.organization_id != user.organization_id:
+        raise HTTPException(status_code=404, detail="Folder not found")
+    pages = export.export_pages(user.organization_id, folder_id=folder_id, include_archived=include_archived)
+    return export_response(pages, f"folder-{folder_id}.zip", manifest)
+
+@app.get("/organization/export", dependencies=[Depends(admitted("export"))])
+async def export_organization(
+    manifest: bool = True,
+    include_archived: bool = False,
+    user: schema.User = Depends(get_admin)
+):
+    pages = export.export_pages(user.organization_id, include_archived=include_archived)
+    return export_response(pages, f"organization-{user.organization_id}.zip", manifest)
+
+# Thumbnail and preview URLs for every document in a folder, so browsing doesn't pull whole PDFs
+@app.get("/organization/folder/{folder_id}/previews", response_model=list[schema.DocumentPreview])
+async def get_folder_previews(
+    folder_id: str,
+    user: schema.User = Depends(get_admin),
+    session: Session = Depends(get_tenant_session)
+):
+    rows = database_operations.get_document_previews(session, folder_id=folder_id, organization_id=user.organization_id)
+    return [
+        schema.DocumentPreview(
+            document_id=row.id,
+            name=row.name,
+            status=row.status,
+            thumbnail_url=previews.url(row.id, "thumbnail") if row.preview_key else None,
+            preview_url=previews.url(row.id, "preview") if row.preview_key else None
+        )
+        for row in rows
+    ]
+
+@app.get("/organization/document/{document_id}/preview")
+async def get_document_preview(
+    document_id: str,
+    size: str = "thumbnail",
+    user: schema.User = Depends(get_admin),
+    session: Session = Depends(get_tenant_session)
+):
+    if size not in previews.SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(previews.SIZES)}")
+    document = database_operations.get_document(session, document_id=document_id)
+    if not document or document.organization_id != user.organization_id:
+        raise HTTPException(status_code=404, detail="Document not found")
+    path = await previews.fetch(document, size)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Preview not generated yet")
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=86400"})
+
+@app.get("/organization/document/{document_id}/extraction")
+async def get_document_extraction(
+    document_id: str,
+    chunk_id: Optional[list[str]] = Query(None),
+    page: Optional[list[int]] = Query(None),
+    user: schema.User = Depends(get_admin),
+    session: Session = Depends(get_tenant_session)
 ):
-    documents = database_operations.get_documents_by_folder(session, folder_id=folder_id)
-    return [document.to_dict() for document in documents]
+    """ The extracted markdown, or only the chunks asked for by id or page. """
+    document = database_operations.get_document(session, document_id=document_id)
+    if not document or document.organization_id != user.organization_id:
+        raise HTTPException(status_code=404, detail="Document not found")
+    key = document.processed_key
+    if not key:
+        raise HTTPException(status_code=404, detail="Document not extracted yet")
+    if document.storage_tier is not None:
+        # a GLACIER or DEEP_ARCHIVE object can't be read until it is restored
+        raise HTTPException(status_code=409, detail="Document is archived; restore it first")
+
+    def read():
+        reader = pipeline.open_processed(key)
+        if chunk_id is None and page is None:
+            return {"markdown": reader.markdown()}
+        return {"chunks": reader.chunks(chunk_id, page)}
+
+    return await asyncio.to_thread(read)
 
 # for implementation, return pre-signed url to S3 instead of actual file
-@app.get("/organization/document/{document_id}")
+@app.get("/organization/document/{document_id}", response_model=schema.DocumentResponse)
 async def get_document(
     document_id: str,
     user: schema.User = Depends(get_admin),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_tenant_session)
 ):
     document = database_operations.get_document(session, document_id=document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     return document
 
+# Correct the document type; the classifier never overrides a type set here
+@app.put("/organization/document/{document_id}/type", response_model=schema.DocumentResponse)
+async def set_document_type(
+    document_id: str,
+    request: schema.DocumentTypeUpdate,
+    user: schema.User = Depends(get_staff),
+    session: Session = Depends(get_tenant_session)
+):
+    document = database_operations.get_document(session, document_id=document_id)
+    if not document or document.organization_id != user.organization_id:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return database_operations.set_document_type(session, document, request.document_type, classifier.USER)
+
+# Bring an archived document back to hot storage; 202 while S3 is still restoring it
+@app.post("/organization/document/{document_id}/restore", response_model=schema.DocumentResponse)
+async def restore_document(
+    document_id: str,
+    response: Response,
+    user: schema.User = Depends(get_staff),
+    session: Session = Depends(get_tenant_session)
+):
+    document = database_operations.get_document(session, document_id=document_id)
+    if not document or document.organization_id != user.organization_id:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if document.storage_tier is not None:
+        if not await archive.restore(document):
+            response.status_code = 202
+        session.refresh(document)
+    return document
+
+# Change the status of, or re-run extraction or review for, many documents at once
+@app.post("/organization/document/bulk", response_model=schema.BulkDocumentResponse)
+async def bulk_update_documents(
+    request: schema.BulkDocumentRequest,
+    user: schema.User = Depends(get_admin),
+    session: Session = Depends(get_tenant_session)
+):
+    try:
+        return await bulk.apply(session, user.organization_id, request)
+    except bulk.BulkError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 @app.get("/organization/dashboard/overview")
 async def get_dashboard_overview(
     user: schema.User = Depends(get_admin),
@@ -339,24 +682,63 @@ async def get_dashboard_overview(
         )
     raise HTTPException(status_code=403, detail="User does not have access to dashboard")
 
-@app.get("/organization/compliance-folders")
+@app.get("/organization/compliance-folders", response_model=schema.ComplianceFoldersResponse)
 async def get_compliance_folders(
     user: schema.User = Depends(get_admin),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_tenant_session)
 ):
     return database_operations.get_compliance_folder_response(session, organization_id=user.organization_id)
 
+# Per-user and organization-wide gaps against the role requirements matrix
+@app.get("/organization/compliance/gaps", response_model=schema.OrganizationComplianceReport)
+async def get_compliance_gaps(
+    user_id: Optional[str] = None,
+    user: schema.User = Depends(get_admin),
+    session: Session = Depends(get_tenant_session)
+):
+    return compliance.evaluate_organization(session, user.organization_id, user_id=user_id)
+
+# Metered Landing AI and Gemini usage per day, and the organization's budget
+@app.get("/organization/usage/daily", response_model=list[schema.UsageDay])
+async def get_daily_usage(
+    days: int = 30,
+    user: schema.User = Depends(get_admin),
+    session: Session = Depends(get_tenant_session)
+):
+    if not 1 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+    return metering.daily_usage(session, user.organization_id, days)
+
+@app.get("/organization/usage/budget", response_model=schema.BudgetResponse)
+async def get_budget(
+    user: schema.User = Depends(get_admin),
+    session: Session = Depends(get_tenant_session)
+):
+    return metering.budget_report(session, user.organization_id)
+
 # View all data for testing purposes
-@app.get("/dump")
+@app.get("/dump", response_model=schema.DumpResponse)
 async def dump(session: Session = Depends(get_session)):
     orgs = database_operations.get_all_organizations(session)
     users = database_operations.get_all_users(session)
-    folders = database_operations.get_all_folders(session)
-    documents = database_operations.get_all_documents(session)
+    folders, documents = [], []
+    for _, shard_session in database.router.iter_sessions():
+        folders.extend(database_operations.get_all_folders(shard_session))
+        documents.extend(database_operations.get_all_documents(shard_session))
     return {"organizations": orgs, "users": users, "folders": folders, "documents": documents}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/reset_database")
 async def reset_database():
-    database.Base.metadata.drop_all(bind=database.engine)
-    database.Base.metadata.create_all(bind=database.engine)
+    try:
+        await backup.before_reset()
+    except Exception as e:
+        print(f"Backup before reset failed: {e}")
+        raise HTTPException(status_code=503, detail="Could not back up the database; nothing was reset.")
+    for organization_id in database.router.organization_ids():
+        database.reset_db(database.router.shard_for(organization_id).engine)
+    database.reset_db()
     return {"message": "Database reset successfully."}
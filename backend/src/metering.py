@@ -0,0 +1,170 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+import database
+import metrics
+import schema
+
+# List prices in US dollars; override per deployment.
+LANDING_AI_COST_PER_PAGE = float(os.getenv("LANDING_AI_COST_PER_PAGE", "0.03"))
+MODEL_PRICES = {
+    # (input, output) per million tokens
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+MICROS = 1_000_000
+
+cost_total = metrics.REGISTRY.register(metrics.Counter(
+    "metered_cost_usd_total", "Estimated spend on paid services.", ("service",)
+))
+
+# organization, document and page count the current pipeline run is billed to
+_attribution: ContextVar = ContextVar("metering_attribution", default=None)
+
+
+@contextmanager
+def attribute(organization_id: str, document_id: str = None, pages: int = None):
+    """ Bill paid calls made inside the block to this organization and document. """
+    token = _attribution.set((organization_id, document_id, pages or 0))
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+def attributed_pages() -> int:
+    attribution = _attribution.get()
+    return attribution[2] if attribution else 0
+
+
+def cost_micros(service: str, model: str = None, pages: int = 0, prompt_tokens: int = 0,
+                completion_tokens: int = 0) -> int:
+    if service == "landing_ai":
+        return round(pages * LANDING_AI_COST_PER_PAGE * MICROS)
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return round(prompt_tokens * input_price + completion_tokens * output_price)
+
+
+def record(service: str, model: str = None, cached: bool = False, request_bytes: int = 0,
+           response_bytes: int = 0, prompt_tokens: int = 0, completion_tokens: int = 0, pages: int = 0,
+           latency: float = 0.0):
+    """
+    Queue a usage row for the attributed organization. Calls made outside
+    attribute() (scripts, tests) aren't metered.
+    """
+    attribution = _attribution.get()
+    if attribution is None:
+        return
+    organization_id, document_id, _ = attribution
+    cost = 0 if cached else cost_micros(service, model, pages, prompt_tokens, completion_tokens)
+    cost_total.inc(service, amount=cost / MICROS)
+    row = dict(
+        organization_id=organization_id, document_id=document_id, service=service, model=model, cached=cached,
+        request_bytes=request_bytes, response_bytes=response_bytes, prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens, pages=pages, latency_ms=round(latency * 1000), cost_micros=cost,
+        created_at=schema.utcnow(),
+    )
+    # group-committed with other small writes; nothing waits on the result
+    database.router.submit(organization_id, lambda session: session.add(schema.UsageRecord(**row)))
+
+
+def period_starts(now: datetime) -> tuple:
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day, day.replace(day=1)
+
+
+def spent_since(session: Session, organization_id: str, since: datetime) -> int:
+    return session.execute(
+        select(func.coalesce(func.sum(schema.UsageRecord.cost_micros), 0)).where(
+            schema.UsageRecord.organization_id == organization_id, schema.UsageRecord.created_at >= since
+        )
+    ).scalar_one()
+
+
+def get_budget(session: Session, organization_id: str):
+    return session.get(schema.OrganizationBudget, organization_id)
+
+
+def over_budget(session: Session, organization_id: str, now: datetime = None):
+    """
+    (action, seconds until the exhausted period resets) once an organization
+    has spent its daily or monthly limit, otherwise None.
+    """
+    budget = get_budget(session, organization_id)
+    if budget is None or (budget.daily_limit_micros is None and budget.monthly_limit_micros is None):
+        return None
+    now = now or schema.utcnow()
+    day, month = period_starts(now)
+    if budget.monthly_limit_micros is not None and spent_since(session, organization_id, month) >= budget.monthly_limit_micros:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        return budget.action, int((next_month - now).total_seconds()) + 1
+    if budget.daily_limit_micros is not None and spent_since(session, organization_id, day) >= budget.daily_limit_micros:
+        return budget.action, int((day + timedelta(days=1) - now).total_seconds()) + 1
+    return None
+
+
+def enforce_budget(session: Session, organization_id: str) -> bool:
+    """
+    Gate paid work for an organization. Returns True when work should be
+    queued until the budget resets; raises a 429 when it should be refused.
+    """
+    verdict = over_budget(session, organization_id)
+    if verdict is None:
+        return False
+    action, retry_after = verdict
+    if action == schema.BudgetAction.QUEUE:
+        return True
+    raise HTTPException(
+        status_code=429,
+        detail="Organization has used its extraction and review budget",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def daily_usage(session: Session, organization_id: str, days: int = 30) -> list:
+    """ Usage per day and service for the last `days` days, oldest first. """
+    since = period_starts(schema.utcnow())[0] - timedelta(days=days - 1)
+    record = schema.UsageRecord
+    day = func.date(record.created_at)
+    rows = session.execute(
+        select(
+            day.label("day"),
+            record.service,
+            func.count(),
+            func.sum(record.cached),
+            func.sum(record.pages),
+            func.sum(record.prompt_tokens),
+            func.sum(record.completion_tokens),
+            func.sum(record.request_bytes),
+            func.sum(record.response_bytes),
+            func.sum(record.latency_ms),
+            func.sum(record.cost_micros),
+        )
+        .where(record.organization_id == organization_id, record.created_at >= since)
+        .group_by(day, record.service)
+        .order_by(day, record.service)
+    ).all()
+    return [
+        schema.UsageDay(
+            day=row[0], service=row[1], requests=row[2], cached=row[3], pages=row[4], prompt_tokens=row[5],
+            completion_tokens=row[6], request_bytes=row[7], response_bytes=row[8], latency_ms=row[9],
+            cost_usd=row[10] / MICROS,
+        )
+        for row in rows
+    ]
+
+
+def budget_report(session: Session, organization_id: str) -> schema.BudgetResponse:
+    budget = get_budget(session, organization_id)
+    day, month = period_starts(schema.utcnow())
+    return schema.BudgetResponse(
+        daily_limit_usd=budget.daily_limit_micros / MICROS if budget and budget.daily_limit_micros is not None else None,
+        monthly_limit_usd=budget.monthly_limit_micros / MICROS if budget and budget.monthly_limit_micros is not None else None,
+        action=budget.action if budget else schema.BudgetAction.THROTTLE,
+        spent_today_usd=spent_since(session, organization_id, day) / MICROS,
+        spent_this_month_usd=spent_since(session, organization_id, month) / MICROS,
+    )
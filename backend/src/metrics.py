@@ -0,0 +1,205 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# per-request SQL query counter, set by the middleware and read by the engine hooks
+_request_queries: ContextVar = ContextVar("request_queries", default=None)
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{str(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # per-bucket counts (last slot is +Inf), sum, count
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((labels, [list(s[0]), s[1], s[2]]) for labels, s in self.series.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                label_text = _format_labels(self.labelnames, labels, ("le", bound))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+request_latency = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+))
+request_queries = REGISTRY.register(Histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request.", ("method", "route"), COUNT_BUCKETS
+))
+stage_latency = REGISTRY.register(Histogram(
+    "pipeline_stage_duration_seconds", "Time spent in each processing pipeline stage.", ("pipeline", "stage")
+))
+stage_errors = REGISTRY.register(Counter(
+    "pipeline_stage_errors_total", "Pipeline stages that raised.", ("pipeline", "stage")
+))
+db_query_latency = REGISTRY.register(Histogram(
+    "db_query_duration_seconds", "SQL statement latency by statement type.", ("operation",)
+))
+external_call_latency = REGISTRY.register(Histogram(
+    "external_call_duration_seconds", "Latency of S3 and HTTP calls to other services.", ("service", "operation")
+))
+external_call_errors = REGISTRY.register(Counter(
+    "external_call_errors_total", "S3 and HTTP calls to other services that raised.", ("service", "operation")
+))
+
+
+@contextmanager
+def span(pipeline: str, stage: str):
+    """ Time one stage of a processing pipeline. """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(pipeline, stage)
+        raise
+    finally:
+        stage_latency.observe(time.perf_counter() - start, pipeline, stage)
+
+
+@contextmanager
+def timed(service: str, operation: str):
+    """ Time a call to S3 or another HTTP service. """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        external_call_errors.inc(service, operation)
+        raise
+    finally:
+        external_call_latency.observe(time.perf_counter() - start, service, operation)
+
+
+def current_query_count() -> int:
+    counter = _request_queries.get()
+    return counter[0] if counter is not None else 0
+
+
+def instrument_engine(engine):
+    """ Record count and duration of every statement run on the engine. """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        db_query_latency.observe(elapsed, operation)
+        counter = _request_queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+    return engine
+
+
+class MetricsMiddleware:
+    """ ASGI middleware recording latency and query count per route template. """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        counter = [0]
+        token = _request_queries.set(counter)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_queries.reset(token)
+            # label by the matched route template so ids don't explode cardinality
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            request_latency.observe(elapsed, scope["method"], path, status[0])
+            request_queries.observe(counter[0], scope["method"], path)
+
+
+def render() -> str:
+    return REGISTRY.render()
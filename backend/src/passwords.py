@@ -0,0 +1,119 @@
+"""
+Password hashing with scrypt, run off the event loop.
+
+Hashes are stored as scrypt$n$r$p$salt$hash (base64, unpadded) so the cost can
+be raised later: a login that verifies against older parameters, or against a
+legacy plaintext row, returns a fresh hash for the caller to store.
+
+hashlib.scrypt releases the GIL, so a small thread pool is enough to keep the
+loop free. At most PASSWORD_WORKERS + PASSWORD_QUEUE operations wait for it;
+beyond that PoolBusy is raised at once, so a burst of logins can't queue up
+unbounded work and drag every other request's latency with it.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import metrics
+
+PREFIX = "scrypt"
+# 2**14 * 8 * 128 bytes = 16 MiB per hash
+SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+SALT_BYTES = 16
+HASH_BYTES = 32
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+# waiting operations beyond the workers; bounds the worst case at about (1 + queue / workers) hashes
+PASSWORD_QUEUE = int(os.getenv("PASSWORD_QUEUE", str(4 * PASSWORD_WORKERS)))
+
+latency = metrics.REGISTRY.register(metrics.Histogram(
+    "password_hash_duration_seconds", "Time to hash or verify one password, including the wait for a worker.",
+    ("operation",)
+))
+rejected = metrics.REGISTRY.register(metrics.Counter(
+    "password_pool_rejected_total", "Password operations refused because the worker pool was full.", ()
+))
+
+
+class PoolBusy(Exception):
+    pass
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES, maxmem=128 * n * r * p + 1024 * 1024
+    )
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(PREFIX + "$")
+
+
+def hash_password(password: str) -> str:
+    """ A new hash with the configured cost. Blocking; use hash_async on the event loop. """
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(stored: str, password: str) -> tuple:
+    """
+    (matches, replacement). replacement is a fresh hash when the password matched
+    a plaintext row or a hash with other cost parameters, otherwise None.
+    """
+    if not is_hashed(stored):
+        # legacy plaintext row, upgraded on its first successful login
+        if hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8")):
+            return True, hash_password(password)
+        return False, None
+    _, n, r, p, salt, digest = stored.split("$")
+    n, r, p = int(n), int(r), int(p)
+    if not hmac.compare_digest(_scrypt(password, _unb64(salt), n, r, p), _unb64(digest)):
+        return False, None
+    if (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P):
+        return True, hash_password(password)
+    return True, None
+
+
+@lru_cache(maxsize=None)
+def get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="passwords")
+
+
+_in_flight = 0
+
+
+async def _run(operation: str, function, *args):
+    # only touched from the event loop thread, so a plain counter is enough
+    global _in_flight
+    if _in_flight >= PASSWORD_WORKERS + PASSWORD_QUEUE:
+        rejected.inc()
+        raise PoolBusy()
+    _in_flight += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), function, *args)
+    finally:
+        _in_flight -= 1
+        latency.observe(time.perf_counter() - started, operation)
+
+
+async def hash_async(password: str) -> str:
+    return await _run("hash", hash_password, password)
+
+
+async def verify_async(stored: str, password: str) -> tuple:
+    return await _run("verify", verify_password, stored, password)
@@ -0,0 +1,353 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import database
+import events
+import schema
+import metrics
+import database_operations
+import preflight
+import metering
+import local_blobs
+import processed_format
+import classifier
+from syncS3 import upload_to_s3, upload_parts_to_s3, S3Source, BUCKET_NAME
+from review import review_document
+from triggerEC2 import notify_data_extraction
+
+load_dotenv()
+
+LANDING_AI_API_KEY = os.getenv("VISION_AGENT_API_KEY")
+ec2_url = "http://54.234.159.7:8000/extract"
+# "compact" stores extraction results in the packed format, "json" as plain JSON
+PROCESSED_FORMAT = os.getenv("PROCESSED_FORMAT", "compact")
+# extraction results are kept here from the moment Landing AI returns until they're in S3
+EXTRACTION_DIR = os.getenv("EXTRACTION_DIR", "data/extractions")
+
+# Checkpoints, in order. Document.processing_stage holds the last one a document
+# completed, so an interrupted pipeline resumes after it instead of starting over.
+RECEIVED = "received"
+RAW_STORED = "raw_stored"
+EXTRACTED = "extracted"
+PROCESSED_STORED = "processed_stored"
+NOTIFIED = "notified"
+REVIEWED = "reviewed"
+STAGES = (RECEIVED, RAW_STORED, EXTRACTED, PROCESSED_STORED, NOTIFIED, REVIEWED)
+# set instead of a stage when neither S3 nor data/ has the upload any more
+LOST = "lost"
+
+logger = logging.getLogger(__name__)
+
+queued_outcomes = metrics.REGISTRY.register(metrics.Counter(
+    "pipeline_queued_documents_total", "Queued documents run by process_queued, by outcome.", ("outcome",)
+))
+
+# documents whose pipeline is running in this process, by id
+in_flight = {}
+# set at shutdown; queued documents aren't started any more
+draining = False
+
+
+def get_document_text(path: str) -> dict:
+    import requests
+
+    url = 'https://api.va.landing.ai/v1/tools/agentic-document-analysis'
+    files = {'pdf': open(path, 'rb')}
+    data = {
+        'include_marginalia': 'true',
+        'include_metadata_in_markdown': 'true',
+    }
+    headers = {
+        'Authorization': f'Basic {LANDING_AI_API_KEY}'
+    }
+
+    started = time.perf_counter()
+    with metrics.timed("landing_ai", "document_analysis"):
+        response = requests.post(url, files=files, data=data, headers=headers)
+    metering.record(
+        "landing_ai", request_bytes=os.path.getsize(path), response_bytes=len(response.content),
+        pages=metering.attributed_pages(), latency=time.perf_counter() - started
+    )
+    return response.json()
+
+
+def local_path(document_id: str) -> str:
+    return f"data/{document_id}.pdf"
+
+
+def raw_key(organization_id: str, user_id: str, document_id: str) -> str:
+    return f"organization/{organization_id}/{user_id}/raw_documents/{document_id}.pdf"
+
+
+def processed_key(organization_id: str, user_id: str, document_id: str, compact: bool = None) -> str:
+    compact = PROCESSED_FORMAT == "compact" if compact is None else compact
+    extension = "pack" if compact else "json"
+    return f"organization/{organization_id}/{user_id}/processed_documents/{document_id}.{extension}"
+
+
+def encode_processed(document_text: dict, key: str):
+    """ The object body to store under a processed key: packed for .pack keys, the dict itself for .json. """
+    if key.endswith(".pack"):
+        return io.BytesIO(processed_format.encode(document_text))
+    return document_text
+
+
+def open_processed(key: str) -> processed_format.ProcessedReader:
+    """ A lazy reader over a stored extraction result in either format. """
+    return processed_format.reader(S3Source(BUCKET_NAME, key))
+
+
+def write_local(document_id: str, file_obj):
+    """ Write an upload to data/ via a temp file, so a failed write never leaves a partial PDF behind. """
+    path = local_path(document_id)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with metrics.span("upload", "disk_write"), open(temp_path, "wb") as f:
+            f.write(file_obj.read())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    file_obj.seek(0)
+
+
+async def check_upload(document_id: str) -> dict:
+    """
+    Preflight a stored upload before anything is sent to S3 or extraction.
+    Rejected files are deleted and raise a 422; quarantined files are moved
+    out of data/ and come back with action "quarantine".
+    """
+    path = local_path(document_id)
+    report = await preflight.run(path)
+    if report["action"] == preflight.REJECT:
+        os.remove(path)
+        raise HTTPException(status_code=422, detail=f"Upload rejected: {report['reason']}")
+    if report["action"] == preflight.QUARANTINE:
+        preflight.quarantine(path)
+    else:
+        local_blobs.store.add(document_id)
+    return report
+
+
+def extraction_path(document_id: str) -> str:
+    return os.path.join(EXTRACTION_DIR, f"{document_id}.json")
+
+
+def save_extraction(document_id: str, document_text: dict):
+    os.makedirs(EXTRACTION_DIR, exist_ok=True)
+    path = extraction_path(document_id)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(document_text, f)
+    os.replace(temp_path, path)
+
+
+def load_extraction(document_id: str) -> dict:
+    with open(extraction_path(document_id)) as f:
+        return json.load(f)
+
+
+def discard_extraction(document_id: str):
+    try:
+        os.remove(extraction_path(document_id))
+    except FileNotFoundError:
+        pass
+
+
+def infer_stage(document: schema.Document) -> str:
+    """ The last completed stage of a row written before stages were recorded. """
+    if document.processing_stage:
+        return document.processing_stage
+    if document.processed_key:
+        return PROCESSED_STORED
+    if document.s3_key:
+        return RAW_STORED
+    return RECEIVED
+
+
+def reached(document: schema.Document, stage: str) -> bool:
+    return STAGES.index(document.processing_stage or RECEIVED) >= STAGES.index(stage)
+
+
+def checkpoint(session: Session, document: schema.Document, stage: str):
+    document.processing_stage = stage
+    document.processing_updated_at = schema.utcnow()
+    session.commit()
+
+
+def preflight_columns(report: dict, queued: bool = False) -> dict:
+    """ Document column values for a preflight report; queued documents wait for budget. """
+    if report["action"] == preflight.QUARANTINE:
+        status = schema.DocumentStatus.QUARANTINED
+    elif queued:
+        status = schema.DocumentStatus.QUEUED
+    else:
+        status = schema.DocumentStatus.PENDING
+    return {
+        "page_count": report["page_count"],
+        "encrypted": report["encrypted"],
+        "has_text_layer": report["has_text_layer"],
+        "preflight_reason": report["reason"],
+        "status": status,
+        "processing_stage": RECEIVED if status == schema.DocumentStatus.PENDING else None,
+        "processing_updated_at": schema.utcnow(),
+    }
+
+
+async def process_document(session: Session, document: schema.Document, user_id: str,
+                           raw=None) -> schema.LanguageModelResponse:
+    """
+    Run a stored upload through S3, extraction, notification and review, then set its status.
+    The local copy is kept until the pipeline finishes, then left to the local_blobs budget.
+
+    raw is the original file object, or a list of chunk path groups from a
+    resumable upload, which goes to S3 as a multipart upload. Stages the
+    document already completed are skipped; raw is only read if the raw copy
+    isn't in S3 yet, and is opened from data/ when None.
+    """
+    in_flight[document.id] = document
+    try:
+        with metering.attribute(document.organization_id, document.id, document.page_count), \
+                local_blobs.store.lease(document.id):
+            return await _process_document(session, document, user_id, raw)
+    finally:
+        in_flight.pop(document.id, None)
+
+
+def store_raw(raw, document_id: str, key: str) -> str:
+    """ Upload the raw PDF from a file object, resumable chunks, or data/ when raw is None. """
+    if isinstance(raw, list):
+        return upload_parts_to_s3(raw, BUCKET_NAME, key)
+    if raw is None:
+        with open(local_path(document_id), "rb") as f:
+            return upload_to_s3(f, BUCKET_NAME, key)
+    return upload_to_s3(raw, BUCKET_NAME, key)
+
+
+def store_processed(document_text: dict, key: str):
+    upload_to_s3(encode_processed(document_text, key), BUCKET_NAME, key)
+
+
+async def _process_document(session: Session, document: schema.Document, user_id: str,
+                            raw) -> schema.LanguageModelResponse:
+    # every stage below blocks on S3, Landing AI, the EC2 notifier or the LLM,
+    # so each runs in a thread and the event loop keeps serving requests
+    organization_id = document.organization_id
+    if not reached(document, RAW_STORED):
+        key = raw_key(organization_id, user_id, document.id)
+        with metrics.span("upload", "s3_raw"):
+            document.s3_key = await asyncio.to_thread(store_raw, raw, document.id, key)
+        checkpoint(session, document, RAW_STORED)
+    local_blobs.store.confirm(document.id)
+
+    if not reached(document, EXTRACTED):
+        path = await asyncio.to_thread(local_blobs.store.ensure, document.id, document.s3_key)
+        with metrics.span("upload", "extraction"):
+            document_text = await asyncio.to_thread(get_document_text, path)
+        # on disk before anything else can fail, so a restart never pays for this extraction twice
+        await asyncio.to_thread(save_extraction, document.id, document_text)
+        checkpoint(session, document, EXTRACTED)
+
+    if not reached(document, PROCESSED_STORED):
+        document_text = await asyncio.to_thread(load_extraction, document.id)
+        document.processed_key = processed_key(organization_id, user_id, document.id)
+        with metrics.span("upload", "s3_processed"):
+            await asyncio.to_thread(store_processed, document_text, document.processed_key)
+        markdown = document_text["data"]["markdown"]
+        if document.document_type_source != classifier.USER:
+            with metrics.span("upload", "classify"):
+                prediction = await asyncio.to_thread(classifier.classify, markdown)
+            if prediction is not None:
+                document.document_type, document.document_type_confidence = prediction
+                document.document_type_source = classifier.CLASSIFIER
+                document.version = schema.Document.version + 1
+        checkpoint(session, document, PROCESSED_STORED)
+        discard_extraction(document.id)
+    else:
+        markdown = await asyncio.to_thread(lambda: open_processed(document.processed_key).markdown())
+
+    if not reached(document, NOTIFIED):
+        with metrics.span("upload", "notify"):
+            await asyncio.to_thread(notify_data_extraction, ec2_url, organization_id, user_id, document.id)
+        checkpoint(session, document, NOTIFIED)
+
+    with metrics.span("upload", "llm_review"):
+        llm_response, tier = await asyncio.to_thread(review_document, markdown)
+    await database_operations.set_document_status(
+        document,
+        schema.DocumentStatus.COMPLETE if llm_response.correct else schema.DocumentStatus.INCORRECT,
+        review_tier=tier, processing_stage=REVIEWED, processing_updated_at=schema.utcnow()
+    )
+    return llm_response
+
+
+async def process_queued(session: Session, organization_id: str = None, document_ids: list = None) -> int:
+    """
+    Run queued documents through the pipeline, oldest first, until an
+    organization is out of budget again. A document that fails goes back in
+    the queue. Returns the number processed.
+    """
+    query = (
+        select(schema.Document, schema.Folder.user_id)
+        .join(schema.Folder, schema.Document.folder_id == schema.Folder.id)
+        .where(schema.Document.status == schema.DocumentStatus.QUEUED)
+        .order_by(schema.Document.created_at)
+    )
+    if organization_id:
+        query = query.where(schema.Document.organization_id == organization_id)
+    if document_ids is not None:
+        query = query.where(schema.Document.id.in_(document_ids))
+    processed = 0
+    exhausted = set()
+    for document, user_id in session.execute(query).all():
+        if draining:
+            break
+        if document.organization_id in exhausted:
+            continue
+        if metering.over_budget(session, document.organization_id):
+            exhausted.add(document.organization_id)
+            continue
+        previous_status = document.status
+        document.status = schema.DocumentStatus.PENDING
+        document.processing_updated_at = schema.utcnow()
+        document.version = schema.Document.version + 1
+        session.commit()
+        events.publish_document_status(document, previous_status)
+        try:
+            await process_document(session, document, user_id)
+        except Exception:
+            # one bad document mustn't strand the rest of the batch; put it back in the
+            # queue, from its last checkpoint, for the next run
+            logger.exception("Queued document %s failed; re-queued", document.id)
+            queued_outcomes.inc("failed")
+            session.rollback()
+            document.status = schema.DocumentStatus.QUEUED
+            document.processing_updated_at = schema.utcnow()
+            document.version = schema.Document.version + 1
+            session.commit()
+            events.publish_document_status(document, schema.DocumentStatus.PENDING)
+            continue
+        queued_outcomes.inc("processed")
+        # usage rows go through the group-committing writer; wait for them before re-checking the budget
+        await database.router.run(document.organization_id, lambda _: None)
+        processed += 1
+    return processed
+
+
+async def drain(timeout: float) -> list:
+    """ Wait up to timeout seconds for running pipelines; returns the ids of documents still running. """
+    global draining
+    draining = True
+    deadline = time.monotonic() + timeout
+    while in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    # their sessions may already be closed, so don't hand out the instances
+    return list(in_flight)
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import shutil
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+import workers
+
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", "30"))
+QUARANTINE_DIR = os.getenv("QUARANTINE_DIR", "data/quarantine")
+MAX_PAGES = int(os.getenv("PREFLIGHT_MAX_PAGES", "2000"))
+# pages sampled for fonts when deciding whether the PDF has a text layer
+TEXT_LAYER_PAGES = 3
+# the spec allows junk before the header, and some scanners write a little
+HEADER_WINDOW = 1024
+# catalog and name-tree entries that run code or carry payloads when the file is opened
+ACTIVE_CONTENT = ("/JavaScript", "/JS", "/Launch", "/EmbeddedFiles", "/RichMedia", "/XFA")
+# /OpenAction and /AA in the catalog only count for these action types; Word and
+# Acrobat routinely write an /OpenAction destination (open at page N)
+RISKY_ACTIONS = {
+    "/JavaScript", "/Launch", "/ImportData", "/SubmitForm", "/GoToR", "/GoToE", "/URI", "/Rendition",
+    "/RichMediaExecute",
+}
+# links followed in an action's /Next chain
+MAX_ACTIONS = 64
+
+REJECT = "reject"
+QUARANTINE = "quarantine"
+ACCEPT = "accept"
+
+
+def _has_fonts(page) -> bool:
+    resources = page.get("/Resources")
+    if resources is None:
+        return False
+    fonts = resources.get_object().get("/Font")
+    return fonts is not None and len(fonts.get_object()) > 0
+
+
+def _risky_actions(action) -> set:
+    """ Risky action types in an action dictionary and its /Next chain; destination arrays have none. """
+    found, pending, seen = set(), [action], 0
+    while pending and seen < MAX_ACTIONS:
+        action = pending.pop().get_object()
+        seen += 1
+        if isinstance(action, list):
+            # a /Next array of actions, or a destination like [page /Fit]
+            pending.extend(item for item in action if isinstance(item.get_object(), dict) and "/S" in item.get_object())
+            continue
+        if not isinstance(action, dict):
+            continue
+        if action.get("/S") in RISKY_ACTIONS:
+            found.add(action["/S"])
+        if "/Next" in action:
+            pending.append(action["/Next"])
+    return found
+
+
+def _active_content(reader) -> list:
+    root = reader.trailer["/Root"].get_object()
+    found = [key for key in ACTIVE_CONTENT if key in root]
+    if "/OpenAction" in root:
+        found.extend(f"/OpenAction {kind}" for kind in _risky_actions(root["/OpenAction"]))
+    if "/AA" in root:
+        triggers = root["/AA"].get_object()
+        for trigger in triggers.values() if isinstance(triggers, dict) else []:
+            found.extend(f"/AA {kind}" for kind in _risky_actions(trigger))
+    names = root.get("/Names")
+    if names is not None:
+        found.extend(key for key in ACTIVE_CONTENT if key in names.get_object())
+    acro_form = root.get("/AcroForm")
+    if acro_form is not None and "/XFA" in acro_form.get_object():
+        found.append("/XFA")
+    return sorted(set(found))
+
+
+def inspect_pdf(path: str) -> dict:
+    """
+    Check one file and describe it. Runs in a worker process, so it only takes
+    and returns plain values.
+    """
+    from pypdf import PdfReader
+    from pypdf.errors import PdfReadError
+
+    result = {
+        "action": ACCEPT,
+        "reason": None,
+        "file_size": os.path.getsize(path),
+        "pdf_version": None,
+        "page_count": None,
+        "encrypted": False,
+        "has_text_layer": False,
+        "active_content": [],
+    }
+    with open(path, "rb") as f:
+        header = f.read(HEADER_WINDOW)
+    start = header.find(b"%PDF-")
+    if start < 0:
+        return {**result, "action": REJECT, "reason": "not a PDF"}
+    result["pdf_version"] = header[start + 5:start + 8].decode("ascii", "replace")
+
+    try:
+        reader = PdfReader(path, strict=False)
+        if reader.is_encrypted:
+            result["encrypted"] = True
+            # owner-password-only files open with an empty user password
+            if not reader.decrypt(""):
+                return {**result, "action": QUARANTINE, "reason": "password protected"}
+        result["page_count"] = len(reader.pages)
+        result["active_content"] = _active_content(reader)
+        result["has_text_layer"] = any(
+            _has_fonts(reader.pages[index]) for index in range(min(TEXT_LAYER_PAGES, result["page_count"]))
+        )
+    except (PdfReadError, ValueError, KeyError, TypeError, AttributeError, IndexError, RecursionError) as e:
+        return {**result, "action": REJECT, "reason": f"unreadable PDF: {e}"}
+
+    if result["page_count"] == 0:
+        return {**result, "action": REJECT, "reason": "PDF has no pages"}
+    if result["page_count"] > MAX_PAGES:
+        return {**result, "action": REJECT, "reason": f"PDF has more than {MAX_PAGES} pages"}
+    if result["active_content"]:
+        return {**result, "action": QUARANTINE, "reason": "active content: " + ", ".join(result["active_content"])}
+    return result
+
+
+def _unchecked(path: str, reason: str) -> dict:
+    return {
+        "action": QUARANTINE, "reason": reason, "file_size": os.path.getsize(path),
+        "pdf_version": None, "page_count": None, "encrypted": False, "has_text_layer": False,
+        "active_content": [],
+    }
+
+
+async def run(path: str) -> dict:
+    """
+    Preflight a stored upload off the event loop. A file that takes too long,
+    or that crashes the worker twice, is quarantined.
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.span("upload", "preflight"):
+        for _ in range(2):
+            pool = workers.get_pool()
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(pool, inspect_pdf, path), PREFLIGHT_TIMEOUT)
+            except BrokenProcessPool:
+                # a worker died, on this file or another one in the pool (e.g. OOM on
+                # a hostile file); try once more on a fresh pool
+                workers.reset(pool)
+            except asyncio.TimeoutError:
+                # the worker would keep going and hold its slot; kill it
+                workers.recycle(pool)
+                return _unchecked(path, "preflight timed out")
+        return _unchecked(path, "preflight crashed")
+
+
+def quarantine(path: str) -> str:
+    """ Move a suspect upload out of data/ so no later stage picks it up. """
+    os.makedirs(QUARANTINE_DIR, exist_ok=True)
+    destination = os.path.join(QUARANTINE_DIR, os.path.basename(path))
+    shutil.move(path, destination)
+    return destination
+
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import os
+from concurrent.futures.process import BrokenProcessPool
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+import database
+import local_blobs
+import metrics
+import schema
+import workers
+from disk_cache import DiskCache
+from syncS3 import upload_to_s3, download_from_s3, BUCKET_NAME
+
+PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", "data/previews")
+PREVIEW_CACHE_BYTES = int(os.getenv("PREVIEW_CACHE_BYTES", str(256 * 1024 * 1024)))
+PREVIEW_WIDTH = 800
+THUMBNAIL_WIDTH = 160
+JPEG_QUALITY = 80
+SIZES = ("thumbnail", "preview")
+
+cache = DiskCache(PREVIEW_CACHE_DIR, PREVIEW_CACHE_BYTES)
+# keeps background tasks referenced until they finish
+_tasks = set()
+
+
+def render_first_page(path: str):
+    """
+    Render page one as a JPEG preview and thumbnail. Runs in a worker process.
+    Returns None when pypdfium2 or Pillow isn't installed (the `previews` extra).
+    """
+    try:
+        import pypdfium2
+    except ImportError:
+        return None
+    pdf = pypdfium2.PdfDocument(path)
+    try:
+        page = pdf[0]
+        image = page.render(scale=PREVIEW_WIDTH / page.get_width()).to_pil().convert("RGB")
+    finally:
+        pdf.close()
+    rendered = {}
+    for size, width in (("preview", PREVIEW_WIDTH), ("thumbnail", THUMBNAIL_WIDTH)):
+        if width < image.width:
+            image.thumbnail((width, width * 4))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        rendered[size] = buffer.getvalue()
+    return rendered
+
+
+def preview_key(organization_id: str, user_id: str, document_id: str, size: str) -> str:
+    return f"organization/{organization_id}/{user_id}/previews/{document_id}_{size}.jpg"
+
+
+def cache_name(document_id: str, size: str) -> str:
+    return f"{document_id}_{size}.jpg"
+
+
+def url(document_id: str, size: str) -> str:
+    return f"/organization/document/{document_id}/preview?size={size}"
+
+
+async def generate(organization_id: str, user_id: str, document_id: str, path: str):
+    """ Render, cache and store the previews for one document, then record the preview key. """
+    loop = asyncio.get_running_loop()
+    try:
+        with metrics.span("previews", "render"):
+            rendered = await loop.run_in_executor(workers.get_pool(), render_first_page, path)
+    except BrokenProcessPool:
+        workers.reset()
+        raise
+    if rendered is None:
+        return
+    for size, data in rendered.items():
+        cache.put(cache_name(document_id, size), data)
+        with metrics.span("previews", "s3_upload"):
+            await asyncio.to_thread(
+                upload_to_s3, io.BytesIO(data), BUCKET_NAME, preview_key(organization_id, user_id, document_id, size)
+            )
+    key = preview_key(organization_id, user_id, document_id, "preview")
+
+    def write(session: Session):
+        session.execute(update(schema.Document).where(schema.Document.id == document_id).values(preview_key=key))
+
+    await database.router.run(organization_id, write)
+
+
+def schedule(document: schema.Document, user_id: str, path: str):
+    """ Generate previews in the background; the upload response doesn't wait for them. """
+    organization_id, document_id = document.organization_id, document.id
+    # taken now, before the pipeline can confirm the upload and let it be evicted
+    local_blobs.store.acquire(document_id)
+
+    async def run():
+        try:
+            await generate(organization_id, user_id, document_id, path)
+        except Exception as e:
+            print(f"Failed to generate previews for {document_id}: {e}")
+        finally:
+            local_blobs.store.release(document_id)
+
+    task = asyncio.create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def drain():
+    """ Wait for scheduled preview tasks, e.g. at shutdown. """
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
+
+
+async def fetch(document: schema.Document, size: str):
+    """ Local path of a preview, filling the cache from S3 on a miss. None if it was never generated. """
+    name = cache_name(document.id, size)
+    path = cache.get(name)
+    if path is not None or not document.preview_key:
+        return path
+    key = document.preview_key.replace("_preview.jpg", f"_{size}.jpg")
+    data = await asyncio.to_thread(download_from_s3, BUCKET_NAME, key)
+    return cache.put(name, data)
@@ -0,0 +1,232 @@
+"""
+Compact container for processed extraction results.
+
+    magic b"CLPX" | version u8 | codec u8 | index length u32 LE | index | sections
+
+The index is JSON compressed with the codec and records where each section
+lives, relative to the end of the index. The markdown, the remaining metadata
+and blocks of CHUNKS_PER_BLOCK chunks are compressed separately, so a reader
+fetches and decodes only the sections it's asked for. Over S3 that means a
+ranged GET for the header and one for the markdown instead of the whole object.
+"""
+import json
+import struct
+import zlib
+
+MAGIC = b"CLPX"
+VERSION = 1
+HEADER = struct.Struct("<4sBBI")
+CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD = 0, 1, 2
+CHUNKS_PER_BLOCK = 32
+# first read; big enough for the header, index and usually the markdown
+PREFETCH_BYTES = 64 * 1024
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def default_codec() -> int:
+    """ zstd when the optional zstandard package is installed, zlib otherwise. """
+    return CODEC_ZSTD if _zstd() is not None else CODEC_ZLIB
+
+
+def compress(data: bytes, codec: int) -> bytes:
+    if codec == CODEC_ZSTD:
+        return _zstd().ZstdCompressor(level=10).compress(data)
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, 6)
+    return data
+
+
+def decompress(data: bytes, codec: int) -> bytes:
+    if codec == CODEC_ZSTD:
+        zstandard = _zstd()
+        if zstandard is None:
+            raise RuntimeError("This object is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    return data
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _pages(chunk: dict) -> list:
+    return sorted({grounding.get("page") for grounding in chunk.get("grounding") or [] if isinstance(grounding, dict)}
+                  - {None})
+
+
+def is_compact(prefix: bytes) -> bool:
+    return prefix[:4] == MAGIC
+
+
+def encode(result: dict, codec: int = None) -> bytes:
+    """ Pack a Landing AI response ({"data": {"markdown", "chunks", ...}, ...}) into the container. """
+    codec = default_codec() if codec is None else codec
+    data = result.get("data") or {}
+    markdown = data.get("markdown") or ""
+    chunks = data.get("chunks") or []
+    rest = {**result, "data": {key: value for key, value in data.items() if key not in ("markdown", "chunks")}}
+
+    body = bytearray()
+    index = {"markdown": None, "meta": None, "blocks": [], "chunks": []}
+
+    def append(payload: bytes) -> list:
+        compressed = compress(payload, codec)
+        span = [len(body), len(compressed)]
+        body.extend(compressed)
+        return span
+
+    index["markdown"] = append(markdown.encode("utf-8"))
+    for start in range(0, len(chunks), CHUNKS_PER_BLOCK):
+        block = chunks[start:start + CHUNKS_PER_BLOCK]
+        index["blocks"].append(append(_dumps(block)))
+        for position, chunk in enumerate(block):
+            index["chunks"].append([
+                start // CHUNKS_PER_BLOCK, position, chunk.get("chunk_id"), chunk.get("chunk_type"), _pages(chunk)
+            ])
+    index["meta"] = append(_dumps(rest))
+    packed_index = compress(_dumps(index), codec)
+    return HEADER.pack(MAGIC, VERSION, codec, len(packed_index)) + packed_index + bytes(body)
+
+
+class BytesSource:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self.data[offset:offset + length]
+
+    def read_all(self) -> bytes:
+        return self.data
+
+
+class FileSource:
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self, offset: int, length: int) -> bytes:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def read_all(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class ProcessedReader:
+    """
+    Lazy view of a packed extraction. Only the header and index are read up
+    front; sections are fetched and decoded on first use and then kept.
+    """
+
+    def __init__(self, source, prefix: bytes = None):
+        self.source = source
+        self.prefix = source.read(0, PREFETCH_BYTES) if prefix is None else prefix
+        magic, self.version, self.codec, index_length = HEADER.unpack_from(self.prefix)
+        if magic != MAGIC:
+            raise ValueError("Not a packed extraction")
+        if self.version > VERSION:
+            raise ValueError(f"Packed extraction version {self.version} is newer than this reader ({VERSION})")
+        index_end = HEADER.size + index_length
+        self.index = json.loads(decompress(self._read(HEADER.size, index_length), self.codec))
+        self.base = index_end
+        self.blocks = {}
+        self._markdown = None
+        self._meta = None
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if offset + length <= len(self.prefix):
+            return self.prefix[offset:offset + length]
+        return self.source.read(offset, length)
+
+    def _section(self, span: list) -> bytes:
+        return decompress(self._read(self.base + span[0], span[1]), self.codec)
+
+    def markdown(self) -> str:
+        if self._markdown is None:
+            self._markdown = self._section(self.index["markdown"]).decode("utf-8")
+        return self._markdown
+
+    def chunk_index(self) -> list:
+        """ [(chunk_id, chunk_type, pages)] for every chunk, without decoding any chunk. """
+        return [(chunk_id, chunk_type, pages) for _, _, chunk_id, chunk_type, pages in self.index["chunks"]]
+
+    def _block(self, number: int) -> list:
+        if number not in self.blocks:
+            self.blocks[number] = json.loads(self._section(self.index["blocks"][number]))
+        return self.blocks[number]
+
+    def chunks(self, chunk_ids=None, pages=None) -> list:
+        """ Chunks filtered by id and/or page, decoding only the blocks that hold them. """
+        chunk_ids = set(chunk_ids) if chunk_ids is not None else None
+        pages = set(pages) if pages is not None else None
+        selected = []
+        for block, position, chunk_id, _, chunk_pages in self.index["chunks"]:
+            if chunk_ids is not None and chunk_id not in chunk_ids:
+                continue
+            if pages is not None and not pages.intersection(chunk_pages):
+                continue
+            selected.append(self._block(block)[position])
+        return selected
+
+    def metadata(self) -> dict:
+        """ Everything except the markdown and chunks. """
+        if self._meta is None:
+            self._meta = json.loads(self._section(self.index["meta"]))
+        return self._meta
+
+    def to_dict(self) -> dict:
+        """ The original response, decoded in full. """
+        meta = self.metadata()
+        chunks = [chunk for number in range(len(self.index["blocks"])) for chunk in self._block(number)]
+        return {**meta, "data": {"markdown": self.markdown(), "chunks": chunks, **(meta.get("data") or {})}}
+
+
+class JsonReader(ProcessedReader):
+    """ Same interface over a legacy plain-JSON object, which has to be decoded whole. """
+
+    def __init__(self, result: dict):
+        self.result = result
+        self.version = 0
+        data = result.get("data") or {}
+        self._chunks = data.get("chunks") or []
+
+    def markdown(self) -> str:
+        return (self.result.get("data") or {}).get("markdown") or ""
+
+    def chunk_index(self) -> list:
+        return [(chunk.get("chunk_id"), chunk.get("chunk_type"), _pages(chunk)) for chunk in self._chunks]
+
+    def chunks(self, chunk_ids=None, pages=None) -> list:
+        chunk_ids = set(chunk_ids) if chunk_ids is not None else None
+        pages = set(pages) if pages is not None else None
+        return [
+            chunk for chunk in self._chunks
+            if (chunk_ids is None or chunk.get("chunk_id") in chunk_ids)
+            and (pages is None or pages.intersection(_pages(chunk)))
+        ]
+
+    def metadata(self) -> dict:
+        data = self.result.get("data") or {}
+        return {**self.result, "data": {key: value for key, value in data.items() if key not in ("markdown", "chunks")}}
+
+    def to_dict(self) -> dict:
+        return self.result
+
+
+def reader(source) -> ProcessedReader:
+    """ A reader for either format, sniffing the first bytes. Sources provide read(offset, length) and read_all(). """
+    prefix = source.read(0, PREFETCH_BYTES)
+    if is_compact(prefix):
+        return ProcessedReader(source, prefix)
+    # a short read is already the whole object
+    return JsonReader(json.loads(prefix if len(prefix) < PREFETCH_BYTES else source.read_all()))
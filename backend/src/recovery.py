@@ -0,0 +1,160 @@
+"""
+Resume document pipelines interrupted by a restart.
+
+At startup every PENDING document whose checkpoint is older than
+RECOVERY_GRACE_SECONDS is claimed and run through the pipeline again from
+its last completed stage (see pipeline.STAGES); one whose upload is gone
+from both data/ and S3 is marked lost instead of being retried at every
+start, and one whose saved extraction is gone is extracted again. The scan
+is repeated once after the grace period, for documents a previous process
+was still draining when this one started. A claim is a conditional UPDATE on the checkpoint time,
+so two processes starting together never resume the same document.
+
+At shutdown no new document is picked up, and running pipelines get
+PIPELINE_DRAIN_SECONDS to finish; anything left resumes on the next start.
+"""
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from sqlalchemy import select, update
+import database
+import metrics
+import pipeline
+import schema
+from syncS3 import parse_s3_path, s3_object_exists
+
+RECOVERY = os.getenv("RECOVERY", "on")
+# a checkpoint this recent may belong to a pipeline another process is still running
+RECOVERY_GRACE_SECONDS = int(os.getenv("RECOVERY_GRACE_SECONDS", "300"))
+PIPELINE_DRAIN_SECONDS = float(os.getenv("PIPELINE_DRAIN_SECONDS", "25"))
+
+logger = logging.getLogger(__name__)
+
+recovered = metrics.REGISTRY.register(metrics.Counter(
+    "pipeline_recovered_total", "Interrupted documents resumed at startup, by the stage they resumed after and outcome.",
+    ("stage", "outcome")
+))
+
+_stopping = None
+_task = None
+
+
+def stale_documents(session, before) -> list:
+    """ (document, uploader id) for unfinished documents last checkpointed before `before`, oldest first. """
+    document = schema.Document
+    return list(session.execute(
+        select(document, schema.Folder.user_id)
+        .join(schema.Folder, document.folder_id == schema.Folder.id)
+        .where(document.status == schema.DocumentStatus.PENDING)
+        .where(document.processing_stage.is_(None) | (document.processing_stage != pipeline.LOST))
+        .where((document.processing_updated_at.is_(None)) | (document.processing_updated_at < before))
+        .order_by(document.created_at)
+    ).all())
+
+
+def claim(session, document: schema.Document) -> bool:
+    """ Take over a document unless another process touched its checkpoint since it was read. """
+    now = schema.utcnow()
+    result = session.execute(
+        update(schema.Document)
+        .where(schema.Document.id == document.id)
+        .where(schema.Document.processing_updated_at.is_not_distinct_from(document.processing_updated_at))
+        .values(processing_updated_at=now),
+        execution_options={"synchronize_session": False},
+    )
+    session.commit()
+    if result.rowcount != 1:
+        return False
+    document.processing_updated_at = now
+    return True
+
+
+def raw_exists(document: schema.Document) -> bool:
+    """ Whether the upload is still in data/ or in S3. """
+    if os.path.exists(pipeline.local_path(document.id)):
+        return True
+    return bool(document.s3_key) and s3_object_exists(*parse_s3_path(document.s3_key))
+
+
+async def resume(session, document: schema.Document, user_id: str) -> str:
+    stage = document.processing_stage = pipeline.infer_stage(document)
+    try:
+        try:
+            await pipeline.process_document(session, document, user_id)
+        except FileNotFoundError:
+            session.rollback()
+            if pipeline.infer_stage(document) != pipeline.EXTRACTED or os.path.exists(pipeline.extraction_path(document.id)):
+                raise
+            # checkpointed as extracted, but data/extractions lost the result; extract again
+            logger.warning("Extraction of document %s is missing; extracting it again", document.id)
+            pipeline.checkpoint(session, document, pipeline.RAW_STORED)
+            await pipeline.process_document(session, document, user_id)
+        outcome = "resumed"
+    except FileNotFoundError:
+        session.rollback()
+        if await asyncio.to_thread(raw_exists, document):
+            logger.exception("Failed to resume document %s after %s", document.id, stage)
+            outcome = "failed"
+        else:
+            logger.error("Cannot resume document %s: its upload is in neither data/ nor S3", document.id)
+            pipeline.checkpoint(session, document, pipeline.LOST)
+            outcome = "lost"
+    except Exception:
+        logger.exception("Failed to resume document %s after %s", document.id, stage)
+        session.rollback()
+        outcome = "failed"
+    recovered.inc(stage, outcome)
+    return outcome
+
+
+async def scan() -> int:
+    """ Resume every stale unfinished document once. Returns how many were taken over. """
+    before = schema.utcnow() - timedelta(seconds=RECOVERY_GRACE_SECONDS)
+    resumed = 0
+    for _, session in database.router.iter_sessions():
+        for document, user_id in stale_documents(session, before):
+            if _stopping is not None and _stopping.is_set():
+                return resumed
+            if not claim(session, document):
+                continue
+            await resume(session, document, user_id)
+            resumed += 1
+    return resumed
+
+
+async def run():
+    try:
+        resumed = await scan()
+        if resumed:
+            logger.info("Resumed %d interrupted documents", resumed)
+        try:
+            await asyncio.wait_for(_stopping.wait(), RECOVERY_GRACE_SECONDS)
+            return
+        except asyncio.TimeoutError:
+            pass
+        resumed = await scan()
+        if resumed:
+            logger.info("Resumed %d interrupted documents", resumed)
+    except Exception:
+        logger.exception("Recovery scan failed")
+
+
+def start():
+    global _stopping, _task
+    _stopping = asyncio.Event()
+    pipeline.draining = False
+    if RECOVERY == "on":
+        _task = asyncio.create_task(run())
+
+
+async def shutdown():
+    """ Stop picking up documents and give running pipelines until the drain deadline. """
+    if _stopping is not None:
+        _stopping.set()
+    remaining = await pipeline.drain(PIPELINE_DRAIN_SECONDS)
+    for document_id in remaining:
+        logger.warning("Document %s still running; it resumes from its last stage on the next start", document_id)
+    if _task is not None and not _task.done():
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data/uploads")
+UPLOAD_TTL_SECONDS = int(os.getenv("UPLOAD_TTL_SECONDS", str(24 * 3600)))
+UPLOAD_PURGE_INTERVAL_SECONDS = int(os.getenv("UPLOAD_PURGE_INTERVAL_SECONDS", "600"))
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(512 * 1024 * 1024)))
+# S3 rejects multipart parts under 5 MiB (except the last), so consecutive
+# chunks are grouped until they reach this size.
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadStore:
+    """
+    Chunk state for resumable uploads, kept on local disk:
+
+        {root}/{upload_id}/manifest.json
+        {root}/{upload_id}/chunks/{index:06d}
+
+    Each chunk is written to a temp file and renamed into place, so a dropped
+    connection never leaves a half-written chunk that looks complete. Apart from
+    write_chunk every method blocks on the disk; async callers run them in a
+    thread.
+    """
+
+    def __init__(self, root: str = UPLOAD_DIR):
+        self.root = root
+        self.purged_at = None
+        self.lock = threading.Lock()
+
+    def _dir(self, upload_id: str) -> str:
+        try:
+            uuid.UUID(upload_id)
+        except ValueError:
+            raise UploadError(404, "Upload not found")
+        return os.path.join(self.root, upload_id)
+
+    def _chunk_path(self, upload_id: str, index: int) -> str:
+        return os.path.join(self._dir(upload_id), "chunks", f"{index:06d}")
+
+    def _write_manifest(self, upload_id: str, manifest: dict):
+        path = os.path.join(self._dir(upload_id), "manifest.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def create(self, user_id: str, organization_id: str, name: str, document_type: str, size: int,
+               chunk_size: int = None) -> dict:
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        if not 0 < size <= MAX_UPLOAD_SIZE:
+            raise UploadError(413, f"Upload size must be between 1 and {MAX_UPLOAD_SIZE} bytes")
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            raise UploadError(400, f"chunk_size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE} bytes")
+        self.purge_in_background()
+        upload_id = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.root, upload_id, "chunks"))
+        manifest = {
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "organization_id": organization_id,
+            "name": name,
+            "document_type": document_type,
+            "size": size,
+            "chunk_size": chunk_size,
+            # pinned up front so every finalize retry targets the same Document row
+            "document_id": str(uuid.uuid4()),
+            "created_at": time.time(),
+        }
+        self._write_manifest(upload_id, manifest)
+        return manifest
+
+    def get(self, upload_id: str, user_id: str = None) -> dict:
+        try:
+            with open(os.path.join(self._dir(upload_id), "manifest.json")) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise UploadError(404, "Upload not found")
+        if user_id is not None and manifest["user_id"] != user_id:
+            raise UploadError(404, "Upload not found")
+        return manifest
+
+    def chunk_count(self, manifest: dict) -> int:
+        return -(-manifest["size"] // manifest["chunk_size"])
+
+    def expected_length(self, manifest: dict, index: int) -> int:
+        return min(manifest["chunk_size"], manifest["size"] - index * manifest["chunk_size"])
+
+    def received(self, manifest: dict) -> list:
+        if manifest.get("completed"):
+            return list(range(self.chunk_count(manifest)))
+        chunk_dir = os.path.join(self._dir(manifest["upload_id"]), "chunks")
+        return sorted(int(name) for name in os.listdir(chunk_dir) if name.isdigit())
+
+    def status(self, manifest: dict) -> dict:
+        received = self.received(manifest)
+        chunk_size = manifest["chunk_size"]
+        missing = sorted(set(range(self.chunk_count(manifest))) - set(received))
+        return {
+            "upload_id": manifest["upload_id"],
+            "size": manifest["size"],
+            "chunk_size": chunk_size,
+            "received_bytes": sum(self.expected_length(manifest, index) for index in received),
+            "missing_offsets": [index * chunk_size for index in missing],
+            "complete": not missing,
+            "document_id": manifest["document_id"],
+        }
+
+    async def write_chunk(self, manifest: dict, offset: int, stream) -> int:
+        """ Store the bytes of one chunk from an async byte stream. Re-sending a chunk replaces it. """
+        chunk_size = manifest["chunk_size"]
+        if manifest.get("completed"):
+            raise UploadError(409, "Upload already completed")
+        if offset < 0 or offset % chunk_size or offset >= manifest["size"]:
+            raise UploadError(400, f"offset must be a multiple of {chunk_size} below {manifest['size']}")
+        index = offset // chunk_size
+        expected = self.expected_length(manifest, index)
+        path = self._chunk_path(manifest["upload_id"], index)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        written = 0
+        # file I/O runs in threads so a slow disk doesn't stall the event loop
+        f = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            try:
+                async for data in stream:
+                    written += len(data)
+                    if written > expected:
+                        raise UploadError(400, f"Chunk at offset {offset} must be {expected} bytes")
+                    await asyncio.to_thread(f.write, data)
+            finally:
+                await asyncio.to_thread(f.close)
+            if written != expected:
+                raise UploadError(400, f"Chunk at offset {offset} must be {expected} bytes, got {written}")
+            await asyncio.to_thread(os.replace, temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return index
+
+    def assemble(self, manifest: dict, destination: str):
+        """ Concatenate the chunks into destination via a temp file and rename. """
+        temp_path = f"{destination}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as out:
+            for index in range(self.chunk_count(manifest)):
+                with open(self._chunk_path(manifest["upload_id"], index), "rb") as chunk:
+                    shutil.copyfileobj(chunk, out)
+        os.replace(temp_path, destination)
+
+    def s3_parts(self, manifest: dict) -> list:
+        """ Chunk paths grouped into S3 multipart parts, in part-number order. """
+        per_part = max(1, -(-S3_MIN_PART_SIZE // manifest["chunk_size"]))
+        paths = [self._chunk_path(manifest["upload_id"], index) for index in range(self.chunk_count(manifest))]
+        return [paths[start:start + per_part] for start in range(0, len(paths), per_part)]
+
+    def mark_complete(self, manifest: dict) -> dict:
+        """ Drop the chunks but keep the manifest, so a repeated finalize still finds its document. """
+        shutil.rmtree(os.path.join(self._dir(manifest["upload_id"]), "chunks"), ignore_errors=True)
+        manifest = {**manifest, "completed": True}
+        self._write_manifest(manifest["upload_id"], manifest)
+        return manifest
+
+    def delete(self, upload_id: str):
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def purge_in_background(self):
+        """
+        Start purge_expired on its own thread, at most once per
+        UPLOAD_PURGE_INTERVAL_SECONDS. Returns the thread, or None if it was too soon.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.purged_at is not None and now - self.purged_at < UPLOAD_PURGE_INTERVAL_SECONDS:
+                return None
+            self.purged_at = now
+        thread = threading.Thread(target=self.purge_expired, name="upload-purge", daemon=True)
+        thread.start()
+        return thread
+
+    def purge_expired(self):
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - UPLOAD_TTL_SECONDS
+        for upload_id in os.listdir(self.root):
+            path = os.path.join(self.root, upload_id)
+            # writing a chunk touches chunks/, rewriting the manifest touches the upload dir
+            touched = [os.path.join(path, name) for name in ("", "chunks") if os.path.isdir(os.path.join(path, name))]
+            if touched and max(os.path.getmtime(entry) for entry in touched) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+store = UploadStore()
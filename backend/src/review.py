@@ -0,0 +1,137 @@
+import os
+import re
+from dataclasses import dataclass, field
+import metrics
+import schema
+from llm_placeholder import complete, SCORED_SYSTEM_PROMPT, SMALL_MODEL
+
+HEURISTICS = "heuristics"
+SMALL = "small"
+LARGE = "large"
+
+
+def _env_list(name: str, default: str) -> tuple:
+    return tuple(item.strip().lower() for item in os.getenv(name, default).split(",") if item.strip())
+
+
+@dataclass(frozen=True)
+class ReviewConfig:
+    # tiers tried in order; the last one always answers
+    tiers: tuple = field(default_factory=lambda: _env_list("REVIEW_TIERS", "heuristics,small,large"))
+    # labels containing any of these words, as whole words, must not be blank
+    required_fields: tuple = field(default_factory=lambda: _env_list("REVIEW_REQUIRED_FIELDS", "name,date,signature"))
+    # small-model verdicts below this confidence go to the large model
+    escalate_below: float = float(os.getenv("REVIEW_ESCALATE_BELOW", "0.8"))
+    # reasoning that hedges is escalated whatever the confidence
+    hedges: tuple = field(default_factory=lambda: _env_list(
+        "REVIEW_HEDGES", "unclear,ambiguous,cannot determine,can't determine,not sure,unable to,possibly,illegible"
+    ))
+
+
+CONFIG = ReviewConfig()
+
+decisions = metrics.REGISTRY.register(metrics.Counter(
+    "review_decisions_total", "Document review verdicts by deciding tier.", ("tier", "correct")
+))
+escalations = metrics.REGISTRY.register(metrics.Counter(
+    "review_escalations_total", "Small-model verdicts passed on to the large model, by reason.", ("reason",)
+))
+
+_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_ANCHOR = re.compile(r"<a id=['\"][^'\"]*['\"]>\s*</a>")
+# "Label: value" lines, optionally bulleted or bold
+_FIELD = re.compile(r"^\s*(?:[-*]\s+)?\**(?P<label>[A-Za-z][\w /&'().#-]{0,60}?)\**\s*:\s*(?P<value>.*)$")
+_BLANK_VALUE = re.compile(r"^[\s_.\-—]*$|^\[\s?\]$|^☐$")
+
+
+def _required(label: str, config: ReviewConfig) -> bool:
+    """ Whether a label names a required field, by whole word ("Date" but not "Candidate"). """
+    return any(re.search(rf"\b{re.escape(word)}\b", label.lower()) for word in config.required_fields)
+
+
+@dataclass
+class FormScan:
+    fields: int
+    blank: list
+    required_blank: list
+
+
+def scan_form(markdown: str, config: ReviewConfig = CONFIG) -> FormScan:
+    """ Find "Label: value" fields in extracted markdown and which of them are blank. """
+    text = _ANCHOR.sub("", _COMMENT.sub("\n", markdown))
+    fields, blank, required_blank = 0, [], []
+    for line in text.splitlines():
+        match = _FIELD.match(line)
+        if not match:
+            continue
+        fields += 1
+        label = match.group("label").strip()
+        if _BLANK_VALUE.match(match.group("value").strip("* ")):
+            blank.append(label)
+            if _required(label, config):
+                required_blank.append(label)
+    return FormScan(fields, blank, required_blank)
+
+
+def heuristic_verdict(markdown: str, config: ReviewConfig = CONFIG):
+    """
+    A rejection for forms that are plainly incomplete, otherwise None. Filled-in
+    fields say nothing about whether their values are right, or whether a
+    section should have been left blank, so only a model approves a form.
+    """
+    scan = scan_form(markdown, config)
+    if scan.required_blank:
+        return schema.LanguageModelResponse(
+            correct=False, reasoning="Required field left blank: " + ", ".join(scan.required_blank)
+        )
+    return None
+
+
+def escalation_reason(verdict, config: ReviewConfig = CONFIG):
+    """ Why a small-model verdict isn't trusted, or None to accept it. """
+    if verdict is None:
+        return "no_answer"
+    if verdict.confidence < config.escalate_below:
+        return "low_confidence"
+    reasoning = verdict.reasoning.lower()
+    if not reasoning.strip() or any(hedge in reasoning for hedge in config.hedges):
+        return "ambiguous"
+    return None
+
+
+def review_document(markdown: str, config: ReviewConfig = CONFIG) -> tuple:
+    """
+    Review extracted form text with the cheapest tier that can decide it.
+    Returns (LanguageModelResponse, tier).
+    """
+    for tier in config.tiers[:-1]:
+        verdict = None
+        if tier == HEURISTICS:
+            verdict = heuristic_verdict(markdown, config)
+        elif tier == SMALL:
+            try:
+                scored = complete(markdown, SCORED_SYSTEM_PROMPT, SMALL_MODEL, schema.ScoredModelResponse)
+            except Exception as e:
+                print(f"Small-model review failed, escalating: {e}")
+                scored = None
+            reason = escalation_reason(scored, config)
+            if reason:
+                escalations.inc(reason)
+            else:
+                verdict = schema.LanguageModelResponse(correct=scored.correct, reasoning=scored.reasoning)
+        if verdict is not None:
+            decisions.inc(tier, verdict.correct)
+            return verdict, tier
+
+    tier = config.tiers[-1] if config.tiers else LARGE
+    if tier == HEURISTICS:
+        verdict = heuristic_verdict(markdown, config) or schema.LanguageModelResponse(
+            correct=False, reasoning="Form could not be checked automatically."
+        )
+    elif tier == SMALL:
+        scored = complete(markdown, SCORED_SYSTEM_PROMPT, SMALL_MODEL, schema.ScoredModelResponse)
+        verdict = schema.LanguageModelResponse(correct=scored.correct, reasoning=scored.reasoning)
+    else:
+        verdict = complete(markdown)
+    decisions.inc(tier, verdict.correct)
+    return verdict, tier
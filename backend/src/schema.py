@@ -1,15 +1,25 @@
 import uuid
-from sqlalchemy import ForeignKey, String, Enum as DBEnum
+from datetime import datetime, timezone
+from sqlalchemy import ForeignKey, String, DateTime, Integer, Boolean, Float, Text, Index, Enum as DBEnum, text
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict
+from typing import List, Literal, Optional
 from enum import Enum
 from database import Base
 
+def utcnow() -> datetime:
+    """ Naive UTC timestamp, which is what SQLite stores. """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class LanguageModelResponse(BaseModel):
     correct: bool
     reasoning: str
 
+class ScoredModelResponse(BaseModel):
+    correct: bool
+    reasoning: str
+    confidence: float
+
 class Permission(str, Enum):
     ADMIN = "admin"
     STAFF = "staff"
@@ -29,6 +39,11 @@ class Role(str, Enum):
 
 class DocumentType(str, Enum):
     BACKGROUND_CHECK = "background_check"
+    TRAINING_CERTIFICATE = "training_certificate"
+    CPR_FIRST_AID = "cpr_first_aid"
+    TB_TEST = "tb_test"
+    HEALTH_ASSESSMENT = "health_assessment"
+    FOOD_HANDLER_PERMIT = "food_handler_permit"
     OTHER = "other"
 
 class DocumentStatus(str, Enum):
@@ -36,6 +51,8 @@ class DocumentStatus(str, Enum):
     INCOMPLETE = "incomplete"
     INCORRECT = "incorrect"
     PENDING = "pending"
+    QUARANTINED = "quarantined"
+    QUEUED = "queued"
 
 class LoginRequest(BaseModel):
     email: str
@@ -49,6 +66,8 @@ class DashboardResponse(BaseModel):
     background_check_status: int
 
 class UserResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: str
     first_name: str
     last_name: str
@@ -67,6 +86,142 @@ class FolderResponse(BaseModel):
 class ComplianceFoldersResponse(BaseModel):
     folders: List[FolderResponse]
 
+class RequirementGap(BaseModel):
+    document_type: DocumentType
+    reason: str  # "missing" or "expired"
+    max_age_days: int
+    latest_document_at: Optional[datetime] = None
+
+class UserComplianceReport(BaseModel):
+    user_id: str
+    first_name: str
+    last_name: str
+    role: Role
+    required: int
+    satisfied: int
+    gaps: List[RequirementGap]
+
+class OrganizationComplianceReport(BaseModel):
+    organization_id: str
+    evaluated_at: datetime
+    staff_count: int
+    compliant_staff: int
+    required: int
+    satisfied: int
+    compliance_percentage: float
+    gaps_by_document_type: dict[DocumentType, int]
+    users: List[UserComplianceReport]
+
+class DocumentPreview(BaseModel):
+    document_id: str
+    name: str
+    status: DocumentStatus
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
+
+# Read-only listings validate these straight from row tuples (from_attributes),
+# so no ORM objects are built and nothing is introspected per request.
+class DocumentResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    name: str
+    link: str
+    s3_key: Optional[str] = None
+    processed_key: Optional[str] = None
+    status: DocumentStatus
+    document_type: DocumentType
+    organization_id: str
+    folder_id: str
+    created_at: Optional[datetime] = None
+    page_count: Optional[int] = None
+    encrypted: Optional[bool] = None
+    has_text_layer: Optional[bool] = None
+    preflight_reason: Optional[str] = None
+    preview_key: Optional[str] = None
+    review_tier: Optional[str] = None
+    document_type_source: Optional[str] = None
+    document_type_confidence: Optional[float] = None
+    processing_stage: Optional[str] = None
+    processing_updated_at: Optional[datetime] = None
+    version: int = 1
+    storage_tier: Optional[str] = None
+    archived_at: Optional[datetime] = None
+
+class DocumentTypeUpdate(BaseModel):
+    document_type: DocumentType
+
+class DocumentRef(BaseModel):
+    id: str
+    # the version the caller last saw; the document is skipped as a conflict if it has moved on
+    version: Optional[int] = None
+
+class DocumentFilter(BaseModel):
+    folder_id: Optional[str] = None
+    document_type: Optional[DocumentType] = None
+    status: Optional[DocumentStatus] = None
+
+class BulkDocumentRequest(BaseModel):
+    documents: Optional[List[DocumentRef]] = None
+    filter: Optional[DocumentFilter] = None
+    status: Optional[DocumentStatus] = None
+    requeue: Optional[Literal["extraction", "review"]] = None
+
+class BulkDocumentResult(BaseModel):
+    id: str
+    outcome: str
+    version: Optional[int] = None
+    status: Optional[DocumentStatus] = None
+
+class BulkDocumentResponse(BaseModel):
+    results: List[BulkDocumentResult]
+    updated: int
+    requeued: int
+
+class FolderSummary(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    name: str
+    organization_id: str
+    user_id: Optional[str] = None
+
+class OrganizationResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    name: str
+
+class DumpResponse(BaseModel):
+    organizations: List[OrganizationResponse]
+    users: List[UserResponse]
+    folders: List[FolderSummary]
+    documents: List[DocumentResponse]
+
+class BudgetAction(str, Enum):
+    THROTTLE = "throttle"
+    QUEUE = "queue"
+
+class UsageDay(BaseModel):
+    day: str
+    service: str
+    requests: int
+    cached: int
+    pages: int
+    prompt_tokens: int
+    completion_tokens: int
+    request_bytes: int
+    response_bytes: int
+    latency_ms: int
+    cost_usd: float
+
+class BudgetResponse(BaseModel):
+    daily_limit_usd: Optional[float] = None
+    monthly_limit_usd: Optional[float] = None
+    action: BudgetAction = BudgetAction.THROTTLE
+    spent_today_usd: float
+    spent_this_month_usd: float
+
 class StaffRegistration(BaseModel):
     first_name: str
     last_name: str
@@ -87,6 +242,12 @@ class AdminRegistration(BaseModel):
     confirm_password: str
     agree_to_terms: bool
 
+class ResumableUploadRequest(BaseModel):
+    name: str
+    document_type: DocumentType = DocumentType.OTHER
+    size: int
+    chunk_size: Optional[int] = None
+
 class Organization(Base):
     __tablename__ = "organizations"
 
@@ -136,6 +297,13 @@ class User(Base):
 
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        # the startup recovery scan looks up unfinished documents by status and stage
+        Index("ix_documents_status_stage", "status", "processing_stage"),
+        # default listings only see documents in hot storage, so archived history isn't indexed here
+        Index("ix_documents_live_organization", "organization_id", sqlite_where=text("storage_tier IS NULL")),
+        Index("ix_documents_live_folder", "folder_id", sqlite_where=text("storage_tier IS NULL")),
+    )
 
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -146,6 +314,28 @@ class Document(Base):
     document_type: Mapped[DocumentType] = mapped_column(DBEnum(DocumentType), default=DocumentType.OTHER)
     organization_id: Mapped[str] = mapped_column(ForeignKey("organizations.id"))
     folder_id: Mapped[str] = mapped_column(ForeignKey("folders.id"))
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, default=utcnow)
+    # filled in by the preflight stage; has_text_layer tells later stages whether OCR is needed
+    page_count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    encrypted: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
+    has_text_layer: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
+    preflight_reason: Mapped[Optional[str]] = mapped_column(String(200), nullable=True)
+    # S3 key of the first-page preview; the thumbnail sits next to it
+    preview_key: Mapped[Optional[str]] = mapped_column(String(200), nullable=True)
+    # which review tier decided the status: heuristics, small or large
+    review_tier: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    # who set document_type: "user" (never overwritten by the classifier) or "classifier",
+    # whose probability for the type is kept in document_type_confidence
+    document_type_source: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    document_type_confidence: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    # last pipeline checkpoint reached (see pipeline.STAGES) and when
+    processing_stage: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    processing_updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # bumped by every status or type change, for optimistic checks in bulk updates
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
+    # None while the objects are in hot storage, else "archived" or "restoring" (see archive.py)
+    storage_tier: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    archived_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     
     organization: Mapped["Organization"] = relationship(back_populates="documents")
     folder: Mapped["Folder"] = relationship(back_populates="documents")
@@ -162,3 +352,45 @@ class Document(Base):
             "folder_id": self.folder_id
         }
 
+class IdempotencyKey(Base):
+    """ Response recorded for an Idempotency-Key header; status_code is NULL while the request is in flight. """
+    __tablename__ = "idempotency_keys"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    organization_id: Mapped[str] = mapped_column(ForeignKey("organizations.id"))
+    request_path: Mapped[str] = mapped_column(String(200), nullable=False)
+    status_code: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    response: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+    # set when the request failed after creating this document; a retry resumes it
+    document_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
+
+class UsageRecord(Base):
+    """ One metered call to a paid service. Costs are integer micro-dollars. """
+    __tablename__ = "usage_records"
+    __table_args__ = (Index("ix_usage_records_organization_created", "organization_id", "created_at"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    organization_id: Mapped[str] = mapped_column(ForeignKey("organizations.id"))
+    document_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
+    service: Mapped[str] = mapped_column(String(20), nullable=False)
+    model: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
+    cached: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    request_bytes: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    response_bytes: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    pages: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    latency_ms: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    cost_micros: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+
+class OrganizationBudget(Base):
+    """ Spending limits in micro-dollars; NULL means no limit for that period. """
+    __tablename__ = "organization_budgets"
+
+    organization_id: Mapped[str] = mapped_column(ForeignKey("organizations.id"), primary_key=True)
+    daily_limit_micros: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    monthly_limit_micros: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    action: Mapped[BudgetAction] = mapped_column(DBEnum(BudgetAction), default=BudgetAction.THROTTLE)
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import re
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, insert
+from sqlalchemy.orm import sessionmaker
+from write_queue import WriteQueue, WriterClosed
+
+_SHARD_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+# columns only the directory database keeps, with the placeholder shards get
+# instead (the columns are NOT NULL); login never reads them from a shard
+DIRECTORY_ONLY = {"users": {"password": ""}}
+
+
+def shard_row(table, row) -> dict:
+    """ A row as it is copied into a shard. """
+    return {**row, **DIRECTORY_ONLY.get(table.name, {})}
+
+
+class Shard:
+    def __init__(self, engine, session_factory=None, writer=None):
+        self.engine = engine
+        self.sessionmaker = session_factory or sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self.writer = writer or WriteQueue(self.sessionmaker)
+
+    def close(self):
+        # final: a request still holding this shard gets WriterClosed rather than
+        # starting a second writer on the file (see TenantRouter.submit)
+        self.writer.close(final=True)
+        self.engine.dispose()
+
+
+class TenantRouter:
+    """
+    Maps an organization to the database that holds its folders and documents.
+
+    With sharding off every organization resolves to the shared database. With
+    "organization" sharding each tenant gets its own SQLite file under shard_dir,
+    so tenants neither share a write lock nor scan each other's rows. The shared
+    database stays the directory of organizations and users used for login.
+    """
+
+    def __init__(self, default: Shard, mode: str, shard_dir: str, create_engine, init_db, cache_size: int = 256):
+        self.default = default
+        self.mode = mode
+        self.shard_dir = shard_dir
+        self.create_engine = create_engine
+        self.init_db = init_db
+        self.cache_size = cache_size
+        self.shards = OrderedDict()
+        self.lock = threading.Lock()
+        # organization -> lock held while its shard is opened and migrated
+        self.opening = {}
+        # organization -> thread closing its evicted shard
+        self.closing = {}
+
+    @property
+    def sharded(self) -> bool:
+        return self.mode == "organization"
+
+    def shard_path(self, organization_id: str) -> str:
+        if not _SHARD_ID.match(organization_id or ""):
+            raise ValueError(f"Invalid organization id for shard: {organization_id!r}")
+        return os.path.join(self.shard_dir, f"{organization_id}.db")
+
+    def cached(self, organization_id: str):
+        """ The tenant's shard if it is already open, else None. """
+        if not self.sharded:
+            return self.default
+        with self.lock:
+            shard = self.shards.get(organization_id)
+            if shard is not None:
+                self.shards.move_to_end(organization_id)
+            return shard
+
+    def shard_for(self, organization_id: str) -> Shard:
+        """
+        The tenant's shard, opened and migrated on first use. Blocks while it
+        opens; async callers use open() instead.
+        """
+        shard = self.cached(organization_id)
+        if shard is not None:
+            return shard
+        with self.lock:
+            opening = self.opening.setdefault(organization_id, threading.Lock())
+        # one opener per tenant, so two requests never migrate the same file at once
+        with opening:
+            shard = self.cached(organization_id)
+            if shard is not None:
+                return shard
+            with self.lock:
+                closing = self.closing.get(organization_id)
+            if closing is not None:
+                # the evicted shard's writer finishes its queue before a new one starts
+                closing.join()
+            os.makedirs(self.shard_dir, exist_ok=True)
+            shard = Shard(self.create_engine(f"sqlite:///{self.shard_path(organization_id)}"))
+            self.init_db(shard.engine)
+            with self.lock:
+                self.shards[organization_id] = shard
+                self.opening.pop(organization_id, None)
+                closers = []
+                while len(self.shards) > self.cache_size:
+                    closers.append(self._retire(*self.shards.popitem(last=False)))
+        for closer in closers:
+            closer.start()
+        return shard
+
+    def _retire(self, organization_id: str, shard: Shard) -> threading.Thread:
+        """ A thread that closes an evicted shard; called with the lock held. """
+
+        def close():
+            try:
+                shard.close()
+            finally:
+                with self.lock:
+                    if self.closing.get(organization_id) is closer:
+                        del self.closing[organization_id]
+
+        # closing joins the writer thread, which mustn't hold up the caller
+        closer = threading.Thread(target=close, name=f"shard-close-{organization_id}", daemon=True)
+        self.closing[organization_id] = closer
+        return closer
+
+    async def open(self, organization_id: str) -> Shard:
+        """ shard_for for async callers; a shard that isn't open yet is opened in a thread. """
+        return self.cached(organization_id) or await asyncio.to_thread(self.shard_for, organization_id)
+
+    def session_for(self, organization_id: str):
+        return self.shard_for(organization_id).sessionmaker()
+
+    def submit(self, organization_id: str, work):
+        """ Queue work(session) on the tenant's writer; returns its Future. """
+        while True:
+            try:
+                return self.shard_for(organization_id).writer.submit(work)
+            except WriterClosed:
+                # evicted between the lookup and the submit; the next lookup reopens it
+                continue
+
+    async def run(self, organization_id: str, work):
+        """ Await work(session) on the tenant's writer without blocking the event loop. """
+        while True:
+            shard = await self.open(organization_id)
+            try:
+                future = shard.writer.submit(work)
+            except WriterClosed:
+                continue
+            return await asyncio.wrap_future(future)
+
+    def organization_ids(self) -> list:
+        """ Organizations that have a shard on disk. """
+        if not self.sharded or not os.path.isdir(self.shard_dir):
+            return []
+        return sorted(name[:-3] for name in os.listdir(self.shard_dir) if name.endswith(".db"))
+
+    def iter_sessions(self):
+        """
+        Yield (organization_id, session) for every shard, closing each session
+        once the caller moves on. Unsharded, yields the shared database once
+        with organization_id None.
+        """
+        if not self.sharded:
+            targets = [(None, self.default)]
+        else:
+            targets = ((organization_id, None) for organization_id in self.organization_ids())
+        for organization_id, shard in targets:
+            session = (shard or self.shard_for(organization_id)).sessionmaker()
+            try:
+                yield organization_id, session
+            finally:
+                session.close()
+
+    def close(self):
+        with self.lock:
+            shards = list(self.shards.values())
+            self.shards.clear()
+            closing = list(self.closing.values())
+        for shard in shards:
+            shard.close()
+        for thread in closing:
+            thread.join()
+        self.default.writer.close()
+
+
+def copy_organization(metadata, source, target, organization_id: str, replace: bool = False) -> dict:
+    """
+    Copy one organization's rows from source to target, table by table in
+    dependency order. Returns the number of rows copied per table.
+    """
+    counts = {}
+    with source.connect() as source_conn, target.begin() as target_conn:
+        for table in metadata.sorted_tables:
+            if table.name == "organizations":
+                condition = table.c.id == organization_id
+            elif "organization_id" in table.c:
+                condition = table.c.organization_id == organization_id
+            else:
+                continue
+            statement = insert(table).prefix_with("OR REPLACE") if replace else insert(table)
+            counts[table.name] = 0
+            result = source_conn.execution_options(stream_results=True).execute(select(table).where(condition))
+            for rows in result.mappings().partitions(1000):
+                target_conn.execute(statement, [shard_row(table, row) for row in rows])
+                counts[table.name] += len(rows)
+    return counts
+
+
+def copy_rows(source, target, table, condition):
+    """ Upsert the rows matching condition from source into target, a shard. """
+    with source.connect() as source_conn, target.begin() as target_conn:
+        rows = [shard_row(table, row) for row in source_conn.execute(select(table).where(condition)).mappings()]
+        if rows:
+            target_conn.execute(insert(table).prefix_with("OR REPLACE"), rows)
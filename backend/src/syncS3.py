@@ -1,12 +1,26 @@
-import boto3
+from functools import lru_cache
 from pathlib import Path
 import io
 import json
-from botocore.exceptions import NoCredentialsError
+import os
 import schema
+import metrics
 
+# an S3-compatible server such as MinIO, instead of AWS
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+# a directory standing in for S3 (see local_s3.py), for tests and dev
+S3_LOCAL_ROOT = os.getenv("S3_LOCAL_ROOT")
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """ Create the boto3 client on first use so importing this module stays cheap. """
+    if S3_LOCAL_ROOT:
+        from local_s3 import LocalS3
+        return LocalS3(S3_LOCAL_ROOT)
+    import boto3
+    return boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
 
-s3 = boto3.client('s3')
 local_json_base_path = "data/organization_jsons/"
 
 BUCKET_NAME = "carelumi-data"
@@ -18,14 +32,92 @@ def upload_to_s3(file_obj, bucket_name: str, s3_key: str):
     """
 
     if isinstance(file_obj, dict):
-        obj = io.BytesIO(json.dumps(obj).encode("utf-8"))
+        file_obj = io.BytesIO(json.dumps(file_obj).encode("utf-8"))
     #Handle text exratcion .json type(dict type)
 
     file_obj.seek(0)
-    s3.upload_fileobj(file_obj, bucket_name, s3_key)
+    with metrics.timed("s3", "upload_fileobj"):
+        get_s3_client().upload_fileobj(file_obj, bucket_name, s3_key)
+
+    return f"s3://{bucket_name}/{s3_key}"
 
+def upload_parts_to_s3(parts: list, bucket_name: str, s3_key: str):
+    """
+    Multipart-upload an object whose parts are lists of local chunk files, one
+    list per part, and return the internal S3 path. Aborts on failure so no
+    orphaned parts are billed.
+    """
+    s3 = get_s3_client()
+    with metrics.timed("s3", "create_multipart_upload"):
+        upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=s3_key)["UploadId"]
+    try:
+        completed = []
+        for part_number, chunk_paths in enumerate(parts, start=1):
+            body = io.BytesIO()
+            for chunk_path in chunk_paths:
+                with open(chunk_path, "rb") as chunk:
+                    body.write(chunk.read())
+            body.seek(0)
+            with metrics.timed("s3", "upload_part"):
+                response = s3.upload_part(
+                    Bucket=bucket_name, Key=s3_key, UploadId=upload_id, PartNumber=part_number, Body=body
+                )
+            completed.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        with metrics.timed("s3", "complete_multipart_upload"):
+            s3.complete_multipart_upload(
+                Bucket=bucket_name, Key=s3_key, UploadId=upload_id, MultipartUpload={"Parts": completed}
+            )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+        raise
     return f"s3://{bucket_name}/{s3_key}"
 
+def download_from_s3(bucket_name: str, s3_key: str) -> bytes:
+    with metrics.timed("s3", "get_object"):
+        return get_s3_client().get_object(Bucket=bucket_name, Key=s3_key)["Body"].read()
+
+def s3_object_exists(bucket_name: str, s3_key: str) -> bool:
+    s3 = get_s3_client()
+    try:
+        with metrics.timed("s3", "head_object"):
+            s3.head_object(Bucket=bucket_name, Key=s3_key)
+    except s3.exceptions.NoSuchKey:
+        return False
+    except Exception as e:
+        # boto3 reports a HEAD of a missing key as a bare 404
+        if getattr(e, "response", {}).get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+def parse_s3_path(s3_path: str) -> tuple:
+    """ (bucket, key) from the s3://bucket/key paths stored on documents. """
+    bucket, _, key = s3_path.removeprefix("s3://").partition("/")
+    return bucket, key
+
+def open_s3_stream(bucket_name: str, s3_key: str) -> tuple:
+    """ (size, body) of an object; read the body incrementally with body.iter_chunks(). """
+    with metrics.timed("s3", "get_object"):
+        response = get_s3_client().get_object(Bucket=bucket_name, Key=s3_key)
+    return response["ContentLength"], response["Body"]
+
+class S3Source:
+    """ Ranged reads of one S3 object, for readers that only need part of it. """
+
+    def __init__(self, bucket_name: str, s3_key: str):
+        self.bucket_name = bucket_name
+        self.s3_key = s3_key
+
+    def read(self, offset: int, length: int) -> bytes:
+        with metrics.timed("s3", "get_object_range"):
+            response = get_s3_client().get_object(
+                Bucket=self.bucket_name, Key=self.s3_key, Range=f"bytes={offset}-{offset + length - 1}"
+            )
+        return response["Body"].read()
+
+    def read_all(self) -> bytes:
+        return download_from_s3(self.bucket_name, self.s3_key)
+
 def get_s3_json_key(organization_id: str) -> str:
     # This creates the S3 path for the queried organization 
     return f"organization/{organization_id}/admin_metadata.json"
@@ -33,10 +125,14 @@ def get_s3_json_key(organization_id: str) -> str:
 def read_s3_json(organization_id: str) -> list:
     """ Read the JSON file from S3 if it exists, otherwise return an empty list. """
     
+    from botocore.exceptions import NoCredentialsError
+
+    s3 = get_s3_client()
     s3_key = get_s3_json_key(organization_id)
     try:
-        response = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)
-        json_data = response['Body'].read().decode('utf-8')
+        with metrics.timed("s3", "get_object"):
+            response = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)
+            json_data = response['Body'].read().decode('utf-8')
         return json.loads(json_data)
     except s3.exceptions.NoSuchKey:
         empty_data = []
@@ -49,10 +145,14 @@ def read_s3_json(organization_id: str) -> list:
 
 def write_s3_json(organization_id: str, data: list):
     """ Write the updated JSON data to the S3 bucket under the organization's directory. """
+    from botocore.exceptions import NoCredentialsError
+
+    s3 = get_s3_client()
     s3_key = get_s3_json_key(organization_id)
     try:
         json_data = json.dumps(data, indent=4)
-        s3.put_object(Body=json_data, Bucket=BUCKET_NAME, Key=s3_key)
+        with metrics.timed("s3", "put_object"):
+            s3.put_object(Body=json_data, Bucket=BUCKET_NAME, Key=s3_key)
     except NoCredentialsError:
         raise Exception("Credentials not available for accessing S3.")
     except Exception as e:
@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+from functools import lru_cache
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+
+@lru_cache(maxsize=None)
+def get_pool():
+    """
+    Process pool for CPU-bound upload stages, started on first use. Workers are
+    spawned rather than forked because the server already runs threads, and are
+    recycled to cap the memory PDF libraries hold on to.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(
+        max_workers=WORKER_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        max_tasks_per_child=200,
+    )
+
+
+def reset(pool=None):
+    """
+    Drop a broken pool so the next task starts a fresh one. With `pool`, only
+    if it is still the current one, so a late caller doesn't drop its replacement.
+    """
+    if pool is None or (get_pool.cache_info().currsize and get_pool() is pool):
+        get_pool.cache_clear()
+
+
+def recycle(pool):
+    """
+    Kill the workers of a pool and replace it. Cancelling a future doesn't stop
+    a task that is already running, so this is the only way to take back a
+    worker stuck on one file; other tasks in the pool fail with BrokenProcessPool.
+    """
+    reset(pool)
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    if get_pool.cache_info().currsize:
+        get_pool().shutdown(wait=False, cancel_futures=True)
+        get_pool.cache_clear()
@@ -0,0 +1,119 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+import metrics
+
+batch_sizes = metrics.REGISTRY.register(metrics.Histogram(
+    "db_write_batch_size", "Write transactions folded into each group commit.", (), metrics.COUNT_BUCKETS
+))
+
+
+class WriterClosed(Exception):
+    """ Raised by submit once the queue has been closed for good. """
+
+
+class WriteQueue:
+    """
+    Serializes small write transactions through one thread and one connection.
+    Work queued while a commit is in progress is folded into the next commit, so
+    SQLite sees one writer and pays one fsync for many status updates.
+    """
+
+    def __init__(self, session_factory, max_batch: int = 64, idle_timeout: float = 30.0):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.idle_timeout = idle_timeout
+        self.queue = queue.Queue()
+        self.thread = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def submit(self, work) -> Future:
+        """ Queue work(session) to run in the next group commit. """
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise WriterClosed()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self.thread.start()
+            self.queue.put((work, future))
+        return future
+
+    async def run(self, work):
+        """ Awaitable submit for async handlers. """
+        return await asyncio.wrap_future(self.submit(work))
+
+    def close(self, timeout: float = None, final: bool = False):
+        """
+        Finish queued work and stop the writer thread. A final close also refuses
+        further work, so no second writer is started on the same database.
+        """
+        with self.lock:
+            self.closed = self.closed or final
+            thread = self.thread
+            if thread is None:
+                return
+            self.queue.put(None)
+        thread.join(timeout)
+
+    def _next_batch(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_timeout)
+                break
+            except queue.Empty:
+                # let idle writers exit; submit() starts a new one under the same lock
+                with self.lock:
+                    if self.queue.empty():
+                        self.thread = None
+                        return None
+        if item is None:
+            with self.lock:
+                self.thread = None
+            return None
+        batch = [item]
+        while len(batch) < self.max_batch:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # stop after this batch
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [(work, future) for work, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            batch_sizes.observe(len(batch))
+            try:
+                self._commit(batch)
+            except Exception:
+                # one bad write shouldn't fail its neighbours, so retry each on its own
+                for item in batch:
+                    try:
+                        self._commit([item])
+                    except Exception as e:
+                        item[1].set_exception(e)
+
+    def _commit(self, batch):
+        session = self.session_factory()
+        try:
+            results = [work(session) for work, _ in batch]
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
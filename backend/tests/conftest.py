@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+# every completion should reach the stub endpoint, not a verdict cached by an earlier test
+os.environ.setdefault("LLM_CACHE", "off")
+# a scratch database and data/ for the whole run; each test that needs rows starts from empty tables
+WORKDIR = tempfile.mkdtemp(prefix="carelumi-tests-")
+os.chdir(WORKDIR)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(WORKDIR, 'test.db')}")
+
+
+@pytest.fixture
+def session():
+    import database
+
+    database.reset_db()
+    db = database.SessionLocal()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def organization(session):
+    """ An organization with one admin and their folder; returns (organization_id, user_id, folder_id). """
+    import schema
+
+    session.add(schema.Organization(id="org-1", name="Acme Care"))
+    session.add(schema.User(
+        id="user-1", first_name="Ada", last_name="Admin", email="ada@example.com", password="",
+        role=schema.Role.ADMIN, permission=schema.Permission.ADMIN, organization_id="org-1",
+    ))
+    session.add(schema.Folder(id="folder-1", name="Ada Admin", organization_id="org-1", user_id="user-1"))
+    session.commit()
+    return "org-1", "user-1", "folder-1"
+
+
+@pytest.fixture
+def add_documents(session, organization):
+    """ Adds documents to the organization's folder, one commit each so they sort by created_at; returns their ids. """
+    import schema
+
+    _, _, folder_id = organization
+
+    def add(count: int, **columns) -> list:
+        ids = []
+        for _ in range(count):
+            document = schema.Document(**{
+                "id": f"doc-{session.query(schema.Document).count()}", "name": "form.pdf", "link": "",
+                "organization_id": "org-1", "folder_id": folder_id, **columns,
+            })
+            session.add(document)
+            session.commit()
+            ids.append(document.id)
+        return ids
+
+    return add
@@ -0,0 +1,169 @@
+"""
+The in-flight Gate and the token buckets behind admission control.
+"""
+import asyncio
+import pytest
+import admission
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def settle():
+    """ Let woken waiters get through wait_for and shield. """
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def queue_up(gate, organizations, admitted: list) -> list:
+    """ Start a waiter per organization, in order, and let each reach the queue. """
+
+    async def wait(index, organization_id):
+        await gate.acquire(organization_id)
+        admitted.append(index)
+
+    tasks = []
+    for index, organization_id in enumerate(organizations):
+        tasks.append(asyncio.create_task(wait(index, organization_id)))
+        await settle()
+    return tasks
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    async def main():
+        gate = admission.Gate(max_in_flight=1, max_waiting=8, per_org=8, timeout=5)
+        await gate.acquire("org-a")
+        admitted = []
+        tasks = await queue_up(gate, ["org-b", "org-c", "org-b", "org-d"], admitted)
+        holder = "org-a"
+        for index, organization_id in enumerate(["org-b", "org-c", "org-b", "org-d"]):
+            gate.release(holder)
+            await settle()
+            assert admitted == list(range(index + 1))
+            holder = organization_id
+        await asyncio.gather(*tasks)
+
+    run(main())
+
+
+def test_organization_is_held_to_its_share():
+    async def main():
+        gate = admission.Gate(max_in_flight=4, max_waiting=8, per_org=2, timeout=5)
+        await gate.acquire("org-a")
+        await gate.acquire("org-a")
+        admitted = []
+        tasks = await queue_up(gate, ["org-a"], admitted)
+        # a free slot, but org-a is at its share
+        assert admitted == [] and gate.in_flight == 2
+        await gate.acquire("org-b")
+        assert gate.by_org == {"org-a": 2, "org-b": 1}
+        gate.release("org-a")
+        await asyncio.gather(*tasks)
+        assert admitted == [0] and gate.by_org == {"org-a": 2, "org-b": 1}
+
+    run(main())
+
+
+def test_tenant_at_its_share_does_not_hold_up_others():
+    async def main():
+        gate = admission.Gate(max_in_flight=3, max_waiting=8, per_org=2, timeout=5)
+        for organization_id in ("org-a", "org-a", "org-b"):
+            await gate.acquire(organization_id)
+        admitted = []
+        # org-a's backlog arrived first; org-c queues behind it
+        tasks = await queue_up(gate, ["org-a", "org-a", "org-a", "org-c"], admitted)
+        gate.release("org-b")
+        await settle()
+        assert admitted == [3]
+        gate.release("org-a")
+        await settle()
+        assert admitted == [3, 0]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert not gate.waiters
+
+    run(main())
+
+
+def test_full_queue_is_refused_at_once():
+    async def main():
+        gate = admission.Gate(max_in_flight=2, max_waiting=3, per_org=2, timeout=5)
+        await gate.acquire("org-a")
+        await gate.acquire("org-b")
+        tasks = await queue_up(gate, ["org-c", "org-d", "org-e"], [])
+        with pytest.raises(admission.Rejected) as rejected:
+            await gate.acquire("org-f")
+        # three waiters ahead plus this one, two slots, a second per hold
+        assert rejected.value.retry_after == 2
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    run(main())
+
+
+def test_retry_after_follows_hold_times():
+    async def main():
+        gate = admission.Gate(max_in_flight=1, max_waiting=0, per_org=1, timeout=5)
+        await gate.acquire("org-a")
+        gate.release("org-a", held=6.0)
+        assert gate.hold_seconds == pytest.approx(2.0)
+        await gate.acquire("org-a")
+        with pytest.raises(admission.Rejected) as rejected:
+            await gate.acquire("org-b")
+        assert rejected.value.retry_after == 2
+
+    run(main())
+
+
+def test_waiter_times_out_and_leaves_the_queue():
+    async def main():
+        gate = admission.Gate(max_in_flight=1, max_waiting=4, per_org=1, timeout=0.05)
+        await gate.acquire("org-a")
+        with pytest.raises(admission.Rejected, match="Timed out"):
+            await gate.acquire("org-b")
+        assert not gate.waiters and gate.in_flight == 1
+
+    run(main())
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, "time", clock)
+    return clock
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_buckets_refill_at_the_rate(backend, clock, tmp_path):
+    buckets = admission.MemoryBuckets() if backend == "memory" else admission.SqliteBuckets(str(tmp_path / "admission.db"))
+    limit = admission.RouteLimit(rate=0.5, burst=2, gated=False)
+    assert [buckets.take("upload:org-a", limit) for _ in range(3)] == [0, 0, 2]
+    # other organizations have their own bucket
+    assert buckets.take("upload:org-b", limit) == 0
+    clock.now += 1
+    assert buckets.take("upload:org-a", limit) == 1
+    clock.now += 1
+    assert buckets.take("upload:org-a", limit) == 0
+
+
+def test_sqlite_buckets_are_shared_between_processes(clock, tmp_path):
+    path = str(tmp_path / "admission.db")
+    limit = admission.RouteLimit(rate=1, burst=2, gated=False)
+    first, second = admission.SqliteBuckets(path), admission.SqliteBuckets(path)
+    assert first.take("export:org-a", limit) == 0
+    assert second.take("export:org-a", limit) == 0
+    assert first.take("export:org-a", limit) == 1
@@ -0,0 +1,102 @@
+"""
+Bulk status changes: the per-row version guard, no-op filtering and conflict reporting.
+"""
+import asyncio
+import threading
+import pytest
+import bulk
+import database
+import database_operations
+import schema
+from classifier import USER
+
+COMPLETE = schema.DocumentStatus.COMPLETE
+INCORRECT = schema.DocumentStatus.INCORRECT
+
+
+def request(**fields) -> schema.BulkDocumentRequest:
+    return schema.BulkDocumentRequest(**fields)
+
+
+def run(session, bulk_request) -> dict:
+    response = asyncio.run(bulk.apply(session, "org-1", bulk_request))
+    return {result.id: result for result in response.results}
+
+
+def versions(session) -> dict:
+    session.expire_all()
+    return {document.id: (document.status, document.version) for document in session.query(schema.Document)}
+
+
+@pytest.mark.parametrize("fields, message", [
+    ({"documents": [], "filter": {}, "status": COMPLETE}, "either documents or filter"),
+    ({"documents": [], "status": COMPLETE, "requeue": "review"}, "either status or requeue"),
+    ({"documents": [], "status": schema.DocumentStatus.QUEUED}, "set by the pipeline"),
+])
+def test_validate_rejects_ambiguous_requests(fields, message):
+    with pytest.raises(bulk.BulkError, match=message):
+        bulk.validate(request(**fields))
+
+
+def test_select_targets_filters_within_the_organization(session, add_documents):
+    complete = add_documents(2, status=COMPLETE)
+    add_documents(1, status=INCORRECT)
+    rows = bulk.select_targets(session, "org-1", request(filter={"status": COMPLETE}, status=INCORRECT))
+    assert [row.id for row in rows] == complete
+    assert bulk.select_targets(session, "org-2", request(filter={}, status=INCORRECT)) == []
+
+
+def test_stale_version_is_a_conflict(session, add_documents):
+    current, stale = add_documents(2, status=INCORRECT)
+    results = run(session, request(documents=[{"id": current, "version": 1}, {"id": stale, "version": 7}], status=COMPLETE))
+    assert (results[current].outcome, results[current].version) == (bulk.UPDATED, 2)
+    assert (results[stale].outcome, results[stale].version) == (bulk.CONFLICT, 1)
+    assert versions(session) == {current: (COMPLETE, 2), stale: (INCORRECT, 1)}
+
+
+def test_no_ops_are_not_written(session, add_documents):
+    done = add_documents(1, status=COMPLETE)[0]
+    in_flight = add_documents(1, status=schema.DocumentStatus.PENDING)[0]
+    results = run(session, request(documents=[{"id": done}, {"id": in_flight}, {"id": "missing"}], status=COMPLETE))
+    assert {document_id: result.outcome for document_id, result in results.items()} == {
+        done: bulk.UNCHANGED, in_flight: bulk.UNCHANGED, "missing": bulk.NOT_FOUND,
+    }
+    assert versions(session) == {done: (COMPLETE, 1), in_flight: (schema.DocumentStatus.PENDING, 1)}
+
+
+def change_status(document_id: str):
+    db = database.SessionLocal()
+    try:
+        document = database_operations.get_document(db, document_id)
+        # set_document_status awaits the writer; run it on a loop of its own, as another request would
+        thread = threading.Thread(target=asyncio.run, args=(database_operations.set_document_status(document, COMPLETE),))
+        thread.start()
+        thread.join()
+    finally:
+        db.close()
+
+
+def change_type(document_id: str):
+    db = database.SessionLocal()
+    try:
+        document = database_operations.get_document(db, document_id)
+        database_operations.set_document_type(db, document, schema.DocumentType.TB_TEST, USER)
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("change", [change_status, change_type])
+def test_change_between_read_and_write_is_a_conflict(session, add_documents, monkeypatch, change):
+    ids = add_documents(3, status=INCORRECT)
+    plan = bulk.plan
+
+    def plan_then_change(bulk_request, rows):
+        # another request lands after the rows were read, before the UPDATE
+        change(ids[1])
+        return plan(bulk_request, rows)
+
+    monkeypatch.setattr(bulk, "plan", plan_then_change)
+    results = run(session, request(filter={"folder_id": "folder-1"}, status=COMPLETE))
+    assert [results[document_id].outcome for document_id in ids] == [bulk.UPDATED, bulk.CONFLICT, bulk.UPDATED]
+    # the conflicting row keeps the other request's change and isn't bumped again
+    assert versions(session)[ids[1]][1] == 2
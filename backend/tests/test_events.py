@@ -0,0 +1,62 @@
+"""
+SqliteEventBus: publishing off the caller's thread, delivery between buses and timed pruning.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import closing
+import events
+
+
+def count(path) -> int:
+    with closing(sqlite3.connect(path)) as conn:
+        return conn.execute("SELECT count(*) FROM events").fetchone()[0]
+
+
+def test_publish_is_written_by_the_writer_thread(tmp_path, monkeypatch):
+    path = str(tmp_path / "events.db")
+    bus = events.SqliteEventBus(path)
+    connects = []
+    connect = bus._connect
+    monkeypatch.setattr(bus, "_connect", lambda: connects.append(threading.current_thread()) or connect())
+    for index in range(20):
+        bus.publish("org-1", {"index": index})
+    bus.close()
+    assert count(path) == 20
+    assert connects and all(thread.name == "event-writer" for thread in connects)
+
+
+def test_other_workers_receive_published_events(tmp_path):
+    path = str(tmp_path / "events.db")
+    publisher, listener = events.SqliteEventBus(path), events.SqliteEventBus(path)
+
+    async def main():
+        subscription = listener.subscribe("org-1")
+        # let the poller note where the table ends before publishing
+        await asyncio.sleep(events.EVENT_POLL_INTERVAL * 2)
+        publisher.publish("org-1", {"document_id": "doc-1"})
+        publisher.publish("org-2", {"document_id": "doc-2"})
+        try:
+            return await asyncio.wait_for(subscription.get(), 5)
+        finally:
+            subscription.close()
+
+    assert asyncio.run(main()) == {"document_id": "doc-1"}
+    publisher.close()
+
+
+def test_old_events_are_pruned_on_a_timer(tmp_path, monkeypatch):
+    path = str(tmp_path / "events.db")
+    monkeypatch.setattr(events, "EVENT_RETENTION_SECONDS", 60)
+    bus = events.SqliteEventBus(path)
+    with closing(sqlite3.connect(path)) as conn, conn:
+        conn.execute("INSERT INTO events (organization_id, payload, created_at) VALUES ('org-1', '{}', ?)", (time.time() - 120,))
+    # within the prune interval the old row stays
+    bus.publish("org-1", {})
+    bus.close()
+    assert count(path) == 2
+    monkeypatch.setattr(events, "EVENT_PRUNE_INTERVAL", 0)
+    bus.publish("org-1", {})
+    bus.close()
+    assert count(path) == 2
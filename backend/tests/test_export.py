@@ -0,0 +1,34 @@
+"""
+stream_zip reading its pages of rows off the event loop.
+"""
+import asyncio
+import csv
+import io
+import threading
+import zipfile
+import export
+import schema
+
+
+def test_pages_are_read_in_a_thread(session, add_documents, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_ROW_BATCH", 2)
+    ids = add_documents(5, status=schema.DocumentStatus.COMPLETE)
+    readers = []
+
+    def pages():
+        for page in export.export_pages("org-1"):
+            readers.append(threading.current_thread())
+            yield page
+
+    async def main():
+        loop_thread = threading.current_thread()
+        body = b"".join([chunk async for chunk in export.stream_zip(pages())])
+        return body, loop_thread
+
+    body, loop_thread = asyncio.run(main())
+    assert len(readers) == 3
+    assert loop_thread not in readers
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        manifest = list(csv.DictReader(io.StringIO(archive.read("manifest.csv").decode())))
+    # nothing was uploaded, so every document is only listed
+    assert [(record["id"], record["error"]) for record in manifest] == [(id, "not uploaded") for id in ids]
@@ -0,0 +1,59 @@
+"""
+Per-IP and per-account login windows.
+"""
+import pytest
+import login_throttle
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(login_throttle, "time", clock)
+    monkeypatch.setattr(login_throttle, "LOGIN_IP_ATTEMPTS", 3)
+    monkeypatch.setattr(login_throttle, "LOGIN_ACCOUNT_FAILURES", 2)
+    monkeypatch.setattr(login_throttle, "attempts_by_ip", login_throttle.SlidingWindow(60, 100))
+    monkeypatch.setattr(login_throttle, "failures_by_account", login_throttle.SlidingWindow(60, 100))
+    return clock
+
+
+def test_ip_window(clock):
+    for index in range(3):
+        assert login_throttle.check(f"user{index}@example.com", "10.0.0.1") == 0
+        clock.now += 10
+    # the first attempt leaves the window 60 s after it was made, 30 s from now
+    assert login_throttle.check("other@example.com", "10.0.0.1") == 31
+    assert login_throttle.check("other@example.com", "10.0.0.2") == 0
+    clock.now += 30
+    assert login_throttle.check("other@example.com", "10.0.0.1") == 0
+
+
+def test_account_window_spans_ips(clock):
+    for ip in ("10.0.0.1", "10.0.0.2"):
+        assert login_throttle.check("Ada@Example.com", ip) == 0
+        login_throttle.failed("Ada@Example.com")
+    clock.now += 5
+    assert login_throttle.check(" ada@example.com", "10.0.0.3") == 56
+    assert login_throttle.check("bob@example.com", "10.0.0.3") == 0
+    clock.now += 55
+    assert login_throttle.check("ada@example.com", "10.0.0.3") == 0
+
+
+def test_success_clears_failures(clock):
+    login_throttle.failed("ada@example.com")
+    login_throttle.succeeded("ada@example.com")
+    login_throttle.failed("ada@example.com")
+    assert login_throttle.check("ada@example.com", "10.0.0.1") == 0
+
+
+def test_zero_limit_disables_the_check(clock, monkeypatch):
+    monkeypatch.setattr(login_throttle, "LOGIN_IP_ATTEMPTS", 0)
+    for _ in range(10):
+        assert login_throttle.check("ada@example.com", "10.0.0.1") == 0
@@ -0,0 +1,88 @@
+"""
+scrypt hashing, rehashing on login, and the bounded worker pool.
+"""
+import asyncio
+import httpx
+import pytest
+import login_throttle
+import main
+import passwords
+import schema
+
+
+@pytest.fixture(autouse=True)
+def cheap_scrypt(monkeypatch):
+    # the cost only needs to be scrypt's, not production's
+    monkeypatch.setattr(passwords, "SCRYPT_N", 2 ** 10)
+    monkeypatch.setattr(login_throttle, "LOGIN_IP_ATTEMPTS", 0)
+
+
+def test_hash_verifies():
+    stored = passwords.hash_password("hunter2")
+    assert stored.startswith("scrypt$1024$8$1$")
+    assert stored != passwords.hash_password("hunter2")
+    assert passwords.verify_password(stored, "hunter2") == (True, None)
+    assert passwords.verify_password(stored, "hunter3") == (False, None)
+
+
+def test_legacy_plaintext_is_rehashed():
+    matches, replacement = passwords.verify_password("hunter2", "hunter2")
+    assert matches and passwords.is_hashed(replacement)
+    assert passwords.verify_password(replacement, "hunter2") == (True, None)
+    assert passwords.verify_password("hunter2", "hunter3") == (False, None)
+
+
+def test_older_cost_is_rehashed(monkeypatch):
+    stored = passwords.hash_password("hunter2")
+    monkeypatch.setattr(passwords, "SCRYPT_N", 2 ** 11)
+    matches, replacement = passwords.verify_password(stored, "hunter2")
+    assert matches and replacement.startswith("scrypt$2048$")
+
+
+def test_full_pool_refuses_at_once(monkeypatch):
+    monkeypatch.setattr(passwords, "PASSWORD_WORKERS", 1)
+    monkeypatch.setattr(passwords, "PASSWORD_QUEUE", 1)
+
+    async def main():
+        release = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def wait(_):
+            asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+
+        running = [asyncio.create_task(passwords._run("verify", wait, None)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(passwords.PoolBusy):
+            await passwords.verify_async("hunter2", "hunter2")
+        release.set()
+        await asyncio.gather(*running)
+        # room again once the others finish
+        assert (await passwords.verify_async("scrypt-less", "scrypt-less"))[0]
+
+    asyncio.run(main())
+
+
+def login(email: str, password: str) -> httpx.Response:
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return await client.post("/auth/login", json={"email": email, "password": password})
+
+    return asyncio.run(post())
+
+
+def test_login_upgrades_plaintext_row(session, organization):
+    session.get(schema.User, "user-1").password = "hunter2"
+    session.commit()
+    assert login("ada@example.com", "hunter2").json()["status"] is True
+    session.expire_all()
+    stored = session.get(schema.User, "user-1").password
+    assert passwords.is_hashed(stored)
+    assert login("ada@example.com", "hunter2").json()["status"] is True
+    assert session.get(schema.User, "user-1").password == stored
+
+
+def test_login_answers_503_when_the_pool_is_full(session, organization, monkeypatch):
+    monkeypatch.setattr(passwords, "_in_flight", passwords.PASSWORD_WORKERS + passwords.PASSWORD_QUEUE)
+    response = login("ada@example.com", "hunter2")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
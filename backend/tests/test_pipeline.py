@@ -0,0 +1,36 @@
+"""
+process_queued over a batch in which one document fails.
+"""
+import asyncio
+import pipeline
+import schema
+
+
+def test_failed_document_does_not_stop_the_batch(session, add_documents, monkeypatch):
+    ids = add_documents(3, status=schema.DocumentStatus.QUEUED, processing_stage=pipeline.RAW_STORED)
+    ran = []
+
+    async def process_document(db, document, user_id, raw=None):
+        ran.append(document.id)
+        pipeline.checkpoint(db, document, pipeline.EXTRACTED)
+        if document.id == ids[1]:
+            raise RuntimeError("Landing AI is down")
+        document.status = schema.DocumentStatus.COMPLETE
+        db.commit()
+
+    monkeypatch.setattr(pipeline, "process_document", process_document)
+    failed_before = pipeline.queued_outcomes.values.get(("failed",), 0)
+
+    processed = asyncio.run(pipeline.process_queued(session, "org-1"))
+
+    assert processed == 2
+    assert ran == ids
+    assert pipeline.queued_outcomes.values[("failed",)] == failed_before + 1
+    session.expire_all()
+    documents = {document.id: document for document in session.query(schema.Document)}
+    assert documents[ids[0]].status == documents[ids[2]].status == schema.DocumentStatus.COMPLETE
+    # back in the queue, keeping the stage it got to, with a version a stale bulk change won't match
+    failed = documents[ids[1]]
+    assert failed.status == schema.DocumentStatus.QUEUED
+    assert failed.processing_stage == pipeline.EXTRACTED
+    assert failed.version == 3
@@ -0,0 +1,78 @@
+"""
+recovery.resume when a file the pipeline needs has gone missing.
+"""
+import asyncio
+import os
+import pytest
+import pipeline
+import recovery
+import schema
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    """ A pipeline that reads the raw upload or the saved extraction like the real one; returns the stages it ran from. """
+    calls = []
+
+    async def process_document(session, document, user_id, raw=None):
+        calls.append(document.processing_stage)
+        # a FileNotFoundError that has nothing to do with the upload
+        if document.link == "flaky":
+            raise FileNotFoundError("a temp file of the extraction client")
+        if pipeline.reached(document, pipeline.EXTRACTED):
+            pipeline.load_extraction(document.id)
+        elif not pipeline.reached(document, pipeline.RAW_STORED):
+            open(pipeline.local_path(document.id), "rb").close()
+        document.status = schema.DocumentStatus.COMPLETE
+        session.commit()
+
+    monkeypatch.setattr(pipeline, "process_document", process_document)
+    return calls
+
+
+def resume(session, add_documents, **columns) -> tuple:
+    document_id = add_documents(1, status=schema.DocumentStatus.PENDING, **columns)[0]
+    document = session.get(schema.Document, document_id)
+    outcome = asyncio.run(recovery.resume(session, document, "user-1"))
+    session.expire_all()
+    return outcome, session.get(schema.Document, document_id)
+
+
+def test_missing_extraction_is_extracted_again(session, add_documents, stages):
+    outcome, document = resume(
+        session, add_documents, s3_key="s3://bucket/raw.pdf", processing_stage=pipeline.EXTRACTED
+    )
+    assert outcome == "resumed"
+    assert stages == [pipeline.EXTRACTED, pipeline.RAW_STORED]
+    assert document.status == schema.DocumentStatus.COMPLETE
+
+
+def test_upload_missing_everywhere_is_lost(session, add_documents, stages, monkeypatch):
+    monkeypatch.setattr(recovery, "s3_object_exists", lambda bucket, key: False)
+    outcome, document = resume(session, add_documents, s3_key="s3://bucket/raw.pdf", link="flaky",
+                               processing_stage=pipeline.RAW_STORED)
+    assert outcome == "lost"
+    assert document.processing_stage == pipeline.LOST
+
+
+def test_upload_still_in_s3_is_not_lost(session, add_documents, stages, monkeypatch):
+    heads = []
+    monkeypatch.setattr(recovery, "s3_object_exists", lambda bucket, key: heads.append(key) or True)
+    outcome, document = resume(session, add_documents, s3_key="s3://bucket/raw.pdf", link="flaky",
+                               processing_stage=pipeline.RAW_STORED)
+    assert outcome == "failed"
+    assert heads == ["raw.pdf"]
+    assert document.processing_stage == pipeline.RAW_STORED
+
+
+def test_upload_still_in_data_is_not_lost(session, add_documents, stages, monkeypatch):
+    monkeypatch.setattr(recovery, "s3_object_exists", lambda bucket, key: pytest.fail("no HEAD needed"))
+    os.makedirs("data", exist_ok=True)
+    with open(pipeline.local_path("doc-0"), "wb") as f:
+        f.write(b"%PDF-1.4")
+    try:
+        outcome, document = resume(session, add_documents, link="flaky", processing_stage=pipeline.RECEIVED)
+    finally:
+        os.remove(pipeline.local_path("doc-0"))
+    assert outcome == "failed"
+    assert document.processing_stage == pipeline.RECEIVED
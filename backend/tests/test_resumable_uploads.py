@@ -0,0 +1,42 @@
+"""
+Sweeping expired resumable uploads.
+"""
+import os
+import time
+import threading
+import resumable_uploads
+
+SIZE = resumable_uploads.MIN_CHUNK_SIZE * 2
+
+
+def age(store, upload_id: str, seconds: float):
+    path = os.path.join(store.root, upload_id)
+    then = time.time() - seconds
+    for entry in (path, os.path.join(path, "chunks")):
+        os.utime(entry, (then, then))
+
+
+def test_expired_uploads_are_purged_in_the_background(tmp_path, monkeypatch):
+    store = resumable_uploads.UploadStore(str(tmp_path))
+    stale = store.create("user-1", "org-1", "form.pdf", "other", SIZE)["upload_id"]
+    fresh = store.create("user-1", "org-1", "form.pdf", "other", SIZE)["upload_id"]
+    age(store, stale, resumable_uploads.UPLOAD_TTL_SECONDS + 60)
+    purges = []
+    purge = store.purge_expired
+    monkeypatch.setattr(store, "purge_expired", lambda: purges.append(threading.current_thread()) or purge())
+    monkeypatch.setattr(store, "purged_at", None)
+
+    thread = store.purge_in_background()
+    thread.join()
+    assert purges == [thread] and thread is not threading.current_thread()
+    assert sorted(os.listdir(tmp_path)) == [fresh]
+
+
+def test_purge_runs_at_most_once_per_interval(tmp_path, monkeypatch):
+    store = resumable_uploads.UploadStore(str(tmp_path))
+    assert store.purge_in_background() is not None
+    # creating an upload doesn't sweep again until the interval has passed
+    store.create("user-1", "org-1", "form.pdf", "other", SIZE)
+    assert store.purge_in_background() is None
+    monkeypatch.setattr(store, "purged_at", time.monotonic() - resumable_uploads.UPLOAD_PURGE_INTERVAL_SECONDS - 1)
+    assert store.purge_in_background() is not None
@@ -0,0 +1,129 @@
+"""
+Each review tier against a stub OpenAI-compatible model endpoint (see
+benchmarks/review_tiers.py for the same stub under load).
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import llm_placeholder
+import review
+
+COMPLETE = "Employee Name: Jane Doe\nDate: 2024-01-02\nSignature: J. Doe\nPosition: Nurse\n"
+# every field filled in, but the expiry date is before the issue date
+WRONG_VALUE = "Employee Name: Jane Doe\nIssued: 2024-01-02\nExpires: 2023-01-02\nSignature: J. Doe\n"
+BLANK_SIGNATURE = "Employee Name: Jane Doe\nDate: 2024-01-02\nSignature: ____\n"
+# blank optional fields whose labels only contain a required word inside another word
+BLANK_LOOKALIKES = "Employee Name: Jane Doe\nCandidate ID: \nUsername: \nUpdated by: \n"
+PROSE = "I confirm that I have read the handbook."
+
+
+class StubModel(BaseHTTPRequestHandler):
+    """ Answers each model with the verdict the test set for it, and records the calls. """
+    verdicts = {}
+    calls = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.calls.append(body["model"])
+        verdict = self.verdicts[body["model"]]
+        if isinstance(verdict, int):
+            self.send_response(verdict)
+            self.end_headers()
+            return
+        payload = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps(verdict)}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def model(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubModel)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(llm_placeholder, "LLM_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1/")
+    monkeypatch.setattr(llm_placeholder, "GEMINI_API_KEY", "stub")
+    llm_placeholder.get_client.cache_clear()
+    StubModel.verdicts = {
+        llm_placeholder.SMALL_MODEL: {"correct": True, "reasoning": "Every field is filled in.", "confidence": 0.95},
+        llm_placeholder.MODEL: {"correct": False, "reasoning": "The supervisor did not sign."},
+    }
+    StubModel.calls = []
+    yield StubModel
+    server.shutdown()
+    server.server_close()
+    llm_placeholder.get_client.cache_clear()
+
+
+def test_heuristics_reject_blank_required_field(model):
+    verdict, tier = review.review_document(BLANK_SIGNATURE)
+    assert (tier, verdict.correct) == (review.HEURISTICS, False)
+    assert "Signature" in verdict.reasoning
+    assert model.calls == []
+
+
+def test_heuristics_never_approve_filled_form(model):
+    assert review.heuristic_verdict(WRONG_VALUE) is None
+    model.verdicts[llm_placeholder.SMALL_MODEL] = {
+        "correct": False, "reasoning": "The certificate expires before it was issued.", "confidence": 0.97
+    }
+    verdict, tier = review.review_document(WRONG_VALUE)
+    assert (tier, verdict.correct) == (review.SMALL, False)
+    assert model.calls == [llm_placeholder.SMALL_MODEL]
+
+
+def test_required_fields_match_whole_words():
+    scan = review.scan_form(BLANK_LOOKALIKES)
+    assert scan.blank == ["Candidate ID", "Username", "Updated by"]
+    assert scan.required_blank == []
+    assert review.heuristic_verdict(BLANK_LOOKALIKES) is None
+
+
+def test_small_model_decides_confident_verdict(model):
+    verdict, tier = review.review_document(PROSE)
+    assert (tier, verdict.correct) == (review.SMALL, True)
+    assert model.calls == [llm_placeholder.SMALL_MODEL]
+
+
+@pytest.mark.parametrize("small", [
+    {"correct": True, "reasoning": "Every field is filled in.", "confidence": 0.4},
+    {"correct": True, "reasoning": "The signature is illegible.", "confidence": 0.95},
+    500,
+])
+def test_large_model_decides_escalated_verdict(model, small):
+    model.verdicts[llm_placeholder.SMALL_MODEL] = small
+    verdict, tier = review.review_document(BLANK_LOOKALIKES)
+    assert (tier, verdict.correct) == (review.LARGE, False)
+    assert verdict.reasoning == "The supervisor did not sign."
+    assert model.calls[-1] == llm_placeholder.MODEL
+
+
+def test_tiers_and_thresholds_are_configurable(model):
+    config = review.ReviewConfig(tiers=("heuristics", "large"), required_fields=("position",), escalate_below=0.99)
+    verdict, tier = review.review_document(BLANK_SIGNATURE, config)
+    assert tier == review.LARGE
+    assert model.calls == [llm_placeholder.MODEL]
+
+    model.calls.clear()
+    config = review.ReviewConfig(tiers=("small", "large"), escalate_below=0.99)
+    _, tier = review.review_document(COMPLETE, config)
+    assert tier == review.LARGE
+    assert model.calls == [llm_placeholder.SMALL_MODEL, llm_placeholder.MODEL]
+
+
+def test_last_tier_always_answers(model):
+    config = review.ReviewConfig(tiers=("heuristics",))
+    verdict, tier = review.review_document(PROSE, config)
+    assert (tier, verdict.correct) == (review.HEURISTICS, False)
+    assert model.calls == []
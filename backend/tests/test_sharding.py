@@ -0,0 +1,118 @@
+"""
+TenantRouter: opening, migrating and evicting tenant shards, and copying an organization into one.
+"""
+import asyncio
+import os
+import threading
+import time
+import pytest
+from sqlalchemy import inspect, insert, select
+import database
+import schema
+import sharding
+from write_queue import WriterClosed
+
+
+@pytest.fixture
+def router(tmp_path):
+    """ A sharding router over a scratch directory that keeps two shards open; returns (router, init_db calls). """
+    calls = []
+
+    def init_db(bind):
+        calls.append(threading.current_thread())
+        # slow enough that racing openers overlap
+        time.sleep(0.05)
+        return database.init_db(bind)
+
+    router = sharding.TenantRouter(
+        sharding.Shard(database.engine, database.SessionLocal, database.writer), "organization",
+        str(tmp_path / "shards"), database.create_db_engine, init_db, cache_size=2,
+    )
+    yield router, calls
+    router.close()
+
+
+def test_concurrent_opens_migrate_once(router):
+    router, calls = router
+    shards = []
+    threads = [threading.Thread(target=lambda: shards.append(router.shard_for("org-a"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len({id(shard) for shard in shards}) == 1
+    assert database.get_schema_version(shards[0].engine) == database.SCHEMA_VERSION
+
+
+def test_open_migrates_off_the_event_loop(router):
+    router, calls = router
+
+    async def main():
+        return await router.open("org-a"), threading.current_thread()
+
+    shard, loop_thread = asyncio.run(main())
+    assert shard is router.shard_for("org-a")
+    assert calls and calls[0] is not loop_thread
+
+
+def test_shard_migrations_run_on_old_shards(router):
+    router, _ = router
+    # a shard from schema version 11 still holding a copied password
+    engine = database.create_db_engine(f"sqlite:///{router.shard_path('org-a')}")
+    os.makedirs(router.shard_dir, exist_ok=True)
+    with engine.begin() as conn:
+        database.Base.metadata.create_all(bind=conn)
+        conn.execute(insert(schema.Organization.__table__), [{"id": "org-a", "name": "A"}])
+        conn.execute(insert(schema.User.__table__), [{
+            "id": "user-a", "first_name": "A", "last_name": "A", "email": "a@example.com", "password": "secret",
+            "role": schema.Role.ADMIN, "permission": schema.Permission.ADMIN, "organization_id": "org-a",
+        }])
+        database.set_schema_version(conn, 11)
+    engine.dispose()
+
+    shard = router.shard_for("org-a")
+    assert database.get_schema_version(shard.engine) == database.SCHEMA_VERSION
+    with shard.engine.connect() as conn:
+        assert conn.execute(select(schema.User.password)).scalar() == ""
+    assert "document_id" in {column["name"] for column in inspect(shard.engine).get_columns("idempotency_keys")}
+
+
+def test_evicted_shard_hands_over_its_writer(router):
+    router, calls = router
+    evicted = router.shard_for("org-a")
+    router.submit("org-a", lambda session: session.add(schema.Organization(id="org-a", name="A"))).result()
+    router.shard_for("org-b")
+    router.shard_for("org-c")
+    assert "org-a" not in router.shards
+    # a request still holding the evicted shard can't start a second writer on its file
+    with pytest.raises(WriterClosed):
+        evicted.writer.submit(lambda session: None)
+    # ...while the router reopens it once the old writer has stopped
+    rename = lambda session: session.get(schema.Organization, "org-a").__setattr__("name", "A2")
+    asyncio.run(router.run("org-a", rename))
+    assert evicted.writer.thread is None
+    assert len(calls) == 4
+    with router.session_for("org-a") as session:
+        assert session.get(schema.Organization, "org-a").name == "A2"
+
+
+def test_copy_organization(session, add_documents, tmp_path):
+    add_documents(2)
+    session.get(schema.User, "user-1").password = "scrypt$hash"
+    session.add(schema.Organization(id="org-2", name="Other"))
+    session.commit()
+    target = database.create_db_engine(f"sqlite:///{tmp_path / 'org-1.db'}")
+    database.init_db(target)
+
+    counts = sharding.copy_organization(database.Base.metadata, database.engine, target, "org-1")
+    assert (counts["organizations"], counts["users"], counts["folders"], counts["documents"]) == (1, 1, 1, 2)
+    with target.connect() as conn:
+        assert conn.execute(select(schema.Organization.id)).scalars().all() == ["org-1"]
+        # password hashes stay in the directory database
+        assert conn.execute(select(schema.User.password)).scalar() == ""
+    # copying again over the same shard replaces rather than duplicates
+    assert sharding.copy_organization(database.Base.metadata, database.engine, target, "org-1", replace=True) == counts
+    with target.connect() as conn:
+        assert len(conn.execute(select(schema.Document.id)).all()) == 2
+    target.dispose()